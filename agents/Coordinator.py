@@ -2,7 +2,7 @@
 #
 # ROLE
 # - Orchestrate the agent workflow in a strict order:
-#     Surveyor -> HasherPacker -> Scribe
+#     Surveyor -> HasherPacker -> Scribe (-> Verifier with --verify)
 #
 # WHY A COORDINATOR EXISTS
 # - DFABS is based on a hybrid BDI agent architecture, being the coordinator the orchestration agent.
@@ -13,54 +13,167 @@
 # - Each agent reads/writes JSON messages to bus/
 # Design notes:
 # - Demonstrates complete workflow core functionality of DFABS as per design document DFABS Group D.
+# - Pipeline mode (--pipeline): Surveyor and HasherPacker run at the same time, connected by a bounded
+#   queue (backpressure), so hashing starts with the first discovered file. The bus messages are still
+#   written at the end of each stage, the audit trail is the same as in the sequential run.
+# - Multi-case mode (--cases): several case configs run at the same time. Each case gets its own
+#   bus_dir/<case_id> and output_dir/<case_id>, so wipe_bus() only ever clears that case's messages,
+#   and the running cases share a fixed I/O/CPU worker budget in equal slices.
+# - Every stage runs inside an instrument.py span: STAGE records (wall/CPU time, I/O bytes, files/s,
+#   peak RSS) and a RUN_SUMMARY record per case; --profile adds cProfile dumps per stage.
+# - Queue mode (queue_workers > 0): the discovery report is split into work shards on the bus, several
+#   HasherPacker worker processes claim them with lease files, and the Coordinator merges the per-shard
+#   results into one HashResult (workqueue.py). Extra workers can join from other hosts sharing the bus.
 
-import sys
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import Surveyor
 import HasherPacker
 import Scribe
+import Verifier
 
-from common import ensure_dir, read_json, write_json, make_message, append_runlog
+from common import close_runlog, configure_runlog, ensure_dir, iter_records, read_json, read_message, record_count, throughput, write_json, make_message, append_runlog
+from checkpoint import STATE_NAME as CHECKPOINT_STATE
+from hashcache import evict
+import workqueue
+from instrument import Spans
 
 
 def wipe_bus(bus_dir: Path):
     # Keep demos repeatable
     if not bus_dir.exists():
         return
-    for p in bus_dir.glob("*.json"):
+    for p in list(bus_dir.glob("*.json")) + list(bus_dir.glob("*.jsonl")):
         try:
             p.unlink()
         except Exception:
             pass
 
 
-def main():
-    base = Path(__file__).parent
-    cfg_path = base / "config.json"
-    if len(sys.argv) == 2:
-        cfg_path = Path(sys.argv[1])
+_END = object()
+
+
+def run_pipelined(config: dict, base: Path, log_path: Path):
+    # Returns the name of the failed stage, or None.
+    q = queue.Queue(maxsize=max(1, int(config.get("pipeline_queue_size", 1024))))
+    status = {"Surveyor": False}
+    t0 = time.perf_counter()
+
+    def survey():
+        try:
+            status["Surveyor"] = Surveyor.run(config, base, emit=q.put)
+        finally:
+            status["discover_seconds"] = time.perf_counter() - t0
+            q.put(_END)
+
+    producer = threading.Thread(target=survey, name="Surveyor", daemon=True)
+    producer.start()
+    try:
+        hashed = HasherPacker.pack(config, base, iter(q.get, _END))
+    finally:
+        # If HasherPacker stopped early, keep draining so the Surveyor thread is never blocked on put().
+        while producer.is_alive():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    append_runlog(
+        log_path,
+        "Coordinator",
+        "PIPELINE",
+        {
+            "queue_size": q.maxsize,
+            "discover_seconds": round(status["discover_seconds"], 6),
+            "discover_and_hash_seconds": round(time.perf_counter() - t0, 6),
+        },
+    )
+    if not status["Surveyor"]:
+        return "Surveyor"
+    if not hashed:
+        return "HasherPacker"
+    return None
 
-    config = read_json(cfg_path)
 
+def run_queue(config: dict, base: Path, log_path: Path):
+    # Returns the name of the failed stage, or None.
     bus = base / config["bus_dir"]
-    out = base / config["output_dir"]
-    ensure_dir(bus)
-    ensure_dir(out)
+    discovery = read_message(bus / "10_discovery_report.json")["content"]
+    shards = workqueue.split(bus, config["case_id"], iter_records(bus, discovery, "files"), int(config.get("queue_shard_files", 1000)))
+    if shards == 0:
+        return None if HasherPacker.run(config, base) else "HasherPacker"
 
-    case_id = config["case_id"]
-    log_path = out / f"runlog_{case_id}.jsonl"
+    t0 = time.perf_counter()
+    workers = max(1, int(config.get("queue_workers", 1)))
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=HasherPacker.work, args=(config, base), name=f"HasherPacker-{i}") for i in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    # Shards of workers that died are finished here, once their leases have gone stale.
+    HasherPacker.work(config, base)
 
-    wipe_bus(bus)
+    try:
+        content, stats = workqueue.merge(bus, config.get("bus_format", "json"))
+    except (OSError, ValueError) as e:
+        print(f"Coordinator ERROR: cannot merge work shards: {e}")
+        return "HasherPacker"
 
-    append_runlog(log_path, "Coordinator", "TASK_START", {"case_id": case_id})
+    msg = make_message(
+        sender="Coordinator",
+        receiver="Scribe",
+        msg_type="HashResult",
+        conversation_id=config["case_id"],
+        content=content,
+        performative="INFORM",
+    )
+    write_json(bus / "20_hash_result.json", msg)
+    append_runlog(
+        log_path,
+        "Coordinator",
+        "QUEUE_MERGE",
+        {
+            "work_shards": shards,
+            "workers": workers,
+            "files": record_count(content, "files"),
+            "worker_exit_codes": [p.exitcode for p in procs],
+            "reclaimed": sum(1 for st in stats if st["gen"] > 1),
+            "seconds": round(time.perf_counter() - t0, 6),
+        },
+    )
+    return None
+
+
+def _hash_totals(bus: Path) -> tuple:
+    # (files, bytes) of the HashResult, 0/0 when the run stopped before HasherPacker finished.
+    msg = bus / "20_hash_result.json"
+    if not msg.exists():
+        return 0, 0
+    content = read_message(msg)["content"]
+    files = 0
+    nbytes = 0
+    for r in iter_records(bus, content, "files"):
+        files += 1
+        nbytes += int(r.get("size") or 0)
+    return files, nbytes
 
+
+def task_request(config: dict) -> dict:
     # Task request message: mirrors how an agent system can carry “intent” and constraints.
-    task = make_message(
+    return make_message(
         sender="Coordinator",
         receiver="Surveyor",
         msg_type="TaskRequest",
-        conversation_id=case_id,
+        conversation_id=config["case_id"],
         content={
             "allowed_roots": config["allowed_roots"],
             "allowed_extensions": config["allowed_extensions"],
@@ -69,28 +182,288 @@ def main():
         },
         performative="REQUEST",
     )
-    write_json(bus / "00_task_request.json", task)
+
+
+def run_case(config: dict, base: Path, pipeline: bool = False, close_case: bool = False, resume: bool = False, profile: bool = False) -> bool:
+    # One complete case: TaskRequest -> Surveyor -> HasherPacker -> Scribe. Returns True on success.
+    # resume: keep the bus of an interrupted run, reuse its discovery report and continue HasherPacker
+    # from its last checkpoint (a run without a discovery report simply starts over).
+    # Every stage is measured (instrument.py): STAGE records per stage, RUN_SUMMARY at the end.
+    bus = base / config["bus_dir"]
+    out = base / config["output_dir"]
+    ensure_dir(bus)
+    ensure_dir(out)
+
+    case_id = config["case_id"]
+    log_path = out / f"runlog_{case_id}.jsonl"
+    try:
+        configure_runlog(log_path, config)
+    except ValueError as e:
+        print(f"Coordinator ERROR: {e}")
+        return False
+    spans = Spans(
+        log_path,
+        profile_dir=out / f"profile_{case_id}" if profile or config.get("profile", False) else None,
+        trace_memory=bool(config.get("trace_memory", False)),
+    )
+    ok = False
+    try:
+        ok = _run_stages(config, base, log_path, spans, pipeline, close_case, resume)
+    finally:
+        spans.summary(case_id, ok)
+        close_runlog(log_path)
+    return ok
+
+
+def _run_stages(config: dict, base: Path, log_path: Path, spans: Spans, pipeline: bool, close_case: bool, resume: bool) -> bool:
+    bus = base / config["bus_dir"]
+    case_id = config["case_id"]
+
+    resume = resume and (bus / "10_discovery_report.json").exists()
+    if resume:
+        return _resume_case(config, base, log_path, spans, close_case)
+
+    wipe_bus(bus)
+
+    append_runlog(log_path, "Coordinator", "TASK_START", {"case_id": case_id})
+    write_json(bus / "00_task_request.json", task_request(config))
 
     print("Coordinator: DFABS run v0.4")
     print(f"- RunID: {case_id}")
 
-    if not Surveyor.run(config, base):
-        append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "Surveyor"})
-        return
+    # Queue mode needs the complete discovery report to split it, so it takes precedence over pipelining.
+    if (pipeline or config.get("pipeline", False)) and not int(config.get("queue_workers", 0)):
+        with spans.stage("Surveyor+HasherPacker") as span:
+            failed = run_pipelined(config, base, log_path)
+            span.ok = not failed
+        if failed:
+            append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": failed})
+            return False
+    else:
+        with spans.stage("Surveyor") as span:
+            span.ok = Surveyor.run(config, base)
+        if not span.ok:
+            append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "Surveyor"})
+            return False
 
-    if not HasherPacker.run(config, base):
-        append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "HasherPacker"})
-        return
+        with spans.stage("HasherPacker") as span:
+            if int(config.get("queue_workers", 0)) > 0:
+                failed = run_queue(config, base, log_path)
+            else:
+                failed = None if HasherPacker.run(config, base) else "HasherPacker"
+            span.ok = not failed
+        if failed:
+            append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": failed})
+            return False
+
+    return _finish_case(config, base, log_path, spans, close_case)
+
+
+def _resume_case(config: dict, base: Path, log_path: Path, spans: Spans, close_case: bool) -> bool:
+    bus = base / config["bus_dir"]
+    checkpoint = (bus / CHECKPOINT_STATE).exists()
+    hashed = (bus / "20_hash_result.json").exists() and not checkpoint
+    append_runlog(log_path, "Coordinator", "TASK_RESUME", {"case_id": config["case_id"], "checkpoint": checkpoint, "hash_done": hashed})
+
+    print("Coordinator: DFABS run v0.4 (resume)")
+    print(f"- RunID: {config['case_id']}")
 
-    if not Scribe.run(config, base):
+    if not hashed:
+        with spans.stage("HasherPacker") as span:
+            span.ok = HasherPacker.run({**config, "resume": True}, base)
+        if not span.ok:
+            append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "HasherPacker"})
+            return False
+    return _finish_case(config, base, log_path, spans, close_case)
+
+
+def _finish_case(config: dict, base: Path, log_path: Path, spans: Spans, close_case: bool) -> bool:
+    case_id = config["case_id"]
+    out = base / config["output_dir"]
+    with spans.stage("Scribe") as span:
+        span.ok = Scribe.run(config, base)
+    if not span.ok:
         append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "Scribe"})
-        return
+        return False
+
+    if config.get("verify_archive", False):
+        with spans.stage("Verifier") as span:
+            span.ok = Verifier.run(config, base)
+        if not span.ok:
+            append_runlog(log_path, "Coordinator", "TASK_FAIL", {"stage": "Verifier"})
+            return False
 
     append_runlog(log_path, "Coordinator", "TASK_END", {"case_id": case_id})
 
+    if close_case:
+        # Closed case: incremental re-runs are no longer expected, drop the hash cache.
+        append_runlog(log_path, "Coordinator", "CACHE_EVICT", {"case_id": case_id, "removed": evict(out, case_id)})
+
     print("Coordinator: finished OK (DFABS)")
     print(f"- Output folder: {out}")
     print(f"- Run log: {log_path}")
+    return True
+
+
+def case_namespace(config: dict) -> dict:
+    # Scheduled cases never share a bus: bus_dir/<case_id> and output_dir/<case_id>.
+    case_id = config["case_id"]
+    return {**config, "bus_dir": str(Path(config["bus_dir"]) / case_id), "output_dir": str(Path(config["output_dir"]) / case_id)}
+
+
+def _worker_share(config: dict, io_share: int, cpu_share: int, pipeline: bool = False) -> dict:
+    # Cap the per-case pools at the case's share of the budget. I/O threads (traversal, hashing) default
+    # to the full share; process compression stays off unless the case config asked for it.
+    # Pools that run at the same time split the share between them:
+    # - pipeline mode: traversal and hashing threads together (half each by default)
+    # - queue mode: queue_workers processes, each with its own hashing threads and compression processes
+    # - merkle_workers threads run inside every hashing thread
+    # verify_workers run after hashing and get the whole share. Each pool keeps at least one worker.
+    config = dict(config)
+    queue = int(config.get("queue_workers", 0))
+    pipelined = (pipeline or config.get("pipeline", False)) and not queue
+    survey_share = max(1, io_share // 2) if pipelined else io_share
+    config["survey_workers"] = min(int(config.get("survey_workers", survey_share)), survey_share)
+    hash_share = io_share - config["survey_workers"] if pipelined else io_share
+    if queue > 0:
+        config["queue_workers"] = queue = min(queue, io_share)
+        hash_share //= queue
+        cpu_share //= queue
+    hash_share = max(1, hash_share)
+    config["hash_workers"] = min(int(config.get("hash_workers", hash_share)), hash_share)
+    if int(config.get("compress_workers", 0)) > 0:
+        config["compress_workers"] = min(int(config["compress_workers"]), max(1, cpu_share))
+    if int(config.get("merkle_chunk_bytes", 0)) > 0:
+        config["merkle_workers"] = min(int(config.get("merkle_workers", 4)), max(1, hash_share // max(1, config["hash_workers"])))
+    config["verify_workers"] = min(int(config.get("verify_workers", 4)), io_share)
+    return config
+
+
+def run_cases(configs: list, base: Path, max_cases: int = 2, io_workers: int = 4, cpu_workers: int = 0,
+              pipeline: bool = False, close_case: bool = False, resume: bool = False) -> dict:
+    # Run several cases at once. At most max_cases run concurrently, admitted in the order given (FIFO),
+    # and each running case gets an equal slice of the I/O and CPU worker budget, so the total number of
+    # threads/processes stays bounded however many cases are queued. Returns {case_id: True/False}.
+    # The split is a static partition, fixed before the first case starts: a case never grows into the
+    # share of a case that has finished or is still waiting (e.g. the last case of a batch runs alone on
+    # io_workers // max_cases threads). The agents size their pools once per stage, so a shared token pool
+    # would bound the active workers but not the threads; lower max_cases for batches with one large case.
+    ids = [c["case_id"] for c in configs]
+    dupes = sorted({i for i in ids if ids.count(i) > 1})
+    if dupes:
+        raise ValueError(f"duplicate case_id in schedule: {', '.join(dupes)}")
+
+    max_cases = max(1, min(int(max_cases), len(configs) or 1))
+    io_share = max(1, int(io_workers) // max_cases)
+    cpu_share = max(1, int(cpu_workers or os.cpu_count() or 1) // max_cases)
+    submitted = time.perf_counter()
+
+    def one(config: dict) -> bool:
+        config = _worker_share(case_namespace(config), io_share, cpu_share, pipeline)
+        bus = base / config["bus_dir"]
+        out = base / config["output_dir"]
+        ensure_dir(out)
+        log_path = out / f"runlog_{config['case_id']}.jsonl"
+        waited = time.perf_counter() - submitted
+        append_runlog(
+            log_path,
+            "Coordinator",
+            "CASE_SCHEDULED",
+            {
+                "case_id": config["case_id"],
+                "queue_wait_seconds": round(waited, 6),
+                "max_cases": max_cases,
+                "survey_workers": config["survey_workers"],
+                "hash_workers": config["hash_workers"],
+                "compress_workers": int(config.get("compress_workers", 0)),
+                "merkle_workers": config.get("merkle_workers"),
+                "verify_workers": config["verify_workers"],
+                "queue_workers": int(config.get("queue_workers", 0)),
+            },
+        )
+        t0 = time.perf_counter()
+        try:
+            ok = run_case(config, base, pipeline=pipeline, close_case=close_case, resume=resume)
+        except Exception as e:
+            print(f"ERROR: case {config['case_id']} crashed: {e}")
+            ok = False
+        seconds = time.perf_counter() - t0
+        files, nbytes = _hash_totals(bus)
+        rate = throughput(nbytes, seconds)
+        append_runlog(
+            log_path,
+            "Coordinator",
+            "CASE_STATUS",
+            {
+                "case_id": config["case_id"],
+                "status": "ok" if ok else "failed",
+                "files": files,
+                "files_per_s": round(files / seconds, 3) if seconds > 0 else None,
+                **rate,
+            },
+        )
+        close_runlog(log_path)
+        return ok
+
+    with ThreadPoolExecutor(max_workers=max_cases, thread_name_prefix="case") as pool:
+        futures = [(c["case_id"], pool.submit(one, c)) for c in configs]
+        return {case_id: f.result() for case_id, f in futures}
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="DFABS Coordinator")
+    ap.add_argument("config", nargs="?", help="config file (default: config.json next to this script)")
+    ap.add_argument("--verify-all", action="store_true", help="ignore the hash cache and re-read every file (cache is refreshed)")
+    ap.add_argument("--close-case", action="store_true", help="evict the case hash cache after a successful run")
+    ap.add_argument("--pipeline", action="store_true", help="hash while the Surveyor is still discovering")
+    ap.add_argument("--verify", action="store_true", help="re-hash the archived entries against the manifest after the report (Verifier)")
+    ap.add_argument("--resume", action="store_true", help="continue an interrupted run from its last HasherPacker checkpoint")
+    ap.add_argument("--profile", action="store_true", help="write a cProfile dump per stage to output/profile_<case_id>/")
+    ap.add_argument("--cases", nargs="+", metavar="CONFIG", help="run several case configs concurrently (isolated bus/output per case)")
+    ap.add_argument("--max-cases", type=int, default=2, help="cases running at the same time (with --cases)")
+    ap.add_argument("--io-workers", type=int, default=4, help="traversal/hashing threads, split statically: each running case gets io-workers // max-cases")
+    ap.add_argument("--cpu-workers", type=int, default=0, help="compression processes, split statically like --io-workers (default: CPU count)")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base = Path(__file__).parent
+
+    if args.cases:
+        configs = []
+        for p in args.cases:
+            config = read_json(Path(p))
+            if args.verify_all:
+                config["verify_all"] = True
+            if args.verify:
+                config["verify_archive"] = True
+            if args.profile:
+                config["profile"] = True
+            configs.append(config)
+        results = run_cases(
+            configs,
+            base,
+            args.max_cases,
+            args.io_workers,
+            args.cpu_workers,
+            pipeline=args.pipeline,
+            close_case=args.close_case,
+            resume=args.resume,
+        )
+        for case_id, ok in results.items():
+            print(f"- {case_id}: {'OK' if ok else 'FAILED'}")
+        return
+
+    cfg_path = Path(args.config) if args.config else base / "config.json"
+
+    config = read_json(cfg_path)
+    if args.verify_all:
+        config["verify_all"] = True
+    if args.verify:
+        config["verify_archive"] = True
+
+    run_case(config, base, pipeline=args.pipeline, close_case=args.close_case, resume=args.resume, profile=args.profile)
 
 
 if __name__ == "__main__":
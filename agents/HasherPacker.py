@@ -2,20 +2,59 @@
 #
 # ROLE
 # - Agent that takes the forensic matching files (and under policy), computes a SHA fingerprints and archives it.
-# - Compute SHA-256 hashes (integrity)
+# - Compute SHA-256 hashes (integrity), plus optional extra digests (md5, sha1, blake2b, ...) from the same read
 # - Create a ZIP preservation archive copy of each evidence file
 #
 # Design notes:
 # - Demonstrates complete workflow core functionality of DFABS as per design document DFABS Group D.
 # - ZIP is used because it is widely available and easy to demonstrate.
 # - The ZIP entry names include relative paths to avoid name collisions.
-# - No SQLlite in this version.
+# - Archive writing lives in archive.py (single writer, optional shards, precompressed entries).
+# - Optional checkpoints (checkpoint.py) let an interrupted run resume where it stopped (Coordinator --resume).
+# - Queue worker mode (work(), python3 HasherPacker.py --worker): claims work shards from bus/queue/
+#   with leases (workqueue.py), several worker processes or hosts can share one case.
+# - Known-file sets (knownhashes.py, "known_hashes"): files found in a reference hash set are recorded
+#   as known, but not archived.
+# - Read scheduling (iosched.py, "read_order"/"read_fadvise"): files are read in disk order within a
+#   window and with page cache hints; archive and HashResult keep the discovery order.
+# - The incremental hash cache (hashcache.py, "hash_cache") is a SQLite file in output_dir.
 
+import itertools
+import os
 import sys
+import tempfile
+import time
 import zipfile
+import zlib
+from functools import partial
 from pathlib import Path
 
-from common import ensure_dir, read_json, write_json, make_message, sha256_file, append_runlog
+from archive import METHOD_NAMES, EvidenceArchive, PreviousArchives, choose_compression, compression_policy, compressor_for, zinfo_state
+from checkpoint import Checkpoint
+from merkle import MerkleBuilder, has_tree, hash_file_tree, leaves_dir, store_tree
+
+from common import (
+    DEFAULT_BUFFER_SIZE,
+    RecordSink,
+    ensure_dir,
+    iter_records,
+    read_json,
+    read_message,
+    write_json,
+    make_message,
+    iter_file_chunks,
+    hash_algorithms,
+    hash_file,
+    new_hashers,
+    ordered_map,
+    append_runlog,
+    configure_runlog,
+    throughput,
+)
+from hashcache import HashCache, cache_path
+from iosched import prefetch, read_scheduler
+from knownhashes import open_known
+from workqueue import attempt_config, claim, complete, discard_attempt, new_worker_id, pending, queue_dir
 
 
 def _zip_name(item: dict) -> str:
@@ -26,80 +65,737 @@ def _zip_name(item: dict) -> str:
     return f"{root_name}/{rel_path}".replace("\\", "/")
 
 
+def _peek_chunks(p: Path, buffer_size: int, use_mmap: bool = False, sequential: bool = False):
+    # Returns (first chunk, iterator over all chunks including the first), so the compression
+    # method can be chosen from the first block without reading it twice.
+    chunks = iter_file_chunks(p, buffer_size=buffer_size, use_mmap=use_mmap, sequential=sequential)
+    first = next(chunks, None)
+    if first is None:
+        return b"", iter(())
+    return first, itertools.chain([first], chunks)
+
+
+def _read_sample(p: Path, nbytes: int) -> bytes:
+    with p.open("rb") as f:
+        return f.read(nbytes)
+
+
+def _tree_builder(merkle: dict, size: int):
+    # Merkle tree only for files of at least merkle_min_bytes (None when tree hashing is off).
+    if merkle is None or size < merkle["min_bytes"]:
+        return None
+    return MerkleBuilder(merkle["chunk_bytes"])
+
+
+def _hash_and_archive(archive: EvidenceArchive, p: Path, arcname: str, ext: str, algorithms: list, policy: dict, buffer_size: int, use_mmap: bool, merkle: dict = None, sequential: bool = False, check=None):
+    # Single-pass mode: each chunk is read once and fed to the hashers and the ZIP entry stream.
+    # The recorded digests are therefore computed over exactly the bytes that were archived.
+    # check(digests) runs before the entry is completed and returns (known set, duplicate); when either is
+    # set the entry is rolled back and zinfo is None. Returns (digests, nbytes, zinfo, verdict).
+    zinfo = zipfile.ZipInfo.from_file(p, arcname=arcname)
+    hashers = new_hashers(algorithms)
+    tree = _tree_builder(merkle, zinfo.file_size)
+    nbytes = 0
+    first, chunks = _peek_chunks(p, buffer_size, use_mmap, sequential)
+    zinfo.compress_type = choose_compression(ext, first, policy)
+    with archive.open_entry(zinfo) as dst:
+        for chunk in chunks:
+            for h in hashers.values():
+                h.update(chunk)
+            if tree is not None:
+                tree.update(chunk)
+            dst.write(chunk)
+            nbytes += len(chunk)
+        digests = {name: h.hexdigest() for name, h in hashers.items()}
+        if tree is not None:
+            digests["merkle"] = store_tree(merkle["leaves_dir"], tree.tree())
+        verdict = check(digests) if check is not None else (None, False)
+        if any(verdict):
+            dst.discard()
+    return digests, nbytes, None if dst.discarded else zinfo, verdict
+
+
+def _hash_job(it: dict, algorithms: list, policy: dict, buffer_size: int, use_mmap: bool, merkle: dict = None, sequential: bool = False):
+    # Worker pool job: read and hash one file, and pick its compression method.
+    # Workers never touch the archive, the single writer in run() appends entries in discovery order.
+    # Huge files (merkle_min_bytes) are tree-hashed: their chunks are read and hashed on merkle_workers threads.
+    p = Path(it["path"])
+    if not p.exists():
+        return None
+    t0 = time.perf_counter()
+    try:
+        if merkle is not None and p.stat().st_size >= merkle["min_bytes"]:
+            digests, tree = hash_file_tree(p, algorithms, chunk_size=merkle["chunk_bytes"], workers=merkle["workers"])
+            digests["merkle"] = store_tree(merkle["leaves_dir"], tree)
+        else:
+            digests = hash_file(p, algorithms, buffer_size=buffer_size, use_mmap=use_mmap, sequential=sequential)
+        # The sample is only read when the policy needs it (auto mode, extension not in the tables).
+        compress_type = choose_compression(it.get("ext") or p.suffix, lambda: _read_sample(p, policy["sample_bytes"]), policy)
+    except Exception as e:
+        return {"error": str(e)}
+    return {"digests": digests, "nbytes": p.stat().st_size, "seconds": time.perf_counter() - t0, "compress_type": compress_type}
+
+
+def _compress_job(it: dict, algorithms: list, policy: dict, buffer_size: int, staging_dir: str, spill_bytes: int, merkle: dict = None, sequential: bool = False):
+    # Process pool job (precompressed mode): one read feeds the hashers, the CRC and the compressor.
+    # Compressed output is kept in memory up to spill_bytes, then spilled to a staging file,
+    # so a worker never holds a whole large file. The writer copies the result into the ZIP as-is.
+    p = Path(it["path"])
+    if not p.exists():
+        return None
+    t0 = time.perf_counter()
+    spill = None
+    try:
+        zinfo = zipfile.ZipInfo.from_file(p, arcname=_zip_name(it))
+        hashers = new_hashers(algorithms)
+        tree = _tree_builder(merkle, zinfo.file_size)
+        first, chunks = _peek_chunks(p, buffer_size, sequential=sequential)
+        zinfo.compress_type = choose_compression(it.get("ext") or p.suffix, first, policy)
+        compressor = compressor_for(zinfo.compress_type)
+        crc = 0
+        nbytes = 0
+        held = bytearray()
+
+        def emit(data):
+            nonlocal spill
+            held.extend(data)
+            if len(held) >= spill_bytes:
+                if spill is None:
+                    spill = tempfile.NamedTemporaryFile(dir=staging_dir, suffix=".part", delete=False)
+                spill.write(held)
+                del held[:]
+
+        for chunk in chunks:
+            for h in hashers.values():
+                h.update(chunk)
+            if tree is not None:
+                tree.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            nbytes += len(chunk)
+            emit(compressor.compress(chunk) if compressor else chunk)
+        if compressor:
+            emit(compressor.flush())
+
+        if spill is not None:
+            spill.write(held)
+            spill.close()
+            held = None
+    except Exception as e:
+        if spill is not None:
+            spill.close()
+            os.unlink(spill.name)
+        return {"error": str(e)}
+
+    digests = {name: h.hexdigest() for name, h in hashers.items()}
+    if tree is not None:
+        digests["merkle"] = store_tree(merkle["leaves_dir"], tree.tree())
+    return {
+        "digests": digests,
+        "nbytes": nbytes,
+        "seconds": time.perf_counter() - t0,
+        "zinfo": zinfo,
+        "crc": crc,
+        "data": bytes(held) if held is not None else None,
+        "spill": spill.name if spill is not None else None,
+    }
+
+
+def _precompressed_chunks(job: dict, buffer_size: int):
+    if job["data"] is not None:
+        yield job["data"]
+        return
+    with open(job["spill"], "rb") as f:
+        while True:
+            data = f.read(buffer_size)
+            if not data:
+                break
+            yield data
+
+
+def _file_key(it: dict):
+    # (dev, inode, size, mtime_ns) for the hash cache, from the Surveyor record when available.
+    try:
+        return (it["dev"], it["inode"], it["size"], it["mtime_ns"])
+    except KeyError:
+        pass
+    try:
+        st = os.stat(it["path"])
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _route_job(job_fn, it: dict):
+    # Pool entry point. Cache hits are resolved by the writer, their files are not read at all.
+    # "_prefetch" (read scheduling): start the readahead of the file this worker reads next.
+    if "_cached" in it:
+        return {"cached": it["_cached"]}
+    if "_prefetch" in it:
+        prefetch(it["_prefetch"])
+    return job_fn(it)
+
+
+def _copy_cached(archive: EvidenceArchive, previous: PreviousArchives, hit: dict, arcname: str) -> zipfile.ZipInfo:
+    # Unchanged file: copy the compressed entry from the previous archive, no read of the evidence file.
+    old, chunks = previous.raw_entry(hit["zip_name"], hit["arcname"])
+    zinfo = zipfile.ZipInfo(arcname, date_time=old.date_time)
+    zinfo.external_attr = old.external_attr
+    zinfo.compress_type = old.compress_type
+    return archive.write_precompressed(zinfo, chunks, old.CRC, old.file_size, old.compress_size)
+
+
+def _exists_job(it: dict):
+    # Single-pass mode hashes inside the writer, so the pool only filters out missing files.
+    return {} if Path(it["path"]).exists() else None
+
+
+def _first_archived(records: list, kept: int) -> int:
+    # Index of the record that wrote archive entry number `kept` (records and entries share their order).
+    n = 0
+    for i, r in enumerate(records):
+        if "arcname" in r and not r.get("duplicate"):
+            if n == kept:
+                return i
+            n += 1
+    return len(records)
+
+
+def _kept_counters(records: list, entries: list, state: dict) -> dict:
+    # HASH_AND_ZIP counters of the kept part of a checkpoint (resume that drops archive output).
+    hashed_bytes = 0
+    copied_bytes = 0
+    compression = {}
+    for r in records:
+        if "error" in r:
+            continue
+        if r.get("from_cache"):
+            copied_bytes += r.get("size", 0)
+        else:
+            hashed_bytes += r.get("size", 0)
+        if r.get("known") or r.get("duplicate"):
+            stats = compression.setdefault("known" if r.get("known") else "duplicate", {"files": 0, "bytes_in": 0, "bytes_out": 0})
+            stats["files"] += 1
+            stats["bytes_in"] += r.get("size", 0)
+    for e in entries:
+        stats = compression.setdefault(METHOD_NAMES.get(e["compress_type"], str(e["compress_type"])), {"files": 0, "bytes_in": 0, "bytes_out": 0})
+        stats["files"] += 1
+        stats["bytes_in"] += e["file_size"]
+        stats["bytes_out"] += e["compress_size"]
+    seconds = state["hash_seconds"] * hashed_bytes / state["hashed_bytes"] if state["hashed_bytes"] else 0.0
+    return {"hashed_bytes": hashed_bytes, "hash_seconds": seconds, "copied_bytes": copied_bytes, "compression": compression}
+
+
 def run(config: dict, base_dir: Path) -> bool:
     bus = base_dir / config["bus_dir"]
     out = base_dir / config["output_dir"]
     ensure_dir(bus)
     ensure_dir(out)
 
-    case_id = config["case_id"]
-    log_path = out / f"runlog_{case_id}.jsonl"
-
     discovery_path = bus / "10_discovery_report.json"
     if not discovery_path.exists():
         print("HasherPacker ERROR: missing discovery message (run Coordinator first).")
         return False
 
-    discovery = read_json(discovery_path)
-    items = discovery.get("content", {}).get("files", [])
+    # Inline records (bus_format "json") are parsed straight into a compact RecordStore.
+    content = read_message(discovery_path).get("content", {})
+    items = iter_records(bus, content, "files")
+    return pack(config, base_dir, items)
 
-    zip_path = out / f"evidence_{case_id}.zip"
 
-    results = []
+def pack(config: dict, base_dir: Path, items) -> bool:
+    # Hash + archive an iterable of discovery records and write the HashResult message.
+    # `items` is consumed lazily, so it can be fed by a running Surveyor (Coordinator pipeline mode).
+    bus = base_dir / config["bus_dir"]
+    out = base_dir / config["output_dir"]
+    ensure_dir(bus)
+    ensure_dir(out)
+
+    case_id = config["case_id"]
+    log_path = out / f"runlog_{case_id}.jsonl"
+    # Queue attempts (workqueue.attempt_config) write their own archive but log to the case runlog.
+    attempt = config.get("queue_attempt")
+    archive_id = f"{case_id}-{attempt}" if attempt else case_id
 
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+    # Streaming hash tuning, buffer size can be adjusted per storage type (see runlog throughput).
+    buffer_size = int(config.get("hash_buffer_bytes", DEFAULT_BUFFER_SIZE))
+    use_mmap = bool(config.get("hash_use_mmap", False))
+    single_pass = bool(config.get("single_pass_archive", False))
+    compress_workers = int(config.get("compress_workers", 0))
+
+    try:
+        algorithms = hash_algorithms(config.get("hash_algorithms"))
+        policy = compression_policy(config)
+        results = RecordSink(bus, "20_hash_result.json", "files", config.get("bus_format", "json"))
+        scheduler = read_scheduler(config)
+    except ValueError as e:
+        print(f"HasherPacker ERROR: {e}")
+        return False
+
+    # Tree hashing for huge files (merkle.py): whole-file digests plus a Merkle tree of fixed-size chunks.
+    # Records carry the root, the leaves go to the leaves store.
+    merkle = None
+    if int(config.get("merkle_chunk_bytes", 0)) > 0:
+        merkle = {
+            "chunk_bytes": int(config["merkle_chunk_bytes"]),
+            "min_bytes": int(config.get("merkle_min_bytes", 1024 * 1024 * 1024)),
+            "workers": max(1, int(config.get("merkle_workers", 4))),
+            "leaves_dir": str(leaves_dir(out)),
+        }
+
+    # Known-file sets: memory-mapped indexes, checked once a file's digests are known.
+    try:
+        known = open_known(config, base_dir, algorithms)
+    except ValueError as e:
+        print(f"HasherPacker ERROR: {e}")
+        return False
+    known_sets = known.names if known is not None else []
+
+    # Archive modes:
+    # - two_pass (default): hash on the worker pool, then ZipFile.write() re-reads the file
+    # - single_pass: the writer reads each file once, hashing while writing the entry (sequential)
+    # - precompressed: a process pool reads once, hashes and compresses; the writer only appends bytes
+    # In every mode a single writer appends archive entries and results in discovery order.
+    staging = out / f".staging_{archive_id}"
+    sequential = scheduler is not None and scheduler.fadvise
+    if compress_workers > 0:
+        mode = "precompressed"
+        workers = compress_workers
+        ensure_dir(staging)
+        job_fn = partial(
+            _compress_job,
+            algorithms=algorithms,
+            policy=policy,
+            buffer_size=buffer_size,
+            staging_dir=str(staging),
+            spill_bytes=int(config.get("compress_spill_bytes", 8 * 1024 * 1024)),
+            merkle=merkle,
+            sequential=sequential,
+        )
+    elif single_pass:
+        mode = "single_pass"
+        workers = 1
+        job_fn = _exists_job
+    else:
+        mode = "two_pass"
+        workers = max(1, int(config.get("hash_workers", 1)))
+        job_fn = partial(_hash_job, algorithms=algorithms, policy=policy, buffer_size=buffer_size, use_mmap=use_mmap, merkle=merkle, sequential=sequential)
+
+    # Checkpoint/resume: every checkpoint_every_files items (or checkpoint_every_seconds) the records,
+    # archive entries and end offset so far are saved on the bus. With config["resume"] the run continues
+    # after the last checkpoint and ends with the same HashResult as an uninterrupted run.
+    checkpoint = Checkpoint(bus, int(config.get("checkpoint_every_files", 0)), float(config.get("checkpoint_every_seconds", 0)))
+    resumed = checkpoint.load() if config.get("resume", False) else None
+    if resumed is not None:
+        state = resumed[0]
+        if (
+            state["archive_mode"] != mode
+            or state["hash_algorithms"] != algorithms
+            or bool(state["dedup"]) != bool(config.get("dedup_archive", False))
+            or state.get("known_sets", []) != known_sets
+        ):
+            print("HasherPacker ERROR: checkpoint was written with different settings, cannot resume (start a fresh run).")
+            if known is not None:
+                known.close()
+            return False
+    checkpoint.start(resumed is not None)
+    if staging.exists():
+        # Spill files of an interrupted run.
+        for part in staging.glob("*.part"):
+            part.unlink()
+
+    # Incremental re-runs: unchanged files (same dev/inode/size/mtime) reuse cached digests and are
+    # copied raw from the previous archive. verify_all forces a full re-read but refreshes the cache.
+    cache = None
+    previous = None
+    verify_all = bool(config.get("verify_all", False))
+    if config.get("hash_cache", False):
+        cache = HashCache(
+            cache_path(out, archive_id),
+            float(config.get("hash_cache_max_age_days", 0)),
+            run_id=resumed[0]["cache_run_id"] if resumed else None,
+        )
+        previous = PreviousArchives(out, archive_id, rotate=resumed is None)
+
+    # Content dedup: each unique SHA-256 is stored once, later copies reference the stored entry.
+    # Every file is still read once in single-pass/precompressed modes: a single-pass entry is rolled back
+    # when its digest turns out to be stored already, precompressed bytes of a duplicate are dropped.
+    # stored: raw SHA-256 -> (arcname, shard) of the first copy, kept only with dedup.
+    dedup = bool(config.get("dedup_archive", False))
+    stored = {}
+
+    def classify(digests: dict):
+        # (known set or None, duplicate) of a file's content.
+        known_set = known.match(digests) if known is not None else None
+        return known_set, known_set is None and dedup and bytes.fromhex(digests["sha256"]) in stored
+
+    def annotate(items):
+        # Runs on the writer thread (as ordered_map pulls items), which owns the SQLite connection.
         for it in items:
-            p = Path(it["path"])
-            if not p.exists():
+            if cache is not None and not verify_all:
+                key = _file_key(it)
+                hit = cache.lookup(*key, algorithms) if key else None
+                if hit and merkle is not None and key[2] >= merkle["min_bytes"]:
+                    # Cached without a tree (or with another chunk size, or its leaves are gone): hash it again.
+                    tree = hit["digests"].get("merkle", {})
+                    if tree.get("chunk_bytes") != merkle["chunk_bytes"] or not has_tree(merkle["leaves_dir"], tree):
+                        hit = None
+                if hit and previous.has(hit["zip_name"], hit["arcname"]):
+                    it = dict(it, _cached=hit)
+            yield it
+
+    hashed_bytes = 0
+    hash_seconds = 0.0
+    copied_bytes = 0
+    compression_stats = {}
+    t_start = time.perf_counter()
+    first_result_seconds = None
+
+    archive = EvidenceArchive(
+        out,
+        archive_id,
+        compression=zipfile.ZIP_DEFLATED,
+        max_entries=int(config.get("archive_shard_max_entries", 0)),
+        max_bytes=int(config.get("archive_shard_max_bytes", 0)),
+    )
+
+    def record(r: dict, zinfo: zipfile.ZipInfo = None):
+        results.append(r)
+        checkpoint.add(r, {"shard": archive.shard_index, **zinfo_state(zinfo)} if zinfo is not None else None)
+
+    def checkpoint_state() -> dict:
+        return {
+            "case_id": case_id,
+            "done": done,
+            "archive": archive.state(),
+            "archive_mode": mode,
+            "hash_algorithms": algorithms,
+            "dedup": dedup,
+            "known_sets": known_sets,
+            "cache_run_id": cache.run_id if cache is not None else None,
+            "hashed_bytes": hashed_bytes,
+            "hash_seconds": hash_seconds,
+            "copied_bytes": copied_bytes,
+            "compression": compression_stats,
+        }
+
+    done = 0
+    if resumed is not None:
+        state, records, entries = resumed
+        kept = archive.resume(state["archive"], entries)
+        if kept < len(entries):
+            # Archive output that does not match the checkpoint is written again, from the item of the
+            # first dropped entry on. Counters are rebuilt from what is kept.
+            cut = _first_archived(records, kept)
+            print(f"HasherPacker: {archive.rewound['shard']} does not match the checkpoint ({archive.rewound['reason']}), resuming from item {cut}.")
+            records = records[:cut]
+            entries = entries[:kept]
+            state = dict(state, done=cut, **_kept_counters(records, entries, state))
+            # Cache rows of the dropped items may point to entries that are gone: read everything again.
+            verify_all = True
+        for r in records:
+            results.append(r)
+            if dedup and "error" not in r and not r.get("duplicate") and not r.get("known"):
+                stored.setdefault(bytes.fromhex(r["sha256"]), (r["arcname"], r.get("shard", 0)))
+        done = state["done"]
+        hashed_bytes = state["hashed_bytes"]
+        hash_seconds = state["hash_seconds"]
+        copied_bytes = state["copied_bytes"]
+        compression_stats = state["compression"]
+        if archive.rewound is not None:
+            checkpoint.rewind(checkpoint_state(), len(records), len(entries))
+        # Skip the items that are already in the archive.
+        items = itertools.islice(items, done, None)
+    resumed_from = done
+
+    with archive:
+        # Read scheduling: each window of read_window items is read in locality order, results stay in discovery order.
+        stream = ordered_map(
+            partial(_route_job, job_fn),
+            annotate(items),
+            workers=workers,
+            processes=(mode == "precompressed"),
+            window=scheduler.window if scheduler is not None else 0,
+            # Single-pass mode reads in the writer after the whole window was planned: prefetch each file itself.
+            order=partial(scheduler.plan, lookahead=workers if mode != "single_pass" else 0) if scheduler is not None else None,
+        )
+        for it, job in stream:
+            if checkpoint.due(done):
+                if cache is not None:
+                    cache.commit()
+                checkpoint.save(checkpoint_state())
+            done += 1
+            if first_result_seconds is None:
+                first_result_seconds = time.perf_counter() - t_start
+            if job is None:
                 continue
 
-            try:
-                digest = sha256_file(p)
-            except Exception as e:
+            p = Path(it["path"])
+            arcname = _zip_name(it)
+            from_cache = "cached" in job
+            if from_cache:
+                job = {"digests": job["cached"]["digests"], "nbytes": 0, "seconds": 0.0, "cached": job["cached"]}
+
+            if "error" in job:
                 # Keep the PoC moving: log the failure and continue.
-                results.append({"path": str(p), "sha256": "", "error": str(e)})
+                record({"path": str(p), **{a: "" for a in algorithms}, "error": job["error"]})
                 continue
 
-            arcname = _zip_name(it)
-            z.write(p, arcname=arcname)
+            digests = job.get("digests")
+            known_set, duplicate = classify(digests) if digests is not None else (None, False)
+            zinfo = None
+
+            # Write the archive entry, the job content tells which path produced it:
+            # cached -> raw copy, {} -> single pass, compress_type -> ZipFile.write, zinfo -> precompressed.
+            # Precompressed jobs of known and duplicate files were compressed before the digest was known, their bytes are dropped.
+            # Single-pass entries are classified once streamed, and rolled back when they are not kept.
+            if not duplicate and known_set is None:
+                try:
+                    if from_cache:
+                        try:
+                            zinfo = _copy_cached(archive, previous, job["cached"], arcname)
+                            copied_bytes += zinfo.file_size
+                        except Exception:
+                            # Previous archive entry unusable: read the file as this mode reads any other.
+                            from_cache = False
+                            job = job_fn(it) or {"error": "file missing"}
+                    if from_cache or "error" in job:
+                        pass
+                    elif not job:
+                        t0 = time.perf_counter()
+                        digests, nbytes, zinfo, (known_set, duplicate) = _hash_and_archive(
+                            archive, p, arcname, it.get("ext") or p.suffix, algorithms, policy, buffer_size, use_mmap, merkle, sequential, classify
+                        )
+                        job = {"digests": digests, "nbytes": nbytes, "seconds": time.perf_counter() - t0}
+                    elif "compress_type" in job:
+                        zinfo = archive.write_file(p, arcname, compress_type=job["compress_type"])
+                    else:
+                        compress_size = len(job["data"]) if job["data"] is not None else os.path.getsize(job["spill"])
+                        zinfo = archive.write_precompressed(job["zinfo"], _precompressed_chunks(job, buffer_size), job["crc"], job["nbytes"], compress_size)
+                except Exception as e:
+                    job = dict(job, error=str(e))
+
+            if job.get("spill"):
+                os.unlink(job["spill"])
+
+            if "error" in job:
+                record({"path": str(p), **{a: "" for a in algorithms}, "error": job["error"]})
+                continue
+
+            hash_seconds += job["seconds"]
+            hashed_bytes += job["nbytes"]
 
-            results.append(
-                {
+            entry = None
+            if known_set is not None:
+                # Known file (reference set): digests in the manifest, no archive entry.
+                stats = compression_stats.setdefault("known", {"files": 0, "bytes_in": 0, "bytes_out": 0})
+                stats["files"] += 1
+                stats["bytes_in"] += it.get("size", 0)
+                r = {
                     "path": str(p),
                     "ext": it.get("ext", ""),
                     "size": it.get("size", 0),
-                    "sha256": digest,
+                    **job["digests"],
+                    "known": known_set,
+                }
+            elif duplicate:
+                # Manifest reference: the content is stored once, under the first copy's entry.
+                first_arcname, shard = stored[bytes.fromhex(job["digests"]["sha256"])]
+                entry = {"arcname": first_arcname, "shard": shard, "zip_path": archive.shards[shard]["zip_path"]}
+                stats = compression_stats.setdefault("duplicate", {"files": 0, "bytes_in": 0, "bytes_out": 0})
+                stats["files"] += 1
+                stats["bytes_in"] += it.get("size", 0)
+                r = {
+                    "path": str(p),
+                    "ext": it.get("ext", ""),
+                    "size": it.get("size", 0),
+                    **job["digests"],
+                    "arcname": entry["arcname"],
+                    "duplicate": True,
+                }
+            else:
+                entry = {"arcname": arcname, "shard": archive.shard_index, "zip_path": archive.shards[-1]["zip_path"]}
+                if dedup:
+                    stored.setdefault(bytes.fromhex(job["digests"]["sha256"]), (arcname, entry["shard"]))
+                method = METHOD_NAMES.get(zinfo.compress_type, str(zinfo.compress_type))
+                stats = compression_stats.setdefault(method, {"files": 0, "bytes_in": 0, "bytes_out": 0})
+                stats["files"] += 1
+                stats["bytes_in"] += zinfo.file_size
+                stats["bytes_out"] += zinfo.compress_size
+                r = {
+                    "path": str(p),
+                    "ext": it.get("ext", ""),
+                    "size": it.get("size", 0),
+                    **job["digests"],
                     "arcname": arcname,
+                    "compression": method,
+                    "compress_ratio": round(zinfo.compress_size / zinfo.file_size, 4) if zinfo.file_size else None,
                 }
-            )
+            if archive.sharded and entry is not None:
+                r["shard"] = entry["shard"]
+            if from_cache:
+                r["from_cache"] = True
+            record(r, zinfo)
+            if scheduler is not None and not from_cache:
+                scheduler.done(str(p))
+
+            if cache is not None and entry is not None:
+                key = _file_key(it)
+                if key:
+                    cache.store(*key, str(p), job["digests"], Path(entry["zip_path"]).name, entry["arcname"])
+
+    if staging.exists():
+        try:
+            staging.rmdir()
+        except OSError:
+            pass
+
+    known_stats = None
+    if known is not None:
+        known_stats = known.stats()
+        known.close()
+
+    cache_stats = None
+    if cache is not None:
+        cache_stats = {"hits": cache.hits, "misses": cache.misses, "copied_bytes": copied_bytes, "verify_all": verify_all}
+        cache.close()
+        previous.close()
+
+    wall_seconds = time.perf_counter() - t_start
+    zip_path = archive.zip_path
 
     msg = make_message(
         sender="HasherPacker",
         receiver="Scribe",
         msg_type="HashResult",
         conversation_id=case_id,
-        content={"files": results, "zip_path": str(zip_path)},
+        content={
+            "files": results.value(),
+            "zip_path": str(zip_path),
+            "single_pass": mode != "two_pass",
+            "archive_mode": mode,
+            "shards": archive.shards,
+            "hash_algorithms": algorithms,
+            "dedup": dedup,
+            "merkle_chunk_bytes": merkle["chunk_bytes"] if merkle else None,
+            "known_sets": known_sets or None,
+        },
         performative="INFORM",
     )
     msg_path = bus / "20_hash_result.json"
     write_json(msg_path, msg)
+    checkpoint.clear()
 
-    append_runlog(log_path, "HasherPacker", "HASH_AND_ZIP", {"files": len(results), "zip": zip_path.name})
+    append_runlog(
+        log_path,
+        "HasherPacker",
+        "HASH_AND_ZIP",
+        {
+            "files": results.count,
+            "queue_attempt": attempt,
+            "zip": zip_path.name,
+            "buffer_bytes": buffer_size,
+            "mmap": use_mmap,
+            "archive_mode": mode,
+            "shards": len(archive.shards),
+            "hash_algorithms": algorithms,
+            "hash_workers": workers,
+            "compression": compression_stats,
+            "unique_contents": len(stored) if dedup else None,
+            "merkle": merkle,
+            "hash_cache": cache_stats,
+            "known_hashes": known_stats,
+            "read_schedule": scheduler.stats() if scheduler is not None else None,
+            # hash_throughput: per-worker hashing rate (summed hash time), stage_throughput: wall clock incl. ZIP.
+            "hash_throughput": throughput(hashed_bytes, hash_seconds),
+            "stage_throughput": throughput(hashed_bytes, wall_seconds),
+            "files_per_s": round(results.count / wall_seconds, 3) if wall_seconds > 0 else None,
+            "first_result_seconds": round(first_result_seconds, 6) if first_result_seconds is not None else None,
+            "checkpoints": checkpoint.saved,
+            "resumed_from": resumed_from if resumed is not None else None,
+            "resume_rewound": archive.rewound,
+        },
+    )
 
-    print(f"HasherPacker: files={len(results)}")
-    print(f"- {zip_path}")
+    print(f"HasherPacker: files={results.count}")
+    for shard in archive.shards:
+        print(f"- {shard['zip_path']}")
     print(f"- {msg_path}")
     return True
 
 
+def work(config: dict, base_dir: Path, worker_id: str = None) -> int:
+    # Queue worker: claim work shards until none is left, hash + archive each one in its own namespace.
+    # Returns the number of shards this worker completed (-1 if there is no queue or the runlog policy is bad).
+    bus = base_dir / config["bus_dir"]
+    out = base_dir / config["output_dir"]
+    q = queue_dir(bus)
+    if not (q / "manifest.json").exists():
+        print("HasherPacker ERROR: missing work queue (run Coordinator with queue_workers first).")
+        return -1
+    # Every attempt logs to the case runlog, with the case's buffering/fsync policy.
+    log_path = out / f"runlog_{config['case_id']}.jsonl"
+    try:
+        configure_runlog(log_path, config)
+    except ValueError as e:
+        print(f"HasherPacker ERROR: {e}")
+        return -1
+
+    shards = read_json(q / "manifest.json")["shards"]
+    worker_id = worker_id or new_worker_id()
+    lease_seconds = float(config.get("queue_lease_seconds", 60))
+    poll_seconds = float(config.get("queue_poll_seconds", 1))
+    completed = 0
+    reclaimed = 0
+    t0 = time.perf_counter()
+    while True:
+        todo = pending(q, shards)
+        if not todo:
+            break
+        lease = None
+        for name in todo:
+            lease = claim(q, name, worker_id, lease_seconds, lease_seconds / 4)
+            if lease is not None:
+                break
+        if lease is None:
+            # Everything left is leased by live workers: wait for them to finish or to go stale.
+            time.sleep(poll_seconds)
+            continue
+
+        reclaimed += lease.gen > 1
+        items = iter_records(q, {"files": {"records": f"{lease.name}.jsonl"}}, "files")
+        try:
+            ok = pack(attempt_config(config, lease.name, lease.gen), base_dir, items)
+        except Exception as e:
+            print(f"HasherPacker ERROR: work shard {lease.name} failed: {e}")
+            ok = False
+        finally:
+            lease.stop()
+        if not lease.lost and complete(q, lease, ok):
+            completed += 1
+        else:
+            discard_attempt(base_dir, config, lease)
+
+    append_runlog(
+        log_path,
+        "HasherPacker",
+        "QUEUE_WORKER",
+        {"worker": worker_id, "shards": completed, "reclaimed": reclaimed, "seconds": round(time.perf_counter() - t0, 6)},
+    )
+    return completed
+
+
 def main():
     base = Path(__file__).parent
+    args = [a for a in sys.argv[1:] if a != "--worker"]
     cfg_path = base / "config.json"
-    if len(sys.argv) == 2:
-        cfg_path = Path(sys.argv[1])
+    if len(args) == 1:
+        cfg_path = Path(args[0])
 
     config = read_json(cfg_path)
-    run(config, base)
+    if "--worker" in sys.argv[1:]:
+        work(config, base)
+    else:
+        run(config, base)
 
 
 if __name__ == "__main__":
@@ -6,14 +6,19 @@
 # Design notes:
 # - CSV is chosen because it is universal for quick human inspection, audits, etc.
 # - The report doubles as a “hash manifest” for this proof-of-concept.
+# - Optional indexed SQLite case database (casedb.py, report_formats ["sqlite"]), filled from the same
+#   record stream as the CSV; the CSV itself is then an optional export (leave "csv" out of report_formats).
 # 
 # - Demonstrates complete workflow core functionality of DFABS as per design document DFABS Group D.
 
+import contextlib
 import csv
 import sys
+import time
 from pathlib import Path
 
-from common import ensure_dir, read_json, write_json, make_message, append_runlog
+from casedb import CaseDB, db_path
+from common import ensure_dir, iter_records, read_json, read_message, write_json, make_message, append_runlog
 
 
 def run(config: dict, base_dir: Path) -> bool:
@@ -30,39 +35,105 @@ def run(config: dict, base_dir: Path) -> bool:
         print("Scribe ERROR: missing hash result message (run Coordinator first).")
         return False
 
-    msg = read_json(hash_path)
-    files = msg.get("content", {}).get("files", [])
+    msg = read_message(hash_path)
+    content = msg.get("content", {})
+    # Iterated lazily: inline list or JSON Lines record file (bus_format "jsonl").
+    files = iter_records(bus, content, "files")
+    # One column per digest algorithm, in the order HasherPacker computed them.
+    algorithms = content.get("hash_algorithms") or ["sha256"]
+    # Dedup archives: duplicates keep their own row, arcname points at the single stored copy.
+    extra = ["duplicate"] if content.get("dedup") else []
+    # Tree-hashed runs: root of the chunk Merkle tree (empty for files below merkle_min_bytes).
+    if content.get("merkle_chunk_bytes"):
+        extra.append("merkle_root")
+    # Known-file sets: name of the reference set that matched (known files have no archive entry).
+    if content.get("known_sets"):
+        extra.append("known")
+
+    formats = config.get("report_formats", ["csv"])
+    unknown = set(formats) - {"csv", "sqlite"}
+    if unknown or not formats:
+        print(f"Scribe ERROR: unsupported report_formats: {sorted(unknown) or formats}")
+        return False
 
-    report_csv = out / f"report_{case_id}.csv"
-    with report_csv.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["path", "ext", "size", "sha256", "arcname"])
-        w.writeheader()
-        for r in files:
-            w.writerow(
-                {
+    t0 = time.perf_counter()
+    db = None
+    report_csv = out / f"report_{case_id}.csv" if "csv" in formats else None
+    try:
+        if "sqlite" in formats:
+            db = CaseDB(db_path(out, case_id), algorithms, int(config.get("sqlite_batch_rows", 10000)))
+            discovery_path = bus / "10_discovery_report.json"
+            if discovery_path.exists():
+                discovery = read_message(discovery_path, ("files", "deviations")).get("content", {})
+                db.add_discovered(iter_records(bus, discovery, "files"))
+                db.add_deviations(iter_records(bus, discovery, "deviations"))
+
+        with contextlib.ExitStack() as stack:
+            w = None
+            if report_csv is not None:
+                f = stack.enter_context(report_csv.open("w", newline="", encoding="utf-8"))
+                w = csv.DictWriter(f, fieldnames=["path", "ext", "size", *algorithms, "arcname", *extra])
+                w.writeheader()
+            rows = 0
+            for r in files:
+                rows += 1
+                if db is not None:
+                    db.add_file(r)
+                if w is None:
+                    continue
+                row = {
                     "path": r.get("path", ""),
                     "ext": r.get("ext", ""),
                     "size": r.get("size", ""),
-                    "sha256": r.get("sha256", ""),
+                    **{a: r.get(a, "") for a in algorithms},
                     "arcname": r.get("arcname", ""),
                 }
-            )
+                if "duplicate" in extra:
+                    row["duplicate"] = "yes" if r.get("duplicate") else ""
+                if "merkle_root" in extra:
+                    row["merkle_root"] = (r.get("merkle") or {}).get("root", "")
+                if "known" in extra:
+                    row["known"] = r.get("known", "")
+                w.writerow(row)
+    except Exception:
+        if db is not None:
+            db.abort()
+        raise
+
+    if db is not None:
+        db.close({"case_id": case_id, "rows": rows})
 
     done = make_message(
         sender="Scribe",
         receiver="Coordinator",
         msg_type="ReportGenerated",
         conversation_id=case_id,
-        content={"report_csv": str(report_csv), "rows": len(files)},
+        content={
+            "report_csv": str(report_csv) if report_csv else None,
+            "case_db": str(db.path) if db else None,
+            "rows": rows,
+        },
         performative="INFORM",
     )
     done_path = bus / "30_report_generated.json"
     write_json(done_path, done)
 
-    append_runlog(log_path, "Scribe", "REPORT", {"rows": len(files), "report": report_csv.name})
+    append_runlog(
+        log_path,
+        "Scribe",
+        "REPORT",
+        {
+            "rows": rows,
+            "report": report_csv.name if report_csv else None,
+            "case_db": db.path.name if db else None,
+            "seconds": round(time.perf_counter() - t0, 6),
+        },
+    )
 
-    print(f"Scribe: rows={len(files)}")
-    print(f"- {report_csv}")
+    print(f"Scribe: rows={rows}")
+    for p in (report_csv, db.path if db else None):
+        if p is not None:
+            print(f"- {p}")
     print(f"- {done_path}")
     return True
 
@@ -8,16 +8,163 @@
 # - allow-listed roots (stay within evidence folders)
 # - allow-listed extensions (reduce extensions)
 # - max file size / max file count (allows limits on size/amount of files when needed), its not strictly related to the forensic action but for a PoC is very useful at this stage
+#
+# TRAVERSAL
+# - os.scandir based: DirEntry type/stat data is reused, each root is resolved once, extensions are
+#   matched against a precomputed set (no Path object per file).
+# - Directory subtrees can be scanned on a worker pool (survey_workers); results are replayed in a
+#   fixed order (names sorted, files of a directory before its subdirectories), so the output is
+#   deterministic and max_files is applied exactly as in a sequential walk.
+# - max_files keeps the semantics of the original os.walk loop: the count is checked after a file is
+#   recorded, once per root, so max_files=0 still yields the first file of each root (plus the
+#   max_files_reached deviation). Once the cap is hit, running subtree scans stop at their next
+#   directory and queued ones are cancelled.
 
 import csv
 import os
 import sys
+import threading
 from pathlib import Path
 
-from common import ensure_dir, read_json, write_json, make_message, append_runlog
+from common import RecordSink, ensure_dir, read_json, write_json, make_message, append_runlog, ordered_map
+
+
+def _suffix(name: str) -> str:
+    # Same rule as pathlib's Path.suffix, without building a Path.
+    i = name.rfind(".")
+    if 0 < i < len(name) - 1:
+        return name[i:]
+    return ""
+
+
+def _list_dir(dirpath: str):
+    # One scandir call per directory. Symlinked directories are not followed (as os.walk(followlinks=False)).
+    # Unreadable directories are skipped silently, like os.walk's default.
+    try:
+        with os.scandir(dirpath) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return [], []
+    files = []
+    subdirs = []
+    for e in entries:
+        try:
+            is_dir = e.is_dir()
+        except OSError:
+            is_dir = False
+        if not is_dir:
+            files.append(e)
+        elif not e.is_symlink():
+            subdirs.append(e.path)
+    return files, subdirs
+
+
+def _file_events(files: list, scope: dict) -> list:
+    # Applies extension/size policy to one directory's files. Events: ("file", record) / ("deviation", record).
+    events = []
+    root_abs = scope["root"]
+    prefix = root_abs + os.sep
+    for e in files:
+        ext = _suffix(e.name).lower()
+        if ext not in scope["allowed_ext"]:
+            continue
+
+        try:
+            st = e.stat()
+        except OSError as ex:
+            events.append(("deviation", {"path": e.path, "reason": f"stat_failed:{ex}"}))
+            continue
+
+        if st.st_size > scope["max_size"]:
+            events.append(("deviation", {"path": e.path, "reason": "size_limit"}))
+            continue
+
+        # Keep paths predictable for reporting: only symlinks need resolving, the root already is.
+        abs_path = os.path.realpath(e.path) if e.is_symlink() else e.path
+        if abs_path.startswith(prefix):
+            rel_path = abs_path[len(prefix):]
+        else:
+            rel_path = os.path.relpath(abs_path, root_abs)
+
+        events.append(
+            (
+                "file",
+                {
+                    "path": abs_path,
+                    "root": root_abs,
+                    "root_name": scope["root_name"],
+                    "rel_path": rel_path,
+                    "ext": ext,
+                    "size": st.st_size,
+                    # File identity for HasherPacker's incremental hash cache.
+                    "dev": st.st_dev,
+                    "inode": st.st_ino,
+                    "mtime_ns": st.st_mtime_ns,
+                },
+            )
+        )
+    return events
+
 
+def _tasks(dirpath: str, depth: int):
+    # The top `depth` levels are listed here; deeper subtrees become independent scan tasks.
+    files, subdirs = _list_dir(dirpath)
+    yield ("files", files)
+    for d in subdirs:
+        if depth > 1:
+            yield from _tasks(d, depth - 1)
+        else:
+            yield ("tree", d)
 
-def run(config: dict, base_dir: Path) -> bool:
+
+def _run_task(task: tuple, scope: dict) -> list:
+    kind, arg = task
+    if kind == "files":
+        return _file_events(arg, scope)
+    # Whole subtree, depth first in the same order a sequential walk would use.
+    events = []
+    stack = [arg]
+    while stack and not scope["stop"].is_set():
+        files, subdirs = _list_dir(stack.pop())
+        events.extend(_file_events(files, scope))
+        stack.extend(reversed(subdirs))
+    return events
+
+
+def discover(base_dir: Path, allowed_roots: list, allowed_ext: list, max_size: int, max_files: int, workers: int = 1, fanout_depth: int = 1):
+    # Generator of ("file", record) / ("deviation", record) events in final, deterministic order.
+    ext_set = frozenset(e.lower() for e in allowed_ext)
+    found = 0
+    for root_rel in allowed_roots:
+        root = base_dir / root_rel
+        if not root.exists():
+            yield ("deviation", {"path": str(root), "reason": "root_missing"})
+            continue
+
+        root_abs = str(root.resolve())
+        stop = threading.Event()
+        scope = {"root": root_abs, "root_name": os.path.basename(root_abs), "allowed_ext": ext_set, "max_size": max_size, "stop": stop}
+        tasks = _tasks(root_abs, max(1, fanout_depth))
+        scans = ordered_map(lambda t: _run_task(t, scope), tasks, workers=workers)
+        try:
+            for _, events in scans:
+                for kind, rec in events:
+                    yield kind, rec
+                    if kind == "file":
+                        found += 1
+                        if found >= max_files:
+                            yield ("deviation", {"path": str(root), "reason": "max_files_reached"})
+                            break
+                if found >= max_files:
+                    break
+        finally:
+            stop.set()
+            scans.close()
+
+
+def run(config: dict, base_dir: Path, emit=None) -> bool:
+    # emit: optional callback receiving each discovered record as soon as it is found
+    # (Coordinator pipeline mode feeds HasherPacker with it while the walk continues).
     bus = base_dir / config["bus_dir"]
     out = base_dir / config["output_dir"]
     ensure_dir(bus)
@@ -41,61 +188,39 @@ def run(config: dict, base_dir: Path) -> bool:
     max_size = int(task_cfg.get("max_file_size_bytes", config["max_file_size_bytes"]))
     max_files = int(task_cfg.get("max_files", config["max_files"]))
 
-    discovered = []
-    deviations = []
-
-    for root_rel in allowed_roots:
-        root = (base_dir / root_rel)
-        if not root.exists():
-            deviations.append({"path": str(root), "reason": "root_missing"})
-            continue
+    # Records are streamed to the CSV and the message sinks as they are found (nothing is held in
+    # memory with bus_format "jsonl").
+    fmt = config.get("bus_format", "json")
+    try:
+        discovered = RecordSink(bus, "10_discovery_report.json", "files", fmt)
+        deviations = RecordSink(bus, "10_discovery_report.json", "deviations", fmt)
+    except ValueError as e:
+        print(f"Surveyor ERROR: {e}")
+        return False
 
-        for dirpath, _, filenames in os.walk(root, followlinks=False):
-            for fn in filenames:
-                p = Path(dirpath) / fn
-
-
-                if p.suffix.lower() not in allowed_ext:
-                    continue
-
-                try:
-                    st = p.stat()
-                except Exception as e:
-                    deviations.append({"path": str(p), "reason": f"stat_failed:{e}"})
-                    continue
-
-                if st.st_size > max_size:
-                    deviations.append({"path": str(p), "reason": "size_limit"})
-                    continue
-
-                # Keep paths predictable for reporting.
-                abs_path = str(p.resolve())
-                rel_path = os.path.relpath(abs_path, str(root.resolve()))
-                root_name = root.resolve().name
-
-                discovered.append(
-                    {
-                        "path": abs_path,
-                        "root": str(root.resolve()),
-                        "root_name": root_name,
-                        "rel_path": rel_path,
-                        "ext": p.suffix.lower(),
-                        "size": st.st_size,
-                    }
-                )
-
-                if len(discovered) >= max_files:
-                    deviations.append({"path": str(root), "reason": "max_files_reached"})
-                    break
-            if len(discovered) >= max_files:
-                break
+    events = discover(
+        base_dir,
+        allowed_roots,
+        allowed_ext,
+        max_size,
+        max_files,
+        workers=max(1, int(config.get("survey_workers", 1))),
+        fanout_depth=int(config.get("survey_fanout_depth", 1)),
+    )
 
     # Write discovery CSV as a quick human-readable artefact, audit useful.
     discovery_csv = out / f"discovery_{case_id}.csv"
     with discovery_csv.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["path", "root", "root_name", "rel_path", "ext", "size"])
+        w = csv.DictWriter(f, fieldnames=["path", "root", "root_name", "rel_path", "ext", "size", "dev", "inode", "mtime_ns"])
         w.writeheader()
-        w.writerows(discovered)
+        for kind, rec in events:
+            if kind == "file":
+                discovered.append(rec)
+                w.writerow(rec)
+                if emit is not None:
+                    emit(rec)
+            else:
+                deviations.append(rec)
 
     # Write message for next agent.
     msg = make_message(
@@ -103,15 +228,15 @@ def run(config: dict, base_dir: Path) -> bool:
         receiver="HasherPacker",
         msg_type="DiscoveryReport",
         conversation_id=case_id,
-        content={"files": discovered, "deviations": deviations},
+        content={"files": discovered.value(), "deviations": deviations.value()},
         performative="INFORM",
     )
     msg_path = bus / "10_discovery_report.json"
     write_json(msg_path, msg)
 
-    append_runlog(log_path, "Surveyor", "DISCOVERY", {"files": len(discovered), "deviations": len(deviations)})
+    append_runlog(log_path, "Surveyor", "DISCOVERY", {"files": discovered.count, "deviations": deviations.count})
 
-    print(f"Surveyor: files={len(discovered)} deviations={len(deviations)}")
+    print(f"Surveyor: files={discovered.count} deviations={deviations.count}")
     print(f"- {discovery_csv}")
     print(f"- {msg_path}")
     return True
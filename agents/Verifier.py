@@ -0,0 +1,306 @@
+# Verifier.py (DFABS v0.4)
+#
+# ROLE
+# - Agent that checks the evidence archive(s) against the hash manifest (20_hash_result.json and
+#   the report CSV): every archived entry is decompressed and re-hashed, and compared with the
+#   digests HasherPacker recorded.
+# - Reports mismatching, missing and extra entries as a VerificationResult bus message and a VERIFY
+#   runlog action, with throughput.
+#
+# Design notes:
+# - Entries are stream-decompressed straight into the hashers (ZipFile.open + readinto), nothing is
+#   extracted to disk. zipfile also checks each entry's CRC-32 at the end of the stream.
+# - Entries are verified on a worker pool (verify_workers); zlib/bz2/lzma and hashlib release the GIL,
+#   so threads decompress in parallel. Each worker keeps its own open handle per archive.
+# - The HashResult records are streamed twice (archive entries, then the report CSV next to them); only
+#   the recorded digests per archived entry are kept, for the duplicate check.
+# - Duplicate records (dedup_archive) are checked against the stored entry they reference.
+# - Files with a Merkle tree are also checked against its root. On a mismatch the recorded leaves are
+#   loaded from the leaves store (merkle.py) and the damaged chunk indices are reported.
+# - Runs from Coordinator (--verify / "verify_archive": true) or on its own: python3 Verifier.py [config]
+
+import csv
+import itertools
+import sys
+import threading
+import time
+import zipfile
+from functools import partial
+from pathlib import Path
+
+from common import DEFAULT_BUFFER_SIZE, ensure_dir, iter_records, read_json, read_message, write_json, make_message, new_hashers, ordered_map, append_runlog, throughput
+from merkle import MerkleBuilder, diff_trees, leaves_dir, load_tree
+
+
+class _Handles:
+    # One ZipFile per worker thread and archive: the central directory is parsed once, not per entry.
+    def __init__(self):
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def get(self, zip_path: str) -> zipfile.ZipFile:
+        zips = getattr(self._local, "zips", None)
+        if zips is None:
+            zips = self._local.zips = {}
+        if zip_path not in zips:
+            zips[zip_path] = zipfile.ZipFile(zip_path)
+            with self._lock:
+                self._all.append(zips[zip_path])
+        return zips[zip_path]
+
+    def close(self):
+        for z in self._all:
+            z.close()
+        self._all = []
+
+
+def _verify_entry(job: dict, handles: _Handles, algorithms: list, buffer_size: int, leaves: Path = None) -> dict:
+    hashers = new_hashers(algorithms)
+    tree = job.get("merkle")
+    builder = MerkleBuilder(tree["chunk_bytes"]) if tree else None
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    nbytes = 0
+    t0 = time.perf_counter()
+    try:
+        with handles.get(job["zip_path"]).open(job["arcname"]) as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                chunk = view[:n]
+                for h in hashers.values():
+                    h.update(chunk)
+                if builder is not None:
+                    builder.update(chunk)
+                nbytes += n
+    except (OSError, zipfile.BadZipFile, EOFError) as e:
+        # BadZipFile includes "Bad CRC-32" raised when the stream ends.
+        return {"error": str(e), "nbytes": nbytes, "seconds": time.perf_counter() - t0}
+
+    result = {"digests": {a: h.hexdigest() for a, h in hashers.items()}, "nbytes": nbytes, "seconds": time.perf_counter() - t0}
+    if builder is not None:
+        got = builder.tree()
+        if got["root"] != tree["root"]:
+            # None: the recorded leaves are missing or damaged themselves, the chunks cannot be located.
+            try:
+                result["damaged_chunks"] = diff_trees(got, load_tree(leaves, tree))
+            except (OSError, ValueError):
+                result["damaged_chunks"] = None
+    return result
+
+
+def _entries(records, shards: list, names: dict, algorithms: list, stored: dict, missing: list, mismatches: list, references: list):
+    # Archive entries to verify, streamed in archive order from the HashResult records (records and
+    # entries share their order). Only what the duplicate check needs is kept: stored maps
+    # (zip_path, arcname) -> recorded digests (one per algorithm) of each archived entry.
+    # names: zip_path -> entry names not matched yet (None for an unreadable archive).
+    # A duplicate must carry the digests recorded for the entry it references, and that entry is re-hashed
+    # against them, so a damaged stored entry is reported once, under its first copy.
+    for r in records:
+        if r.get("error") or r.get("known"):
+            # Known files (reference hash set) are not archived.
+            continue
+        zip_path = shards[r.get("shard", 0)]["zip_path"]
+        key = (zip_path, r["arcname"])
+        digests = tuple(r[a] for a in algorithms)
+        if r.get("duplicate"):
+            if key not in stored:
+                # Listed before the entry it references: checked once all records are read.
+                references.append((key, r["path"], digests))
+            else:
+                _check_reference(key, r["path"], digests, stored[key], algorithms, mismatches)
+            continue
+        if key in stored:
+            continue
+        stored[key] = digests
+        present = names.get(zip_path, {})
+        if present is None:
+            # Unreadable central directory, reported under errors.
+            continue
+        if r["arcname"] not in present:
+            missing.append({"zip": Path(zip_path).name, "arcname": r["arcname"]})
+            continue
+        del present[r["arcname"]]
+        job = {"zip_path": zip_path, "arcname": r["arcname"], "path": r["path"], **{a: r[a] for a in algorithms}}
+        if r.get("merkle"):
+            job["merkle"] = r["merkle"]
+        yield job
+
+
+def _check_reference(key: tuple, path: str, digests: tuple, stored: tuple, algorithms: list, mismatches: list):
+    # A duplicate against the entry it references, for every algorithm of the run.
+    for a, want, got in zip(algorithms, digests, stored):
+        if want != got:
+            mismatches.append({"zip": Path(key[0]).name, "arcname": key[1], "path": path, "algorithm": a, "expected": want, "actual": got})
+
+
+def _report_mismatches(records, rows, algorithms: list) -> list:
+    # The report CSV against the HashResult, both streamed. Scribe writes one row per record in record
+    # order, so rows normally pair up one to one; a row or record out of step waits in `unmatched` until
+    # its counterpart comes by. What is still unmatched at the end is missing from the other side.
+    mismatches = []
+    unmatched = ({}, {})  # path -> digests, of records / of rows
+
+    def compare(path: str, manifest: dict, report: dict):
+        for a in algorithms:
+            if report[a] != manifest[a]:
+                mismatches.append({"path": path, "algorithm": a, "report": report[a], "manifest": manifest[a]})
+
+    for r, row in itertools.zip_longest(records, rows):
+        if r is not None and row is not None and r.get("path", "") == row.get("path"):
+            compare(row["path"], r, {a: row.get(a, "") for a in algorithms})
+            continue
+        for side, item in enumerate((r, row)):
+            if item is None:
+                continue
+            path = item.get("path", "")
+            digests = {a: item.get(a, "") for a in algorithms}
+            other = unmatched[1 - side]
+            if path in other:
+                manifest, report = (digests, other.pop(path)) if side == 0 else (other.pop(path), digests)
+                compare(path, manifest, report)
+            else:
+                unmatched[side][path] = digests
+    mismatches.extend({"path": path, "missing_from": "report"} for path in unmatched[0])
+    mismatches.extend({"path": path, "missing_from": "manifest"} for path in unmatched[1])
+    return mismatches
+
+
+def run(config: dict, base_dir: Path) -> bool:
+    bus = base_dir / config["bus_dir"]
+    out = base_dir / config["output_dir"]
+    ensure_dir(bus)
+    ensure_dir(out)
+
+    case_id = config["case_id"]
+    log_path = out / f"runlog_{case_id}.jsonl"
+
+    hash_path = bus / "20_hash_result.json"
+    if not hash_path.exists():
+        print("Verifier ERROR: missing hash result message (run Coordinator first).")
+        return False
+
+    content = read_message(hash_path).get("content", {})
+    algorithms = content.get("hash_algorithms") or ["sha256"]
+    shards = content.get("shards") or [{"zip_path": content["zip_path"], "entries": []}]
+
+    # Entry names per archive; the names left once every record was matched are extra entries.
+    # Archives that do not exist are left out, so all their records count as missing.
+    names = {}
+    errors = []
+    for shard in shards:
+        zip_path = shard["zip_path"]
+        if not Path(zip_path).exists():
+            continue
+        try:
+            with zipfile.ZipFile(zip_path) as z:
+                names[zip_path] = dict.fromkeys(z.namelist())
+        except (OSError, zipfile.BadZipFile) as e:
+            # Unreadable central directory: none of this archive's entries can be checked.
+            errors.append({"zip": Path(zip_path).name, "error": str(e)})
+            names[zip_path] = None
+
+    workers = max(1, int(config.get("verify_workers", 4)))
+    buffer_size = int(config.get("hash_buffer_bytes", DEFAULT_BUFFER_SIZE))
+    stored = {}
+    missing = []
+    mismatches = []
+    references = []
+    jobs = _entries(iter_records(bus, content, "files"), shards, names, algorithms, stored, missing, mismatches, references)
+    entries = 0
+    verified = 0
+    nbytes = 0
+    handles = _Handles()
+    t0 = time.perf_counter()
+    try:
+        for job, res in ordered_map(partial(_verify_entry, handles=handles, algorithms=algorithms, buffer_size=buffer_size, leaves=leaves_dir(out)), jobs, workers=workers):
+            entries += 1
+            nbytes += res["nbytes"]
+            where = {"zip": Path(job["zip_path"]).name, "arcname": job["arcname"], "path": job["path"]}
+            if "error" in res:
+                errors.append({**where, "error": res["error"]})
+                continue
+            verified += 1
+            for a in algorithms:
+                if res["digests"][a] != job[a]:
+                    mismatches.append({**where, "algorithm": a, "expected": job[a], "actual": res["digests"][a]})
+            if "damaged_chunks" in res:
+                mismatches.append({**where, "algorithm": "merkle", "damaged_chunks": res["damaged_chunks"]})
+    finally:
+        handles.close()
+    seconds = time.perf_counter() - t0
+
+    # Duplicates listed before their stored entry, and duplicates of an entry no record stored.
+    for key, path, digests in references:
+        if key not in stored:
+            missing.append({"zip": Path(key[0]).name, "arcname": key[1], "path": path})
+        else:
+            _check_reference(key, path, digests, stored[key], algorithms, mismatches)
+    extra = [{"zip": Path(zip_path).name, "arcname": name} for zip_path, left in names.items() if left for name in left]
+
+    # The report CSV is the human-facing manifest: its digests must agree with the HashResult.
+    report_mismatches = []
+    report_csv = out / f"report_{case_id}.csv"
+    if report_csv.exists():
+        with report_csv.open(newline="", encoding="utf-8") as f:
+            report_mismatches = _report_mismatches(iter_records(bus, content, "files"), csv.DictReader(f), algorithms)
+
+    ok = not (mismatches or missing or extra or errors or report_mismatches)
+    msg = make_message(
+        sender="Verifier",
+        receiver="Coordinator",
+        msg_type="VerificationResult",
+        conversation_id=case_id,
+        content={
+            "ok": ok,
+            "entries_verified": verified,
+            "mismatches": mismatches,
+            "missing": missing,
+            "extra": extra,
+            "errors": errors,
+            "report_checked": report_csv.exists(),
+            "report_mismatches": report_mismatches,
+        },
+        performative="INFORM",
+    )
+    msg_path = bus / "40_verification_result.json"
+    write_json(msg_path, msg)
+
+    append_runlog(
+        log_path,
+        "Verifier",
+        "VERIFY",
+        {
+            "ok": ok,
+            "entries": entries,
+            "verified": verified,
+            "mismatches": len(mismatches),
+            "missing": len(missing),
+            "extra": len(extra),
+            "errors": len(errors),
+            "report_mismatches": len(report_mismatches),
+            "verify_workers": workers,
+            "throughput": throughput(nbytes, seconds),
+            "entries_per_s": round(entries / seconds, 3) if seconds > 0 else None,
+        },
+    )
+
+    print(f"Verifier: entries={verified} mismatches={len(mismatches)} missing={len(missing)} extra={len(extra)} errors={len(errors)}")
+    print(f"- {msg_path}")
+    return ok
+
+
+def main():
+    base = Path(__file__).parent
+    cfg_path = base / "config.json"
+    if len(sys.argv) == 2:
+        cfg_path = Path(sys.argv[1])
+
+    config = read_json(cfg_path)
+    sys.exit(0 if run(config, base) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,697 @@
+# archive.py (DFABS v0.4)
+#
+# ROLE
+# - Evidence ZIP writing helpers used by HasherPacker.
+# - One writer object owns the archive(s): entries are appended in the order they are given,
+#   optionally split into several shards (evidence_<case>_part001.zip, ...) by entry count or size.
+# - Entries can be written from precompressed data, so compression can run in worker processes
+#   while a single writer still produces a standard ZIP.
+#
+# Design notes:
+# - Archives are written by _ZipWriter, a small explicit ZIP writer (local header, data, CRC and sizes
+#   patched into the local header, central directory at close, ZIP64 records where needed). zipfile has no
+#   public API for writing already-compressed data or for reopening a partial archive, and its private
+#   write internals change between Python versions; reading (Verifier, PreviousArchives) still uses zipfile.
+#   compressor_for() gives the compressor of each method, so worker processes produce the same entry bytes
+#   as the writer itself.
+# - Entries are all-or-nothing: when writing an entry fails (read error in single-pass mode, broken previous
+#   archive), the file is cut back to the entry's local header, so the archive never holds a partial entry.
+# - Compression policy: the method is chosen per entry (stored/deflate/bzip2/lzma) from an extension
+#   table and a quick trial compression of the first block, so already-compressed evidence is not
+#   deflated again for no gain.
+# - Incremental re-runs: PreviousArchives keeps the last run's archive(s) aside (*.zip.prev) so
+#   unchanged entries can be copied raw (no decompress/recompress) into the new archive.
+# - Resume after a crash: state() describes the archive as written so far (shards, end offset of the
+#   open shard) and zinfo_state() the central-directory data of each entry. resume() verifies the local
+#   headers of those entries and the offset and CRC of each shard's last entry, cuts the partial shard back
+#   to the checkpointed end and keeps appending; the central directory is written from the restored ZipInfos
+#   at close. A shard that does not match the checkpoint is written again from its first entry.
+
+import bz2
+import lzma
+import os
+import struct
+import zipfile
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+
+COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+METHOD_NAMES = {v: k for k, v in COMPRESSION_METHODS.items()}
+
+# Container/media formats that are already compressed internally.
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".7z", ".bz2", ".gz", ".rar", ".xz", ".zip", ".zst",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk",
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp3", ".m4a", ".aac", ".ogg", ".mp4", ".m4v", ".mov", ".mkv", ".avi", ".webm",
+}
+
+
+def _method(name: str) -> int:
+    try:
+        return COMPRESSION_METHODS[str(name).lower()]
+    except KeyError:
+        raise ValueError(f"unsupported compression method: {name}") from None
+
+
+def compression_policy(config: dict) -> dict:
+    # compression_policy: "auto" or a fixed method name ("deflate" keeps the original behaviour).
+    # Plain dict so it can be handed to worker processes.
+    mode = str(config.get("compression_policy", "deflate")).lower()
+    strong = config.get("compression_strong_method")
+    return {
+        "fixed": None if mode == "auto" else _method(mode),
+        "by_extension": {e.lower(): _method(m) for e, m in config.get("compression_by_extension", {}).items()},
+        "strong": _method(strong) if strong else None,
+        "strong_ratio": float(config.get("compression_strong_ratio", 0.25)),
+        "stored_ratio": float(config.get("compression_stored_ratio", 0.95)),
+        "sample_bytes": int(config.get("compression_sample_bytes", 64 * 1024)),
+    }
+
+
+def choose_compression(ext: str, sample, policy: dict) -> int:
+    # sample: first block of the file, or a zero-argument callable returning it (read only if needed).
+    if policy["fixed"] is not None:
+        return policy["fixed"]
+    ext = (ext or "").lower()
+    if ext in policy["by_extension"]:
+        return policy["by_extension"][ext]
+    if ext in INCOMPRESSIBLE_EXTENSIONS:
+        return zipfile.ZIP_STORED
+
+    if callable(sample):
+        sample = sample()
+    sample = sample[: policy["sample_bytes"]]
+    if not sample:
+        return zipfile.ZIP_STORED
+
+    # Fast zlib level 1 trial on the sample as a cheap entropy estimate.
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    if ratio >= policy["stored_ratio"]:
+        return zipfile.ZIP_STORED
+    if policy["strong"] is not None and ratio <= policy["strong_ratio"]:
+        return policy["strong"]
+    return zipfile.ZIP_DEFLATED
+
+
+class _LZMACompressor:
+    # ZIP LZMA entry data: 4-byte header (LZMA SDK version 9.4, properties size), the 5-byte LZMA1
+    # properties, then raw LZMA1 data with end marker. Settings of preset 6 (lc=3, lp=0, pb=2, 8 MiB dictionary).
+    def __init__(self):
+        dict_size = 1 << 23
+        props = bytes([(2 * 5 + 0) * 9 + 3]) + dict_size.to_bytes(4, "little")
+        self._header = struct.pack("<BBH", 9, 4, len(props)) + props
+        self._compressor = lzma.LZMACompressor(
+            lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA1, "lc": 3, "lp": 0, "pb": 2, "dict_size": dict_size}]
+        )
+
+    def compress(self, data):
+        out = self._header + self._compressor.compress(data)
+        self._header = b""
+        return out
+
+    def flush(self):
+        out = self._header + self._compressor.flush()
+        self._header = b""
+        return out
+
+
+def compressor_for(compress_type: int):
+    # Compressor for the entry data of this method (None for ZIP_STORED).
+    if compress_type == zipfile.ZIP_DEFLATED:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    if compress_type == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Compressor()
+    if compress_type == zipfile.ZIP_LZMA:
+        return _LZMACompressor()
+    if compress_type == zipfile.ZIP_STORED:
+        return None
+    raise ValueError(f"unsupported compression method: {compress_type}")
+
+
+def shard_path(out_dir: Path, case_id: str, index: int, sharded: bool) -> Path:
+    if not sharded:
+        return out_dir / f"evidence_{case_id}.zip"
+    return out_dir / f"evidence_{case_id}_part{index + 1:03d}.zip"
+
+
+# ZipInfo fields needed to write the central directory for an entry that is already on disk.
+_ZINFO_FIELDS = (
+    "filename", "compress_type", "create_system", "create_version", "extract_version", "reserved",
+    "flag_bits", "volume", "internal_attr", "external_attr", "header_offset", "CRC", "compress_size", "file_size",
+)
+
+
+def zinfo_state(zinfo: zipfile.ZipInfo) -> dict:
+    d = {k: getattr(zinfo, k) for k in _ZINFO_FIELDS}
+    d["date_time"] = list(zinfo.date_time)
+    d["extra"] = zinfo.extra.hex()
+    d["comment"] = zinfo.comment.hex()
+    return d
+
+
+def zinfo_from_state(d: dict) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(d["filename"], date_time=tuple(d["date_time"]))
+    for k in _ZINFO_FIELDS[1:]:
+        setattr(zinfo, k, d[k])
+    zinfo.extra = bytes.fromhex(d["extra"])
+    zinfo.comment = bytes.fromhex(d["comment"])
+    return zinfo
+
+
+# ZIP records (APPNOTE.TXT), all little endian.
+# Local file header: signature, version needed, flags, method, time, date, crc, compressed size, size,
+# name/extra lengths.
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+# Central directory header: signature, create version/system, extract version, reserved, flags, method,
+# time, date, crc, compressed size, size, name/extra/comment lengths, disk, internal attr, external attr, offset.
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_END = struct.Struct("<4s4H2LH")
+_END64 = struct.Struct("<4sQ2H2L4Q")
+_END64_LOCATOR = struct.Struct("<4sLQL")
+_ZIP64_LOCAL_EXTRA = struct.Struct("<2H2Q")
+
+# Sizes/offsets above this use ZIP64 fields (same limit as zipfile).
+ZIP64_LIMIT = (1 << 31) - 1
+_MAX16 = 0xFFFF
+_MAX32 = 0xFFFFFFFF
+_UTF8_FLAG = 0x800
+_LZMA_EOS_FLAG = 0x02
+_VERSIONS = {zipfile.ZIP_STORED: 20, zipfile.ZIP_DEFLATED: 20, zipfile.ZIP_BZIP2: 46, zipfile.ZIP_LZMA: 63}
+_ZIP64_VERSION = 45
+
+
+def _dos_date_time(date_time) -> tuple:
+    year, month, day, hour, minute, second = date_time[:6]
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _encoded_name(zinfo: zipfile.ZipInfo) -> bytes:
+    # ASCII names as they are, anything else as UTF-8 with the language encoding flag.
+    try:
+        return zinfo.filename.encode("ascii")
+    except UnicodeEncodeError:
+        zinfo.flag_bits |= _UTF8_FLAG
+        return zinfo.filename.encode("utf-8")
+
+
+def _central_record(zinfo: zipfile.ZipInfo) -> bytes:
+    name = _encoded_name(zinfo)
+    file_size, compress_size, offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+    zip64 = []
+    if file_size > ZIP64_LIMIT:
+        zip64.append(file_size)
+        file_size = _MAX32
+    if compress_size > ZIP64_LIMIT:
+        zip64.append(compress_size)
+        compress_size = _MAX32
+    if offset > ZIP64_LIMIT:
+        zip64.append(offset)
+        offset = _MAX32
+    extra = zinfo.extra
+    extract_version = zinfo.extract_version
+    if zip64:
+        extra = struct.pack(f"<2H{len(zip64)}Q", 1, 8 * len(zip64), *zip64) + extra
+        extract_version = max(extract_version, _ZIP64_VERSION)
+    time_, date = _dos_date_time(zinfo.date_time)
+    header = _CENTRAL_HEADER.pack(
+        b"PK\x01\x02", max(zinfo.create_version, extract_version), zinfo.create_system, extract_version, zinfo.reserved,
+        zinfo.flag_bits, zinfo.compress_type, time_, date, zinfo.CRC, compress_size, file_size,
+        len(name), len(extra), len(zinfo.comment), 0, zinfo.internal_attr, zinfo.external_attr, offset,
+    )
+    return header + name + extra + zinfo.comment
+
+
+class _Entry:
+    # Write handle of one entry: compresses (unless the data is precompressed), tracks CRC and sizes.
+    def __init__(self, fp, compressor, raw: bool):
+        self._fp = fp
+        self._compressor = compressor
+        self._raw = raw
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.discarded = False
+
+    def discard(self):
+        # The writer decided against the entry once its data was seen: open_entry() cuts it off again.
+        self.discarded = True
+
+    def write(self, data) -> int:
+        n = len(data)
+        if self._raw:
+            self._write(data)
+            return n
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += n
+        self._write(self._compressor.compress(data) if self._compressor is not None else data)
+        return n
+
+    def _write(self, data):
+        self._fp.write(data)
+        self.compress_size += len(data)
+
+    def flush(self):
+        if self._compressor is not None and not self._raw:
+            self._write(self._compressor.flush())
+            self._compressor = None
+
+
+class _ZipWriter:
+    # One ZIP file on a seekable handle. Entries are appended at `end`; an entry only counts (central
+    # directory, `end`) once finish() has written its CRC and sizes into the local header.
+    def __init__(self, fp, entries: list = (), end: int = 0):
+        self.fp = fp
+        self.entries = list(entries)
+        self.end = end
+        self._central_bytes = sum(len(_central_record(z)) for z in self.entries)
+        self._open = None
+        fp.seek(end)
+
+    def projected_size(self, name: str, data_bytes: int) -> int:
+        # File size after one more entry of data_bytes (headers, ZIP64 fields and end records included).
+        return self.end + self._central_bytes + data_bytes + 2 * len(name.encode("utf-8")) + 256
+
+    def begin(self, zinfo: zipfile.ZipInfo, raw: bool = False) -> _Entry:
+        name = _encoded_name(zinfo)
+        # ZIP64 fields are reserved up front when the entry may pass the limit (as zipfile decides it).
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT
+        if zinfo.compress_type == zipfile.ZIP_LZMA:
+            zinfo.flag_bits |= _LZMA_EOS_FLAG
+        zinfo.extract_version = max(_VERSIONS.get(zinfo.compress_type, 20), _ZIP64_VERSION if zip64 else 20)
+        zinfo.create_version = max(zinfo.create_version, zinfo.extract_version)
+        zinfo.header_offset = self.end
+        extra = zinfo.extra + (_ZIP64_LOCAL_EXTRA.pack(1, 16, 0, 0) if zip64 else b"")
+        size = _MAX32 if zip64 else 0
+        time_, date = _dos_date_time(zinfo.date_time)
+        self.fp.seek(self.end)
+        self.fp.write(
+            _LOCAL_HEADER.pack(
+                b"PK\x03\x04", zinfo.extract_version | zinfo.reserved << 8, zinfo.flag_bits, zinfo.compress_type,
+                time_, date, 0, size, size, len(name), len(extra),
+            )
+            + name
+            + extra
+        )
+        self._open = (zinfo, zip64, _LOCAL_HEADER.size + len(name) + len(extra))
+        return _Entry(self.fp, None if raw else compressor_for(zinfo.compress_type), raw)
+
+    def finish(self, entry: _Entry, crc: int = None, file_size: int = None):
+        zinfo, zip64, header_size = self._open
+        entry.flush()
+        zinfo.CRC = entry.crc if crc is None else crc
+        zinfo.file_size = entry.file_size if file_size is None else file_size
+        zinfo.compress_size = entry.compress_size
+        if not zip64 and max(zinfo.file_size, zinfo.compress_size) > ZIP64_LIMIT:
+            raise zipfile.LargeZipFile(f"{zinfo.filename} grew past the ZIP64 limit while it was written")
+        end = self.fp.tell()
+        if zip64:
+            self.fp.seek(zinfo.header_offset + 14)
+            self.fp.write(struct.pack("<L", zinfo.CRC))
+            self.fp.seek(zinfo.header_offset + header_size - 16)
+            self.fp.write(struct.pack("<2Q", zinfo.file_size, zinfo.compress_size))
+        else:
+            self.fp.seek(zinfo.header_offset + 14)
+            self.fp.write(struct.pack("<3L", zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        self.fp.seek(end)
+        self.end = end
+        self.entries.append(zinfo)
+        self._central_bytes += len(_central_record(zinfo))
+        self._open = None
+
+    def rollback(self):
+        # Drops the entry being written (read error, failed copy): the file is cut back to its local header,
+        # so a failed entry never reaches the archive.
+        zinfo = self._open[0]
+        self._open = None
+        self.fp.seek(zinfo.header_offset)
+        self.fp.truncate()
+        self.end = zinfo.header_offset
+
+    def close(self):
+        # Central directory and end records after the last complete entry.
+        fp = self.fp
+        fp.seek(self.end)
+        for zinfo in self.entries:
+            fp.write(_central_record(zinfo))
+        count = len(self.entries)
+        offset = self.end
+        size = fp.tell() - offset
+        if count >= _MAX16 or offset > ZIP64_LIMIT or size > ZIP64_LIMIT:
+            fp.write(_END64.pack(b"PK\x06\x06", _END64.size - 12, _ZIP64_VERSION, _ZIP64_VERSION, 0, 0, count, count, size, offset))
+            fp.write(_END64_LOCATOR.pack(b"PK\x06\x07", 0, offset + size, 1))
+        fp.write(_END.pack(b"PK\x05\x06", 0, 0, min(count, _MAX16), min(count, _MAX16), min(size, _MAX32), min(offset, _MAX32), 0))
+        fp.truncate()
+        fp.close()
+
+
+class EvidenceArchive:
+    # Single writer for the evidence ZIP(s).
+    # max_entries / max_bytes of 0 mean "no limit"; with both at 0 exactly one evidence_<case>.zip is produced.
+    def __init__(self, out_dir: Path, case_id: str, compression: int = zipfile.ZIP_DEFLATED, max_entries: int = 0, max_bytes: int = 0):
+        self.out_dir = out_dir
+        self.case_id = case_id
+        self.compression = compression
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sharded = bool(max_entries or max_bytes)
+        self.shards = []
+        self._names = set()
+        self._zip = None
+        self.rewound = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def zip_path(self) -> Path:
+        return shard_path(self.out_dir, self.case_id, 0, self.sharded)
+
+    def _target(self, arcname: str, data_bytes: int) -> _ZipWriter:
+        # Rotate to a new shard before the entry that would exceed a limit (a shard is never empty, so an
+        # entry larger than max_bytes gets a shard of its own). data_bytes: entry data size or an upper bound.
+        if self._zip is not None and self.sharded and self._zip.entries:
+            shard = self.shards[-1]
+            full = (self.max_entries and len(shard["entries"]) >= self.max_entries) or (
+                self.max_bytes and self._zip.projected_size(arcname, data_bytes) > self.max_bytes
+            )
+            if full:
+                self._close_current()
+
+        if self._zip is None:
+            path = shard_path(self.out_dir, self.case_id, len(self.shards), self.sharded)
+            self._zip = _ZipWriter(open(path, "w+b"))
+            self.shards.append({"zip_path": str(path), "entries": []})
+        return self._zip
+
+    @property
+    def shard_index(self) -> int:
+        # Shard that received the most recent entry.
+        return len(self.shards) - 1
+
+    def _check_name(self, arcname: str):
+        # Every arcname is written once per case (over all shards); a second entry of the same name would
+        # make readers pick one of the two silently.
+        if arcname in self._names:
+            raise ValueError(f"duplicate archive entry: {arcname}")
+
+    def _written(self, zinfo: zipfile.ZipInfo) -> zipfile.ZipInfo:
+        self.shards[-1]["entries"].append(zinfo.filename)
+        self._names.add(zinfo.filename)
+        return zinfo
+
+    def _close_current(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self.shards[-1]["bytes"] = Path(self.shards[-1]["zip_path"]).stat().st_size
+        self._zip = None
+
+    # The write methods return the entry's ZipInfo (compress_size, CRC, ...) once it is complete.
+
+    @staticmethod
+    def _data_bound(file_size: int, compress_type: int) -> int:
+        # Upper bound of the compressed size: incompressible data grows slightly with deflate/bzip2/lzma.
+        return file_size if compress_type == zipfile.ZIP_STORED else file_size + file_size // 64 + 1024
+
+    def write_file(self, p: Path, arcname: str, compress_type: int = None, buffer_size: int = 1024 * 1024) -> zipfile.ZipInfo:
+        zinfo = zipfile.ZipInfo.from_file(p, arcname=arcname)
+        zinfo.compress_type = self.compression if compress_type is None else compress_type
+        with open(p, "rb") as src, self.open_entry(zinfo) as dst:
+            while True:
+                data = src.read(buffer_size)
+                if not data:
+                    break
+                dst.write(data)
+        return zinfo
+
+    @contextmanager
+    def open_entry(self, zinfo: zipfile.ZipInfo):
+        # Streaming entry (single-pass mode). zinfo is completed in place when the block exits.
+        # An exception inside the block, or dst.discard(), removes the partial entry again (entries are all-or-nothing).
+        self._check_name(zinfo.filename)
+        z = self._target(zinfo.filename, self._data_bound(zinfo.file_size, zinfo.compress_type))
+        dst = z.begin(zinfo)
+        try:
+            yield dst
+            if not dst.discarded:
+                z.finish(dst)
+        except BaseException:
+            z.rollback()
+            raise
+        if dst.discarded:
+            z.rollback()
+            return
+        self._written(zinfo)
+
+    def write_precompressed(self, zinfo: zipfile.ZipInfo, chunks, crc: int, file_size: int, compress_size: int = None) -> zipfile.ZipInfo:
+        # zinfo.compress_type must describe how `chunks` were compressed (see compressor_for()).
+        # file_size is set before writing so ZIP64 is chosen from the real uncompressed size.
+        # compress_size (total of `chunks`) makes the shard size check exact.
+        self._check_name(zinfo.filename)
+        zinfo.file_size = file_size
+        if compress_size is None:
+            compress_size = self._data_bound(file_size, zinfo.compress_type)
+        z = self._target(zinfo.filename, compress_size)
+        dst = z.begin(zinfo, raw=True)
+        try:
+            for chunk in chunks:
+                dst.write(chunk)
+            z.finish(dst, crc=crc, file_size=file_size)
+        except BaseException:
+            z.rollback()
+            raise
+        return self._written(zinfo)
+
+    def state(self) -> dict:
+        # Flushes the open shard to disk and returns what resume() needs (entries come from zinfo_state()).
+        end = None
+        if self._zip is not None:
+            fp = self._zip.fp
+            fp.flush()
+            os.fsync(fp.fileno())
+            end = self._zip.end
+        return {
+            "shards": [{"zip_path": s["zip_path"], "bytes": s.get("bytes")} for s in self.shards],
+            "end": end,
+        }
+
+    def resume(self, state: dict, entries: list) -> int:
+        # entries: [{"shard": index, **zinfo_state()}] of every entry written before the checkpoint, in write order.
+        # Each shard is checked against the checkpoint (size, local headers, offset and CRC of its last entry).
+        # From the first shard that does not match on, the shards are removed and written again. Returns how
+        # many of `entries` are kept (always a prefix); self.rewound tells why the rest was dropped.
+        by_shard = [[] for _ in state["shards"]]
+        for e in entries:
+            by_shard[e["shard"]].append(zinfo_from_state(e))
+        kept = 0
+        for index, (saved, zinfos) in enumerate(zip(state["shards"], by_shard)):
+            path = Path(saved["zip_path"])
+            fp = None
+            try:
+                if saved["bytes"] is None:
+                    fp = _verified_open_shard(path, zinfos, state["end"])
+                else:
+                    _verify_closed_shard(path, zinfos, saved["bytes"])
+            except _DAMAGED as e:
+                self.rewound = {"shard": path.name, "kept_entries": kept, "reason": str(e) or type(e).__name__}
+                break
+            shard = {"zip_path": saved["zip_path"], "entries": [z.filename for z in zinfos]}
+            if fp is None:
+                shard["bytes"] = saved["bytes"]
+            else:
+                self._zip = _ZipWriter(fp, zinfos, state["end"])
+            self.shards.append(shard)
+            self._names.update(shard["entries"])
+            kept += len(zinfos)
+
+        # Shards after the kept ones (dropped, or started after the checkpoint) are written from scratch.
+        index = len(self.shards)
+        if self.sharded or index == 0:
+            while shard_path(self.out_dir, self.case_id, index, self.sharded).exists():
+                shard_path(self.out_dir, self.case_id, index, self.sharded).unlink()
+                index += 1
+        return kept
+
+    def close(self):
+        self._close_current()
+        if not self.shards:
+            # Keep previous behaviour: an (empty) archive always exists after a run.
+            self._target("", 0)
+            self._close_current()
+
+
+# What a damaged or changed shard can raise while it is checked.
+_DAMAGED = (OSError, EOFError, ValueError, struct.error, zlib.error, lzma.LZMAError, zipfile.BadZipFile)
+
+
+def _check_local_header(f, zinfo: zipfile.ZipInfo) -> tuple:
+    f.seek(zinfo.header_offset)
+    header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+    name = f.read(header[-2])
+    if header[0] != b"PK\x03\x04" or name.decode("utf-8" if zinfo.flag_bits & 0x800 else "cp437") != zinfo.filename:
+        raise zipfile.BadZipFile(f"local header does not match checkpoint for {zinfo.filename}")
+    return header
+
+
+class _LZMADecompressor:
+    # Counterpart of _LZMACompressor: reads the properties header, then the raw LZMA1 data.
+    def __init__(self):
+        self._header = b""
+        self._decompressor = None
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None:
+            self._header += data
+            if len(self._header) < 4 or len(self._header) < 4 + struct.unpack_from("<H", self._header, 2)[0]:
+                return b""
+            size = struct.unpack_from("<H", self._header, 2)[0]
+            props, data = self._header[4:4 + size], self._header[4 + size:]
+            lc, rest = props[0] % 9, props[0] // 9
+            self._decompressor = lzma.LZMADecompressor(
+                lzma.FORMAT_RAW,
+                filters=[{"id": lzma.FILTER_LZMA1, "lc": lc, "lp": rest % 5, "pb": rest // 5, "dict_size": int.from_bytes(props[1:5], "little")}],
+            )
+        return self._decompressor.decompress(data)
+
+
+def _data_crc(f, zinfo: zipfile.ZipInfo, offset: int, buffer_size: int = 1024 * 1024) -> int:
+    # CRC-32 of an entry's uncompressed content, read straight from its data at `offset`.
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    elif zinfo.compress_type == zipfile.ZIP_BZIP2:
+        decompressor = bz2.BZ2Decompressor()
+    elif zinfo.compress_type == zipfile.ZIP_LZMA:
+        decompressor = _LZMADecompressor()
+    else:
+        decompressor = None
+    f.seek(offset)
+    crc = 0
+    remaining = zinfo.compress_size
+    while remaining:
+        data = f.read(min(buffer_size, remaining))
+        if not data:
+            raise zipfile.BadZipFile(f"truncated entry {zinfo.filename}")
+        remaining -= len(data)
+        crc = zlib.crc32(decompressor.decompress(data) if decompressor is not None else data, crc)
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        crc = zlib.crc32(decompressor.flush(), crc)
+    return crc
+
+
+def _verified_open_shard(path: Path, zinfos: list, end: int):
+    # Open file of the shard that was being written, cut back to the checkpoint end, or raises.
+    # The last checkpointed entry must end exactly at `end` and its data must match its CRC.
+    fp = open(path, "r+b")
+    try:
+        if os.fstat(fp.fileno()).st_size < end:
+            raise zipfile.BadZipFile(f"partial archive shorter than checkpoint: {path}")
+        header = None
+        for zinfo in zinfos:
+            header = _check_local_header(fp, zinfo)
+        if zinfos:
+            last = zinfos[-1]
+            data_at = last.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+            if data_at + last.compress_size != end:
+                raise zipfile.BadZipFile(f"last entry {last.filename} does not end at the checkpoint offset")
+            if header[6] != last.CRC or _data_crc(fp, last, data_at) != last.CRC:
+                raise zipfile.BadZipFile(f"CRC of {last.filename} does not match checkpoint")
+        elif end != 0:
+            raise zipfile.BadZipFile(f"checkpoint end {end} without entries: {path}")
+        fp.truncate(end)
+    except BaseException:
+        fp.close()
+        raise
+    return fp
+
+
+def _verify_closed_shard(path: Path, zinfos: list, size: int):
+    if path.stat().st_size != size:
+        raise zipfile.BadZipFile(f"closed shard changed since checkpoint: {path}")
+    with zipfile.ZipFile(path) as z:
+        infos = z.infolist()
+        if [i.filename for i in infos] != [i.filename for i in zinfos]:
+            raise zipfile.BadZipFile(f"entries of {path.name} do not match checkpoint")
+        if infos:
+            last, saved = infos[-1], zinfos[-1]
+            if (last.header_offset, last.CRC, last.compress_size) != (saved.header_offset, saved.CRC, saved.compress_size):
+                raise zipfile.BadZipFile(f"last entry of {path.name} does not match checkpoint")
+            # zipfile checks the CRC once the entry is read to the end.
+            with z.open(last) as f:
+                while f.read(1024 * 1024):
+                    pass
+
+
+class PreviousArchives:
+    # The previous run's archive(s) for a case, renamed to <name>.zip.prev before the new run
+    # writes evidence_<case>*.zip. Entries are read back raw, exactly as they were compressed.
+    def __init__(self, out_dir: Path, case_id: str, rotate: bool = True):
+        # rotate=False when resuming: the current zips are this run's partial output, .prev already exists.
+        self.out_dir = out_dir
+        self.case_id = case_id
+        if rotate:
+            for p in self._case_files(".zip"):
+                prev = p.with_name(p.name + ".prev")
+                if prev.exists():
+                    # An earlier run was interrupted: .prev is still the last complete archive.
+                    p.unlink()
+                else:
+                    os.replace(p, prev)
+        self._open = {}
+
+    def _case_files(self, suffix: str) -> list:
+        return list(self.out_dir.glob(f"evidence_{self.case_id}{suffix}")) + list(
+            self.out_dir.glob(f"evidence_{self.case_id}_part*{suffix}")
+        )
+
+    def _zip(self, zip_name: str):
+        if zip_name not in self._open:
+            prev = self.out_dir / (zip_name + ".prev")
+            self._open[zip_name] = zipfile.ZipFile(prev) if prev.exists() else None
+        return self._open[zip_name]
+
+    def has(self, zip_name: str, arcname: str) -> bool:
+        z = self._zip(zip_name)
+        return z is not None and arcname in z.NameToInfo
+
+    def raw_entry(self, zip_name: str, arcname: str, buffer_size: int = 1024 * 1024):
+        # Returns (ZipInfo, iterator over the raw compressed bytes of the entry).
+        z = self._zip(zip_name)
+        zinfo = z.getinfo(arcname)
+
+        def chunks():
+            with open(z.filename, "rb") as f:
+                f.seek(zinfo.header_offset)
+                header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+                if header[0] != b"PK\x03\x04":
+                    raise zipfile.BadZipFile(f"bad local header for {arcname}")
+                f.seek(header[-2] + header[-1], os.SEEK_CUR)
+                remaining = zinfo.compress_size
+                while remaining:
+                    data = f.read(min(buffer_size, remaining))
+                    if not data:
+                        raise zipfile.BadZipFile(f"truncated entry {arcname}")
+                    remaining -= len(data)
+                    yield data
+
+        return zinfo, chunks()
+
+    def close(self, remove: bool = True):
+        for z in self._open.values():
+            if z is not None:
+                z.close()
+        self._open = {}
+        if remove:
+            for p in self._case_files(".zip.prev"):
+                p.unlink()
@@ -0,0 +1,203 @@
+# benchmark.py (DFABS v0.4)
+#
+# ROLE
+# - Performance regression harness: generates (or reuses) a synthetic evidence tree, runs
+#   Surveyor.run, HasherPacker.run and Scribe.run one after the other in an isolated work folder,
+#   and writes machine-readable JSON that can be compared between releases.
+#
+# Recorded per stage and end to end: wall time, files/s, MB/s, peak RSS (the stage process and its worker
+# processes, from getrusage) and, for HasherPacker, the archive ratio (archive bytes / input bytes).
+#
+# Design notes:
+# - ru_maxrss is a lifetime high-water mark, so each stage runs in a fresh process (spawn): its peak is
+#   its own, not the largest of all stages so far. The end-to-end peak is the largest stage peak.
+# - End-to-end wall time is measured around the whole run, not summed from the stages, so it includes
+#   what lies between them (one interpreter start per stage, bus hand-over).
+#
+# Example:
+#   python3 benchmark.py --files 20000 --set hash_workers=8 --out bench_hash8.json
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import Surveyor
+import HasherPacker
+import Scribe
+import make_demo_dataset
+
+from common import iter_records, read_message, utc_now
+
+
+def _peak_rss_kb() -> dict:
+    # ru_maxrss is KiB on Linux and bytes on macOS; None without the resource module (Windows).
+    if resource is None:
+        return {"self": None, "children": None}
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale,
+    }
+
+
+def _rates(files: int, nbytes: int, seconds: float) -> dict:
+    return {
+        "seconds": round(seconds, 6),
+        "files_per_s": round(files / seconds, 3) if seconds > 0 else None,
+        "mb_per_s": round(nbytes / (1024 * 1024) / seconds, 3) if seconds > 0 else None,
+    }
+
+
+STAGES = {"Surveyor": Surveyor.run, "HasherPacker": HasherPacker.run, "Scribe": Scribe.run}
+
+
+def _stage_process(name: str, config: dict, base: Path, quiet: bool, conn):
+    # Runs in the stage's own process and sends back its timing and peak RSS.
+    out = io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+            ok = STAGES[name](config, base)
+    except Exception as e:
+        ok = False
+        out.write(f"{type(e).__name__}: {e}")
+    seconds = time.perf_counter() - t0
+    conn.send({"ok": ok, "output": out.getvalue().strip(), "seconds": seconds, "peak_rss_kb": _peak_rss_kb()})
+    conn.close()
+
+
+def _stage(name: str, config: dict, base: Path, quiet: bool) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    recv, send = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_stage_process, args=(name, config, base, quiet, send), name=f"bench-{name}")
+    p.start()
+    send.close()
+    try:
+        st = recv.recv()
+    except EOFError:
+        st = None
+    p.join()
+    if st is None:
+        st = {"ok": False, "output": f"stage process exited with code {p.exitcode}"}
+    if not st["ok"]:
+        raise RuntimeError(f"{name} failed: {st['output']}")
+    return {"seconds": st["seconds"], "peak_rss_kb": st["peak_rss_kb"]}
+
+
+def run_benchmark(base: Path, dataset_dir: Path, overrides: dict, quiet: bool = True) -> dict:
+    config = {
+        "case_id": "BENCH",
+        "allowed_roots": [str(dataset_dir)],
+        "allowed_extensions": [".txt", ".pdf", ".jpg", ".doc"],
+        "max_file_size_bytes": 1 << 62,
+        "max_files": 1 << 62,
+        "bus_dir": "bus",
+        "output_dir": "output",
+    }
+    config.update(overrides)
+
+    t0 = time.perf_counter()
+    stages = {name: _stage(name, config, base, quiet) for name in STAGES}
+    seconds = time.perf_counter() - t0
+
+    bus = base / config["bus_dir"]
+    content = read_message(bus / "20_hash_result.json")["content"]
+    files = 0
+    nbytes = 0
+    for r in iter_records(bus, content, "files"):
+        files += 1
+        nbytes += int(r.get("size") or 0)
+    archive_bytes = sum(Path(s["zip_path"]).stat().st_size for s in content["shards"])
+
+    result = {"stages": {}, "files": files, "bytes": nbytes}
+    for name, st in stages.items():
+        result["stages"][name] = {**_rates(files, nbytes, st["seconds"]), "peak_rss_kb": st["peak_rss_kb"]}
+    result["stages"]["HasherPacker"]["archive_bytes"] = archive_bytes
+    result["stages"]["HasherPacker"]["archive_ratio"] = round(archive_bytes / nbytes, 4) if nbytes else None
+    peaks = [st["peak_rss_kb"] for st in stages.values()]
+    result["end_to_end"] = {
+        **_rates(files, nbytes, seconds),
+        "peak_rss_kb": {k: max((p[k] for p in peaks if p[k] is not None), default=None) for k in ("self", "children")},
+    }
+    return result
+
+
+def _parse_set(values: list) -> dict:
+    # --set key=value, value parsed as JSON when possible (numbers, booleans, lists).
+    overrides = {}
+    for item in values:
+        key, _, raw = item.partition("=")
+        try:
+            overrides[key] = json.loads(raw)
+        except json.JSONDecodeError:
+            overrides[key] = raw
+    return overrides
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="DFABS pipeline benchmark")
+    ap.add_argument("--dataset", help="existing evidence tree (default: generate one)")
+    ap.add_argument("--files", type=int, default=2000)
+    ap.add_argument("--depth", type=int, default=2)
+    ap.add_argument("--fanout", type=int, default=4)
+    ap.add_argument("--size-dist", default="lognormal:4096:1.5")
+    ap.add_argument("--dup-ratio", type=float, default=0.1)
+    ap.add_argument("--compressibility", type=float, default=0.5)
+    ap.add_argument("--ext-mix", default=".txt:6,.pdf:1,.jpg:1,.doc:1")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="config override, repeatable")
+    ap.add_argument("--out", help="write the JSON result to this file (default: stdout)")
+    args = ap.parse_args(argv)
+
+    overrides = _parse_set(args.set)
+    if not args.dataset:
+        overrides.setdefault("allowed_extensions", [e for e, _ in make_demo_dataset.parse_ext_mix(args.ext_mix)])
+    with tempfile.TemporaryDirectory(prefix="dfabs_bench_") as tmp:
+        work = Path(tmp)
+        dataset = None
+        if args.dataset:
+            dataset_dir = Path(args.dataset).resolve()
+        else:
+            dataset_dir = work / "evidence"
+            dataset = make_demo_dataset.generate(
+                dataset_dir,
+                files=args.files,
+                depth=args.depth,
+                fanout=args.fanout,
+                size_dist=args.size_dist,
+                dup_ratio=args.dup_ratio,
+                compressibility=args.compressibility,
+                ext_mix=args.ext_mix,
+                seed=args.seed,
+            )
+        result = run_benchmark(work, dataset_dir, overrides)
+
+    report = {
+        "timestamp": utc_now(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": dataset or {"out_dir": str(dataset_dir)},
+        "config_overrides": overrides,
+        **result,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# casedb.py (DFABS v0.4)
+#
+# ROLE
+# - Indexed SQLite case database written by Scribe (report_formats: ["sqlite"]), so examiners can query
+#   the manifest ("all files with this hash", "all .pdf over 5 MB", "everything under root X")
+#   instead of grepping a multi-gigabyte CSV.
+#
+# Tables:
+# - files       one row per HashResult record (report order), digests, archive entry, root/rel_path,
+#               known (reference set name for known files)
+# - deviations  Surveyor deviations (size limit, missing root, ...)
+# - discovered  Surveyor file records (root, rel_path, dev/inode/mtime), joined into files.root/rel_path
+# - meta        case_id, algorithms, generation time
+#
+# Design notes:
+# - Bulk load: rows are inserted with executemany in batches (sqlite_batch_rows) inside one
+#   transaction, and the indexes are created after the data is in, which is much faster than
+#   maintaining them row by row.
+# - The database is built under a temporary name and renamed at the end, so a half-written
+#   database never replaces the previous one.
+
+import os
+import sqlite3
+from pathlib import Path
+
+from common import utc_now
+
+_RESULT_COLUMNS = ["arcname", "shard", "compression", "compress_ratio", "duplicate", "from_cache", "error", "merkle_root", "known"]
+_DISCOVERED_COLUMNS = ["path", "root", "root_name", "rel_path", "ext", "size", "dev", "inode", "mtime_ns"]
+
+
+def db_path(out_dir: Path, case_id: str) -> Path:
+    return out_dir / f"case_{case_id}.sqlite"
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class CaseDB:
+    def __init__(self, path: Path, algorithms: list, batch_rows: int = 10000):
+        self.path = path
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+        self.algorithms = list(algorithms)
+        self.batch_rows = max(1, batch_rows)
+        self.files = 0
+        self.deviations = 0
+        self._batch = []
+
+        self.conn = sqlite3.connect(str(self.tmp_path))
+        # Rebuilt from the bus messages on every run, durability while building is not needed.
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        digest_cols = ", ".join(f"{_q(a)} TEXT" for a in self.algorithms)
+        self.conn.execute(
+            f"CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT, root TEXT, root_name TEXT, rel_path TEXT, "
+            f"ext TEXT, size INTEGER, {digest_cols}, arcname TEXT, shard INTEGER, compression TEXT, "
+            f"compress_ratio REAL, duplicate INTEGER, from_cache INTEGER, error TEXT, merkle_root TEXT, known TEXT)"
+        )
+        self.conn.execute("CREATE TABLE deviations (id INTEGER PRIMARY KEY, path TEXT, reason TEXT)")
+        self.conn.execute(
+            "CREATE TABLE discovered (path TEXT PRIMARY KEY, root TEXT, root_name TEXT, rel_path TEXT, "
+            "ext TEXT, size INTEGER, dev INTEGER, inode INTEGER, mtime_ns INTEGER)"
+        )
+        self.conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        cols = ["path", "ext", "size", *self.algorithms, *_RESULT_COLUMNS]
+        self._insert_file = f"INSERT INTO files ({', '.join(_q(c) for c in cols)}) VALUES ({', '.join('?' * len(cols))})"
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_rows:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def add_discovered(self, records):
+        sql = f"INSERT OR REPLACE INTO discovered VALUES ({', '.join('?' * len(_DISCOVERED_COLUMNS))})"
+        rows = (tuple(r.get(c) for c in _DISCOVERED_COLUMNS) for r in records)
+        for batch in self._batches(rows):
+            self.conn.executemany(sql, batch)
+
+    def add_deviations(self, records):
+        for batch in self._batches((r.get("path"), r.get("reason")) for r in records):
+            self.conn.executemany("INSERT INTO deviations (path, reason) VALUES (?, ?)", batch)
+            self.deviations += len(batch)
+
+    def add_file(self, r: dict):
+        merkle = r.get("merkle") or {}
+        self._batch.append(
+            (
+                r.get("path"),
+                r.get("ext"),
+                r.get("size"),
+                *(r.get(a) or None for a in self.algorithms),
+                r.get("arcname"),
+                r.get("shard"),
+                r.get("compression"),
+                r.get("compress_ratio"),
+                1 if r.get("duplicate") else 0,
+                1 if r.get("from_cache") else 0,
+                r.get("error"),
+                merkle.get("root"),
+                r.get("known"),
+            )
+        )
+        if len(self._batch) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self.conn.executemany(self._insert_file, self._batch)
+            self.files += len(self._batch)
+            self._batch = []
+
+    def close(self, meta: dict):
+        self._flush()
+        # Location columns come from the Surveyor records (HashResult records only carry the path).
+        # Correlated subqueries (primary key lookups) instead of UPDATE ... FROM, which needs SQLite 3.33.
+        self.conn.execute(
+            "UPDATE files SET "
+            "root = (SELECT d.root FROM discovered AS d WHERE d.path = files.path), "
+            "root_name = (SELECT d.root_name FROM discovered AS d WHERE d.path = files.path), "
+            "rel_path = (SELECT d.rel_path FROM discovered AS d WHERE d.path = files.path) "
+            "WHERE EXISTS (SELECT 1 FROM discovered AS d WHERE d.path = files.path)"
+        )
+        for a in self.algorithms:
+            self.conn.execute(f"CREATE INDEX {_q('idx_files_' + a)} ON files ({_q(a)})")
+        self.conn.execute("CREATE INDEX idx_files_ext_size ON files (ext, size)")
+        self.conn.execute("CREATE INDEX idx_files_size ON files (size)")
+        self.conn.execute("CREATE INDEX idx_files_root_rel ON files (root, rel_path)")
+        self.conn.execute("CREATE INDEX idx_deviations_reason ON deviations (reason)")
+        meta = {"generated_at": utc_now(), "hash_algorithms": ",".join(self.algorithms), **meta}
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()])
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.conn.close()
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
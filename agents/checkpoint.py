@@ -0,0 +1,145 @@
+# checkpoint.py (DFABS v0.4)
+#
+# ROLE
+# - Periodic HasherPacker checkpoints on the bus, so an interrupted large case can be resumed
+#   (Coordinator --resume) instead of hashing and archiving everything again.
+#
+# Bus files:
+# - 20_hash_checkpoint.json          small state: items done, archive end offset, shard list, counters
+# - 20_hash_checkpoint.records.jsonl result records written so far (append-only)
+# - 20_hash_checkpoint.entries.jsonl ZIP central-directory data of the written entries (append-only)
+#
+# Design notes:
+# - The record/entry files are append-only and the state file stores their byte offsets, so a checkpoint
+#   costs only the records since the previous one (no quadratic rewrite on multi-million file cases).
+# - Order of a checkpoint: archive flushed and fsynced -> record/entry lines fsynced -> state file replaced
+#   atomically. Anything written after the last state file (archive bytes, extra lines) is truncated on resume.
+# - The checkpoint files are removed once HasherPacker has written its HashResult.
+
+import json
+import os
+import time
+from pathlib import Path
+
+from common import ensure_dir
+
+STATE_NAME = "20_hash_checkpoint.json"
+
+
+class Checkpoint:
+    def __init__(self, bus_dir: Path, every_files: int = 0, every_seconds: float = 0):
+        self.bus_dir = bus_dir
+        self.state_path = bus_dir / STATE_NAME
+        self.records_path = bus_dir / "20_hash_checkpoint.records.jsonl"
+        self.entries_path = bus_dir / "20_hash_checkpoint.entries.jsonl"
+        self.every_files = every_files
+        self.every_seconds = every_seconds
+        self.saved = 0
+        self._pending_records = []
+        self._pending_entries = []
+        self._last_done = 0
+        self._last_time = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.every_files or self.every_seconds)
+
+    def load(self):
+        # Returns (state, records, entries) of the last complete checkpoint, or None.
+        # The append-only files are cut back to the offsets recorded in the state file.
+        if not self.state_path.exists():
+            return None
+        with self.state_path.open(encoding="utf-8") as f:
+            state = json.load(f)
+        records = self._read_lines(self.records_path, state["records_offset"])
+        entries = self._read_lines(self.entries_path, state["entries_offset"])
+        self._last_done = state["done"]
+        return state, records, entries
+
+    @staticmethod
+    def _read_lines(path: Path, offset: int) -> list:
+        if not path.exists():
+            if offset:
+                raise ValueError(f"checkpoint file missing: {path.name}")
+            return []
+        with path.open("r+b") as f:
+            f.truncate(offset)
+            f.seek(0)
+            return [json.loads(line) for line in f if line.strip()]
+
+    def start(self, resumed: bool):
+        # A fresh run drops any stale checkpoint; a resumed run keeps appending to it.
+        if not resumed:
+            self.clear()
+        ensure_dir(self.bus_dir)
+
+    def add(self, record: dict, entry: dict = None):
+        if not self.enabled:
+            return
+        self._pending_records.append(record)
+        if entry is not None:
+            self._pending_entries.append(entry)
+
+    def due(self, done: int) -> bool:
+        if not self.enabled or done == self._last_done:
+            return False
+        if self.every_files and done - self._last_done >= self.every_files:
+            return True
+        return bool(self.every_seconds and time.monotonic() - self._last_time >= self.every_seconds)
+
+    def save(self, state: dict):
+        # state: archive and counter state from HasherPacker, must already be durable on disk.
+        state = dict(state)
+        state["records_offset"] = self._append(self.records_path, self._pending_records)
+        state["entries_offset"] = self._append(self.entries_path, self._pending_entries)
+        self._pending_records = []
+        self._pending_entries = []
+        self._write_state(state)
+        self.saved += 1
+
+    def rewind(self, state: dict, records: int, entries: int):
+        # Resume found archive output it cannot reuse: keep only the first `records`/`entries` lines.
+        # The state file (with the shorter offsets) is replaced first; a crash before the files are cut
+        # is harmless, load() cuts them to the state offsets anyway.
+        state = dict(state)
+        state["records_offset"] = self._line_offset(self.records_path, records)
+        state["entries_offset"] = self._line_offset(self.entries_path, entries)
+        self._write_state(state)
+        for path, offset in ((self.records_path, state["records_offset"]), (self.entries_path, state["entries_offset"])):
+            if path.exists():
+                with path.open("r+b") as f:
+                    f.truncate(offset)
+
+    @staticmethod
+    def _line_offset(path: Path, lines: int) -> int:
+        if not lines:
+            return 0
+        offset = 0
+        with path.open("rb") as f:
+            for _ in range(lines):
+                offset += len(f.readline())
+        return offset
+
+    def _write_state(self, state: dict):
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+        self._last_done = state["done"]
+        self._last_time = time.monotonic()
+
+    @staticmethod
+    def _append(path: Path, lines: list) -> int:
+        with path.open("ab") as f:
+            for obj in lines:
+                f.write((json.dumps(obj) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def clear(self):
+        for p in (self.state_path, self.records_path, self.entries_path, self.state_path.with_name(STATE_NAME + ".tmp")):
+            if p.exists():
+                p.unlink()
@@ -7,6 +7,12 @@
 # - JSON files are used as messages to keep agent communication visible for demos.
 # - SHA-256 is used for file integrity because it is widely recognized and simple to explain. This is also in line with the original DFABS design document Group D submission.
 # - The run log is plain JSON Lines (jsonl) so it is easy to capture as evidence.
+# - Large message payloads (file lists) can be streamed: with bus_format "jsonl" the envelope keeps its
+#   FIPA-style fields and each list field references a JSON Lines record file next to it.
+#   Producers append records one by one, consumers iterate them lazily (bounded memory).
+# - With bus_format "json" the records are held in a compact RecordStore (records.py) until the message
+#   is written; write_json streams them out one record at a time, in the same JSON layout, and
+#   read_message parses them back one record at a time into a RecordStore.
 #
 # Out of scope in this build, designed originally but not included due to constrains, plan for next versions:
 # - tamper-evident log
@@ -15,14 +21,33 @@
 # Design notes:
 # - Demonstrates complete workflow core functionality of DFABS as per design document DFABS Group D. Originally as per agent design there was no common functions, although this is not really an agent related design choice.
 
+import atexit
 import json
 import hashlib
+import itertools
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
 
+from records import RecordStore
+
 PROTOCOL = "dfabs-acl-lite"
 ONTOLOGY = "DFABS-Ontology"
 
+# Streaming hash defaults. One buffer is allocated per call and reused for every read,
+# so peak memory stays flat whatever the evidence file size.
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_MMAP_THRESHOLD = 64 * 1024 * 1024
+
+# SHA-256 is the reference digest of the workflow, extra algorithms (md5, sha1, blake2b, ...)
+# are computed next to it from the same bytes.
+DEFAULT_HASH_ALGORITHMS = ["sha256"]
+
 
 def utc_now() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
@@ -36,9 +61,138 @@ def read_json(path: Path) -> dict:
     return json.loads(path.read_text(encoding="utf-8"))
 
 
+class _JSONReader:
+    # Pull reader over a JSON text file: values are decoded one at a time from a sliding buffer,
+    # so only the value being decoded has to be in memory.
+    _decode = json.JSONDecoder().raw_decode
+
+    def __init__(self, f, chunk: int = DEFAULT_BUFFER_SIZE):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        # Next non-whitespace character ("" at the end of the file), not consumed.
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill(self.chunk):
+                return self.buf[self.pos:self.pos + 1]
+
+    def take(self, allowed: str) -> str:
+        c = self.peek()
+        if not c or c not in allowed:
+            raise ValueError(f"invalid message: expected {allowed!r}, found {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value is complete once a delimiter follows it; before that it may be cut short
+            # ("12" of "12.5e3", an incomplete object).
+            if end is not None and (self.eof or (end < len(self.buf) and self.buf[end] in " \t\r\n,:]}")):
+                self.pos = end
+                return value
+            if not self._fill(max(self.chunk, len(self.buf) - self.pos)) and end is None:
+                raise ValueError("invalid message: truncated JSON value")
+
+
+def _read_records(r: _JSONReader):
+    # A JSON array of records, appended to a RecordStore one record at a time.
+    records = RecordStore()
+    r.take("[")
+    if r.peek() == "]":
+        r.pos += 1
+        return records
+    while True:
+        rec = r.value()
+        if not isinstance(rec, dict) and isinstance(records, RecordStore):
+            # Not a record list after all: keep it as a plain list.
+            records = list(records)
+        records.append(rec)
+        if r.take(",]") == "]":
+            return records
+
+
+def _read_object(r: _JSONReader, fields: tuple, level: int) -> dict:
+    obj = {}
+    r.take("{")
+    if r.peek() == "}":
+        r.pos += 1
+        return obj
+    while True:
+        key = r.value()
+        if not isinstance(key, str):
+            raise ValueError("invalid message: object key is not a string")
+        r.take(":")
+        if level == 0 and key == "content" and r.peek() == "{":
+            obj[key] = _read_object(r, fields, 1)
+        elif level == 1 and key in fields and r.peek() == "[":
+            obj[key] = _read_records(r)
+        else:
+            obj[key] = r.value()
+        if r.take(",}") == "}":
+            return obj
+
+
+def read_message(path: Path, fields: tuple = ("files",)) -> dict:
+    # Same as read_json for a bus message, except that the inline record lists content[field]
+    # (bus_format "json") are parsed record by record straight into a RecordStore: the full list of
+    # dicts is never built. Record files (bus_format "jsonl") are left to iter_records as before.
+    # Raises ValueError (like read_json) for text that is not a JSON object.
+    with path.open(encoding="utf-8") as f:
+        r = _JSONReader(f)
+        msg = _read_object(r, fields, 0)
+        if r.peek():
+            raise ValueError("invalid message: extra data after the JSON object")
+        return msg
+
+
+def _json_chunks(value, level: int):
+    # Same text as json.dumps(value, indent=2), but RecordStore lists are encoded record by record
+    # instead of being expanded into one big list of dicts first.
+    pad = "\n" + "  " * (level + 1)
+    if isinstance(value, RecordStore):
+        if not len(value):
+            yield "[]"
+            return
+        sep = "["
+        for rec in value:
+            yield sep + pad + json.dumps(rec, indent=2).replace("\n", pad)
+            sep = ","
+        yield "\n" + "  " * level + "]"
+    elif isinstance(value, dict) and value:
+        sep = "{"
+        for k, v in value.items():
+            yield sep + pad + json.dumps(k if isinstance(k, str) else json.dumps(k).strip('"')) + ": "
+            yield from _json_chunks(v, level + 1)
+            sep = ","
+        yield "\n" + "  " * level + "}"
+    else:
+        yield json.dumps(value, indent=2).replace("\n", "\n" + "  " * level)
+
+
 def write_json(path: Path, obj: dict):
     ensure_dir(path.parent)
-    path.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+    with path.open("w", encoding="utf-8") as f:
+        for chunk in _json_chunks(obj, 0):
+            f.write(chunk)
 
 
 def make_message(sender: str, receiver: str, msg_type: str, conversation_id: str, content: dict, performative: str = "INFORM") -> dict:
@@ -57,16 +211,343 @@ def make_message(sender: str, receiver: str, msg_type: str, conversation_id: str
     }
 
 
-def sha256_file(path: Path) -> str:
-    # PoC assumption: evidence files are small (enforced by max_file_size_bytes).
-    # Reading the whole file keeps the code simple.
-    data = path.read_bytes()
-    return hashlib.sha256(data).hexdigest()
+class RecordSink:
+    # Collects one list field of a bus message, e.g. content["files"] of 10_discovery_report.json.
+    # - "json": records stay in memory and are embedded in the message (original format)
+    # - "jsonl": records are appended to <message>.<field>.jsonl, the message holds a reference
+    # The envelope is written after the record files, so a visible envelope is always complete.
+    def __init__(self, bus_dir: Path, msg_name: str, field: str, fmt: str = "json"):
+        if fmt not in ("json", "jsonl"):
+            raise ValueError(f"unsupported bus_format: {fmt}")
+        self.fmt = fmt
+        self.count = 0
+        self._records = RecordStore()
+        self._f = None
+        self.path = bus_dir / f"{Path(msg_name).stem}.{field}.jsonl"
+        if fmt == "jsonl":
+            ensure_dir(bus_dir)
+            self._f = self.path.open("w", encoding="utf-8")
+
+    def append(self, rec: dict):
+        self.count += 1
+        if self._f is None:
+            self._records.append(rec)
+        else:
+            self._f.write(json.dumps(rec) + "\n")
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+    def value(self):
+        # What goes into the message content for this field.
+        self.close()
+        if self._f is None:
+            return self._records
+        return {"format": "jsonl", "records": self.path.name, "count": self.count}
+
+
+def iter_records(bus_dir: Path, content: dict, field: str):
+    # Lazily yields the records of a message list field, whichever format the producer used.
+    value = content.get(field, [])
+    if isinstance(value, dict) and "records" in value:
+        with (bus_dir / value["records"]).open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from value
+
+
+def record_count(content: dict, field: str) -> int:
+    value = content.get(field, [])
+    if isinstance(value, dict):
+        return int(value.get("count", 0))
+    return len(value)
+
+
+def iter_file_chunks(path: Path, buffer_size: int = DEFAULT_BUFFER_SIZE, use_mmap: bool = False, mmap_threshold: int = DEFAULT_MMAP_THRESHOLD, sequential: bool = False):
+    # Yields memoryview chunks of the file content.
+    # - default: readinto() a single preallocated bytearray (constant memory, no per-read allocation)
+    # - mmap: for files above mmap_threshold, slice a read-only mapping (the OS pages data in and out)
+    # - sequential: tell the OS the file is read once front to back (larger readahead), see iosched.py
+    # Chunks are only valid until the next one is produced, consumers must not keep references.
+    with path.open("rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if sequential and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if use_mmap and size >= mmap_threshold and size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if sequential and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, len(mm), buffer_size):
+                        chunk = view[offset:offset + buffer_size]
+                        try:
+                            yield chunk
+                        finally:
+                            # Released explicitly, otherwise the mapping cannot be closed.
+                            chunk.release()
+                finally:
+                    view.release()
+            return
+
+        buf = bytearray(buffer_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            yield view[:n]
+
+
+def hash_algorithms(names=None) -> list:
+    # Normalise a configured algorithm list: lower case, no duplicates, sha256 always first.
+    # Variable-length digests (shake_*) are rejected because the report needs a fixed hex value.
+    algos = ["sha256"]
+    for name in names or DEFAULT_HASH_ALGORITHMS:
+        name = str(name).lower().replace("-", "")
+        if name in algos:
+            continue
+        if name not in hashlib.algorithms_available or name.startswith("shake_"):
+            raise ValueError(f"unsupported hash algorithm: {name}")
+        algos.append(name)
+    return algos
+
+
+def new_hashers(algorithms) -> dict:
+    return {name: hashlib.new(name) for name in algorithms}
+
+
+def hash_file(path: Path, algorithms=None, buffer_size: int = DEFAULT_BUFFER_SIZE, use_mmap: bool = False, mmap_threshold: int = DEFAULT_MMAP_THRESHOLD, sequential: bool = False) -> dict:
+    # One streaming read, every chunk is fed to all hashers (extra algorithms cost CPU, not I/O).
+    hashers = new_hashers(hash_algorithms(algorithms))
+    for chunk in iter_file_chunks(path, buffer_size=buffer_size, use_mmap=use_mmap, mmap_threshold=mmap_threshold, sequential=sequential):
+        for h in hashers.values():
+            h.update(chunk)
+    return {name: h.hexdigest() for name, h in hashers.items()}
+
+
+def sha256_file(path: Path, buffer_size: int = DEFAULT_BUFFER_SIZE, use_mmap: bool = False, mmap_threshold: int = DEFAULT_MMAP_THRESHOLD) -> str:
+    # Streaming SHA-256: the file is never loaded into memory as a whole.
+    return hash_file(path, ["sha256"], buffer_size=buffer_size, use_mmap=use_mmap, mmap_threshold=mmap_threshold)["sha256"]
+
+
+def ordered_map(fn, items, workers: int = 1, window: int = 0, processes: bool = False, order=None):
+    # Runs fn(item) on a thread pool and yields (item, result) strictly in input order.
+    # At most `window` items are in flight, so memory stays bounded for very long item lists.
+    # hashlib and file reads release the GIL, so threads are enough to keep several I/Os outstanding.
+    # processes=True uses a process pool instead (CPU-bound work such as compression); fn must be picklable.
+    # order(batch) -> [(index, job item)]: items are taken in batches of `window` and each batch is run in
+    # that order (read scheduling, iosched.py); results are still yielded in input order.
+    if order is not None:
+        yield from _batch_ordered_map(fn, items, workers, max(1, window or workers * 4), processes, order)
+        return
+    if workers <= 1:
+        for it in items:
+            yield it, fn(it)
+        return
+
+    window = max(window or workers * 4, workers)
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for it in items:
+                pending.append((it, pool.submit(fn, it)))
+                if len(pending) >= window:
+                    head, fut = pending.popleft()
+                    yield head, fut.result()
+            while pending:
+                head, fut = pending.popleft()
+                yield head, fut.result()
+        finally:
+            # Consumer stopped early (close(), error): queued jobs are dropped, only running ones are awaited.
+            for _, fut in pending:
+                fut.cancel()
+
+
+def _batch_ordered_map(fn, items, workers: int, window: int, processes: bool, order):
+    items = iter(items)
+    batches = iter(lambda: list(itertools.islice(items, window)), [])
+    if workers <= 1:
+        for batch in batches:
+            results = [None] * len(batch)
+            for i, job in order(batch):
+                results[i] = fn(job)
+            yield from zip(batch, results)
+        return
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for batch in batches:
+                futures = [None] * len(batch)
+                for i, job in order(batch):
+                    futures[i] = pool.submit(fn, job)
+                pending.extend(zip(batch, futures))
+                # The next batch is queued before this one is drained, so the pool never runs dry.
+                while len(pending) > window:
+                    head, fut = pending.popleft()
+                    yield head, fut.result()
+            while pending:
+                head, fut = pending.popleft()
+                yield head, fut.result()
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+
+
+def throughput(nbytes: int, seconds: float) -> dict:
+    # Small helper so every agent reports throughput with the same keys in the runlog.
+    mb = nbytes / (1024 * 1024)
+    return {
+        "bytes": nbytes,
+        "seconds": round(seconds, 6),
+        "mb_per_s": round(mb / seconds, 3) if seconds > 0 else None,
+    }
+
+
+# Run log writer: one open O_APPEND handle per log file instead of open/append/close per record.
+# Records are buffered as whole lines and written with a single write() per flush (concurrent writers,
+# e.g. queue worker processes, never interleave inside a line). Policy per log file (configure_runlog):
+# - runlog_flush_records: flush after this many records (default 1, every record visible at once)
+# - runlog_flush_seconds: also flush when the oldest buffered record is this old (0 = off)
+# - runlog_fsync: "never" (default), "flush" (fsync on every flush) or "close" (fsync on close_runlog and
+#   at interpreter exit; the stage-end flushes only write)
+# Buffered records are always flushed at stage ends (instrument.py), case end and interpreter exit.
+# The policy belongs to the log path, not the process: cases run side by side (--cases, daemon) each keep
+# their own, and it outlives close_runlog, so records appended after a case's close still follow it.
+_DEFAULT_RUNLOG_POLICY = {"flush_records": 1, "flush_seconds": 0.0, "fsync": "never"}
+_runlog_policies = {}
+_runlogs = {}
+_runlogs_lock = threading.Lock()
+_runlog_listeners = []
+
+
+def runlog_policy(config: dict) -> dict:
+    # Raises ValueError for an unknown runlog_fsync.
+    fsync = config.get("runlog_fsync", "never")
+    if fsync not in ("never", "flush", "close"):
+        raise ValueError(f"unsupported runlog_fsync: {fsync}")
+    return {
+        "flush_records": max(1, int(config.get("runlog_flush_records", 1))),
+        "flush_seconds": float(config.get("runlog_flush_seconds", 0)),
+        "fsync": fsync,
+    }
+
+
+def configure_runlog(log_path: Path, config: dict):
+    # Sets the buffering/fsync policy of one run log. Raises ValueError like runlog_policy.
+    policy = runlog_policy(config)
+    key = os.path.abspath(log_path)
+    with _runlogs_lock:
+        _runlog_policies[key] = policy
+        w = _runlogs.get(key)
+    if w is not None:
+        w.set_policy(policy)
+
+
+class RunlogWriter:
+    def __init__(self, path: Path, policy: dict = None):
+        self.path = path
+        self.policy = dict(policy or _DEFAULT_RUNLOG_POLICY)
+        self._fd = None
+        self._buf = []
+        self._first = 0.0
+        self._lock = threading.Lock()
+
+    def set_policy(self, policy: dict):
+        with self._lock:
+            self.policy = dict(policy)
+
+    def _open(self):
+        # (Re)open when the log was removed or replaced since the last write (e.g. a wiped output folder).
+        if self._fd is not None:
+            try:
+                st = os.stat(self.path)
+                cur = os.fstat(self._fd)
+                if (st.st_dev, st.st_ino) == (cur.st_dev, cur.st_ino):
+                    return
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+        ensure_dir(self.path.parent)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, line: str):
+        with self._lock:
+            if not self._buf:
+                self._first = time.monotonic()
+            self._buf.append(line)
+            policy = self.policy
+            if len(self._buf) >= policy["flush_records"] or (policy["flush_seconds"] and time.monotonic() - self._first >= policy["flush_seconds"]):
+                self._flush(policy["fsync"] == "flush")
+
+    def _flush(self, sync: bool):
+        if self._buf:
+            self._open()
+            data = "".join(self._buf).encode("utf-8")
+            self._buf = []
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+        if sync and self._fd is not None:
+            os.fsync(self._fd)
+
+    def flush(self, sync: bool = False):
+        with self._lock:
+            self._flush(sync or self.policy["fsync"] == "flush")
+
+    def close(self):
+        with self._lock:
+            self._flush(self.policy["fsync"] != "never")
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def _runlog(log_path: Path) -> RunlogWriter:
+    key = os.path.abspath(log_path)
+    with _runlogs_lock:
+        w = _runlogs.get(key)
+        if w is None:
+            w = _runlogs[key] = RunlogWriter(Path(key), _runlog_policies.get(key))
+        return w
+
+
+def flush_runlogs(final: bool = False):
+    # final: the logs are not written again (interpreter exit), so the "close" policy syncs here too.
+    with _runlogs_lock:
+        writers = list(_runlogs.values())
+    for w in writers:
+        w.flush(final and w.policy["fsync"] == "close")
+
+
+def close_runlog(log_path: Path):
+    with _runlogs_lock:
+        w = _runlogs.pop(os.path.abspath(log_path), None)
+    if w is not None:
+        w.close()
+
+
+def add_runlog_listener(fn):
+    # fn(log_path, record) is called for every record appended in this process (instrument.py).
+    _runlog_listeners.append(fn)
+
+
+def remove_runlog_listener(fn):
+    _runlog_listeners.remove(fn)
 
 
 def append_runlog(log_path: Path, agent: str, action: str, details: dict):
     # Plain JSONL for evidence, reproducibility, checking and test.
     record = {"ts": utc_now(), "agent": agent, "action": action, "details": details}
-    ensure_dir(log_path.parent)
-    with log_path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(record) + "\n")
+    _runlog(log_path).write(json.dumps(record) + "\n")
+    for fn in list(_runlog_listeners):
+        fn(log_path, record)
+
+
+atexit.register(flush_runlogs, True)
@@ -0,0 +1,407 @@
+# daemon.py (DFABS v0.4)
+#
+# ROLE
+# - Long-running, event-driven form of the workflow: the agents react to bus messages instead of being
+#   called one after another by a Coordinator process that is started per case.
+#     bus/inbox/<case>.json          -> case accepted, TaskRequest written to bus/<case>/
+#     00_task_request.json           -> Surveyor
+#     10_discovery_report.json       -> HasherPacker
+#     20_hash_result.json            -> Scribe
+#     30_report_generated.json       -> Verifier (only with "verify_archive": true)
+#
+# Design notes:
+# - One asyncio event loop owns the routing; every agent run and all bulk file I/O happen in worker
+#   threads (asyncio.to_thread), so a long hashing stage never delays routing of the other cases.
+# - Bus changes are watched with inotify (Linux, via ctypes) where available, a message is routed as soon
+#   as its writer closes it. Elsewhere (or "daemon_inotify": false) the watched folders are polled and a
+#   file is routed once its size/mtime was stable over two polls.
+# - The agent modules and the daemon config stay loaded between cases; a case request only carries the
+#   keys that differ from the daemon config. Cases are namespaced as in Coordinator --cases
+#   (bus_dir/<case_id>, output_dir/<case_id>) and at most daemon_max_cases run at the same time.
+# - Each stage of a case is triggered once. A message only starts its stage after the agent that wrote
+#   it has returned (agents keep writing runlog records and checkpoints after their bus message), so the
+#   stages of one case never overlap and the case is finished only after its last agent returned.
+# - The bus messages and runlog are the same as in a Coordinator run, plus a DAEMON_CASE record with the
+#   case latency. Pipeline and queue mode are
+#   Coordinator features; in the daemon HasherPacker runs once the discovery report is on the bus.
+#
+# Usage:
+#   python3 daemon.py serve [config.json]
+#   python3 daemon.py submit case.json [--config config.json]
+
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import signal
+import struct
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import Surveyor
+import HasherPacker
+import Scribe
+import Verifier
+
+from common import close_runlog, configure_runlog, ensure_dir, read_json, runlog_policy, write_json, append_runlog
+from Coordinator import case_namespace, task_request, wipe_bus
+
+INBOX_DIR = "inbox"
+
+STAGES = {
+    "00_task_request.json": "Surveyor",
+    "10_discovery_report.json": "HasherPacker",
+    "20_hash_result.json": "Scribe",
+    "30_report_generated.json": "Verifier",
+}
+ROLES = list(STAGES.values())
+AGENTS = {"Surveyor": Surveyor.run, "HasherPacker": HasherPacker.run, "Scribe": Scribe.run, "Verifier": Verifier.run}
+
+# Keys of the daemon itself, not passed on to the cases.
+_DAEMON_KEYS = ("daemon_max_cases", "daemon_poll_seconds", "daemon_inotify")
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")
+
+
+def inbox_dir(config: dict, base_dir: Path) -> Path:
+    return base_dir / config["bus_dir"] / INBOX_DIR
+
+
+def submit(case_config: dict, config: dict, base_dir: Path) -> Path:
+    # Drops a case request into the inbox. Written under a temporary name and renamed, so the daemon
+    # never sees a half-written request.
+    inbox = inbox_dir(config, base_dir)
+    ensure_dir(inbox)
+    path = inbox / f"{case_config['case_id']}.json"
+    tmp = inbox / f".{path.name}.tmp"
+    write_json(tmp, case_config)
+    os.replace(tmp, path)
+    return path
+
+
+class _InotifyWatcher:
+    def __init__(self, loop, on_path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._libc = libc
+        self._fd = fd
+        self._loop = loop
+        self._on_path = on_path
+        self._dirs = {}
+        loop.add_reader(fd, self._read)
+
+    def watch(self, folder: Path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), _IN_CLOSE_WRITE | _IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {folder}")
+        self._dirs[wd] = folder
+
+    def unwatch(self, folder: Path):
+        for wd, d in list(self._dirs.items()):
+            if d == folder:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._dirs[wd]
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, n = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + n].rstrip(b"\0")
+            offset += _EVENT.size + n
+            folder = self._dirs.get(wd)
+            if folder is not None and name and not mask & _IN_ISDIR:
+                self._on_path(folder / os.fsdecode(name))
+
+    def close(self):
+        self._loop.remove_reader(self._fd)
+        os.close(self._fd)
+
+
+class _PollingWatcher:
+    def __init__(self, loop, on_path, poll_seconds: float):
+        self._on_path = on_path
+        self._poll_seconds = poll_seconds
+        self._dirs = set()
+        self._seen = {}
+        self._task = loop.create_task(self._run())
+
+    def watch(self, folder: Path):
+        self._dirs.add(folder)
+
+    def unwatch(self, folder: Path):
+        self._dirs.discard(folder)
+
+    @staticmethod
+    def _scan(dirs: list) -> dict:
+        state = {}
+        for d in dirs:
+            try:
+                with os.scandir(d) as it:
+                    for e in it:
+                        if e.is_file():
+                            st = e.stat()
+                            state[Path(e.path)] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        return state
+
+    async def _run(self):
+        previous = {}
+        while True:
+            state = await asyncio.to_thread(self._scan, list(self._dirs))
+            for path, sig in state.items():
+                # Unchanged since the last poll: the writer is done with it.
+                if previous.get(path) == sig and self._seen.get(path) != sig:
+                    self._seen[path] = sig
+                    self._on_path(path)
+            # Forget files that are gone (moved requests, wiped or unwatched buses): bounded in a long run.
+            self._seen = {path: sig for path, sig in self._seen.items() if path in state}
+            previous = state
+            await asyncio.sleep(self._poll_seconds)
+
+    def close(self):
+        self._task.cancel()
+
+
+def _watcher(loop, on_path, config: dict):
+    if config.get("daemon_inotify", True) and sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(loop, on_path)
+        except (OSError, AttributeError) as e:
+            print(f"Daemon: inotify not available ({e}), polling the bus instead.")
+    return _PollingWatcher(loop, on_path, float(config.get("daemon_poll_seconds", 0.5)))
+
+
+def _accept_case(case_config: dict, base_dir: Path, request: Path) -> dict:
+    # Runs in a worker thread: prepares the case namespace, moves the request out of the inbox.
+    bus = base_dir / case_config["bus_dir"]
+    out = base_dir / case_config["output_dir"]
+    ensure_dir(bus)
+    ensure_dir(out)
+    wipe_bus(bus)
+    os.replace(request, bus / "case_request.json")
+    log_path = out / f"runlog_{case_config['case_id']}.jsonl"
+    configure_runlog(log_path, case_config)
+    append_runlog(log_path, "Coordinator", "TASK_START", {"case_id": case_config["case_id"], "daemon": True})
+    return {"config": case_config, "bus": bus, "log_path": log_path}
+
+
+async def serve(config: dict, base_dir: Path, stop: asyncio.Event = None, exit_after: int = None) -> dict:
+    # Runs until `stop` is set (or exit_after cases have finished). Returns {case_id: True/False}.
+    loop = asyncio.get_running_loop()
+    inbox = inbox_dir(config, base_dir)
+    ensure_dir(inbox)
+    rejected = inbox / "rejected"
+    defaults = {k: v for k, v in config.items() if k not in _DAEMON_KEYS}
+    max_cases = max(1, int(config.get("daemon_max_cases", 2)))
+    stop = stop or asyncio.Event()
+    runlog_policy(config)  # ValueError for a bad default policy, before anything is accepted
+
+    events = asyncio.Queue()
+    watcher = _watcher(loop, events.put_nowait, config)
+    watcher.watch(inbox)
+
+    cases = {}
+    waiting = deque()
+    results = {}
+    tasks = set()
+    admitting = asyncio.Lock()
+
+    def spawn(coro):
+        task = loop.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def reject(request: Path, reason: str):
+        print(f"Daemon ERROR: case request {request.name} rejected: {reason}")
+        ensure_dir(rejected)
+        await asyncio.to_thread(os.replace, request, rejected / request.name)
+
+    async def admit():
+        async with admitting:
+            await _admit()
+
+    async def _admit():
+        while waiting and len(cases) < max_cases:
+            request, received = waiting.popleft()
+            if not request.exists():
+                continue
+            try:
+                raw = await asyncio.to_thread(read_json, request)
+            except ValueError as e:
+                await reject(request, f"invalid JSON ({e})")
+                continue
+            if not isinstance(raw, dict) or not raw.get("case_id"):
+                await reject(request, "case_id missing")
+                continue
+            if raw["case_id"] == INBOX_DIR:
+                # bus_dir/<case_id> would be the inbox itself.
+                await reject(request, f"case_id {INBOX_DIR!r} is reserved")
+                continue
+            if raw["case_id"] in cases:
+                await reject(request, f"case {raw['case_id']} is already running")
+                continue
+            case_config = case_namespace({**defaults, **raw})
+            try:
+                runlog_policy(case_config)
+            except ValueError as e:
+                await reject(request, str(e))
+                continue
+            case = await asyncio.to_thread(_accept_case, case_config, base_dir, request)
+            case.update(received=received, accepted=time.perf_counter(), arrived={}, returned={}, triggered=set(), stages={}, finished=False)
+            case["final"] = "Verifier" if case_config.get("verify_archive", False) else "Scribe"
+            cases[case_config["case_id"]] = case
+            # Watch first, then write the TaskRequest: its own event starts the Surveyor.
+            watcher.watch(case["bus"])
+            await asyncio.to_thread(write_json, case["bus"] / "00_task_request.json", task_request(case_config))
+
+    def start_ready(case: dict, role: str):
+        # Starts `role` once its message is on the bus and the upstream agent has returned OK.
+        upstream = ROLES[ROLES.index(role) - 1] if role != ROLES[0] else None
+        if case["finished"] or role in case["triggered"] or role not in case["arrived"]:
+            return
+        if upstream is not None and upstream not in case["returned"]:
+            return
+        case["triggered"].add(role)
+        spawn(run_stage(case, role, max(case["arrived"][role], case["returned"].get(upstream, 0.0))))
+
+    async def run_stage(case: dict, role: str, triggered_at: float):
+        case_config = case["config"]
+        started = time.perf_counter()
+        case["stages"][role] = {"pickup_seconds": round(started - triggered_at, 6)}
+        try:
+            ok = await asyncio.to_thread(AGENTS[role], case_config, base_dir)
+        except Exception as e:
+            print(f"Daemon ERROR: {role} failed for case {case_config['case_id']}: {e}")
+            ok = False
+        returned = time.perf_counter()
+        case["stages"][role]["seconds"] = round(returned - started, 6)
+        if not ok:
+            await asyncio.to_thread(append_runlog, case["log_path"], "Coordinator", "TASK_FAIL", {"stage": role})
+            await finish(case, False)
+        elif role == case["final"]:
+            await finish(case, True)
+        else:
+            case["returned"][role] = returned
+            start_ready(case, ROLES[ROLES.index(role) + 1])
+
+    async def finish(case: dict, ok: bool):
+        if case["finished"]:
+            return
+        case["finished"] = True
+        case_id = case["config"]["case_id"]
+        watcher.unwatch(case["bus"])
+        cases.pop(case_id, None)
+        results[case_id] = ok
+        details = {
+            "case_id": case_id,
+            "ok": ok,
+            "seconds": round(time.perf_counter() - case["accepted"], 6),
+            "queued_seconds": round(case["accepted"] - case["received"], 6),
+            "stages": case["stages"],
+        }
+        if ok:
+            await asyncio.to_thread(append_runlog, case["log_path"], "Coordinator", "TASK_END", {"case_id": case_id})
+        await asyncio.to_thread(append_runlog, case["log_path"], "Coordinator", "DAEMON_CASE", details)
+        await asyncio.to_thread(close_runlog, case["log_path"])
+        print(f"Daemon: case {case_id} {'finished OK' if ok else 'FAILED'} in {details['seconds']:.3f}s")
+        if exit_after and len(results) >= exit_after:
+            stop.set()
+        await admit()
+
+    async def route(path: Path):
+        now = time.perf_counter()
+        if path.parent == inbox:
+            if path.suffix == ".json" and not path.name.startswith("."):
+                waiting.append((path, now))
+                await admit()
+            return
+        case = cases.get(path.parent.name)
+        role = STAGES.get(path.name)
+        if case is None or role is None or path.parent != case["bus"] or role in case["arrived"]:
+            return
+        if role == "Verifier" and case["final"] != "Verifier":
+            return
+        case["arrived"][role] = now
+        start_ready(case, role)
+
+    async def router():
+        while True:
+            path = await events.get()
+            try:
+                await route(path)
+            except Exception as e:
+                print(f"Daemon ERROR: {path}: {e}")
+
+    # Requests that arrived while no daemon was running, oldest first.
+    pending = await asyncio.to_thread(lambda: sorted(inbox.glob("*.json"), key=lambda p: p.stat().st_mtime_ns))
+    for p in pending:
+        events.put_nowait(p)
+
+    print(f"Daemon: watching {inbox} ({type(watcher).__name__.strip('_')}, max {max_cases} cases)")
+    router_task = loop.create_task(router())
+    try:
+        await stop.wait()
+    finally:
+        router_task.cancel()
+        for task in list(tasks):
+            # Agent threads cannot be interrupted, let the running stages finish.
+            await asyncio.wait([task])
+        watcher.close()
+    return results
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="DFABS agent daemon")
+    sub = p.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("serve", help="run the agents as a daemon reacting to bus messages")
+    s.add_argument("config", nargs="?", default=None)
+    s.add_argument("--exit-after", type=int, default=None, help="stop after this many cases have finished")
+    q = sub.add_parser("submit", help="queue a case request (case config JSON) for a running daemon")
+    q.add_argument("case_config")
+    q.add_argument("--config", default=None, help="daemon config (for bus_dir)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    base = Path(__file__).parent
+    args = parse_args(argv)
+    cfg_path = Path(args.config) if args.config else base / "config.json"
+    config = read_json(cfg_path)
+
+    if args.command == "submit":
+        path = submit(read_json(Path(args.case_config)), config, base)
+        print(f"Daemon: submitted {path}")
+        return
+
+    async def run() -> dict:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        return await serve(config, base, stop=stop, exit_after=args.exit_after)
+
+    results = asyncio.run(run())
+    if results and not all(results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# hashcache.py (DFABS v0.4)
+#
+# ROLE
+# - Persistent hash cache for incremental re-runs of the same case (SQLite file in output_dir).
+# - A file is considered unchanged when device, inode, size and st_mtime_ns all match the
+#   values recorded by the previous run. HasherPacker then reuses the digests and copies the
+#   compressed entry from the previous archive instead of re-reading and recompressing the file.
+#
+# Design notes:
+# - SQLite is in the standard library and a single file is easy to keep next to the case outputs.
+# - Rows not seen in the latest run are pruned, so the cache only describes the current evidence set.
+# - verify_all (Coordinator --verify-all) skips lookups but still refreshes the cache.
+# - Closed cases: evict() removes the cache file (Coordinator --close-case), and rows older than
+#   hash_cache_max_age_days are dropped when the cache is opened.
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    digests TEXT NOT NULL,
+    zip_name TEXT NOT NULL,
+    arcname TEXT NOT NULL,
+    seen_run INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (dev, inode)
+)
+"""
+
+
+def cache_path(out_dir: Path, case_id: str) -> Path:
+    return out_dir / f"hashcache_{case_id}.sqlite"
+
+
+def evict(out_dir: Path, case_id: str) -> bool:
+    # Drop the whole cache of a closed case. Returns True if a cache file existed.
+    p = cache_path(out_dir, case_id)
+    if not p.exists():
+        return False
+    p.unlink()
+    return True
+
+
+class HashCache:
+    def __init__(self, db_path: Path, max_age_days: float = 0, run_id: int = None):
+        # run_id: reuse the id of an interrupted run (resume), so rows it already stored are kept.
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute(_SCHEMA)
+        if run_id is None:
+            row = self.conn.execute("SELECT COALESCE(MAX(seen_run), 0) FROM files").fetchone()
+            run_id = row[0] + 1
+        self.run_id = run_id
+        self.hits = 0
+        self.misses = 0
+        if max_age_days:
+            self.conn.execute("DELETE FROM files WHERE seen_at < ?", (time.time() - max_age_days * 86400,))
+        self.conn.commit()
+
+    def lookup(self, dev: int, inode: int, size: int, mtime_ns: int, algorithms: list):
+        row = self.conn.execute(
+            "SELECT digests, zip_name, arcname FROM files WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (dev, inode, size, mtime_ns),
+        ).fetchone()
+        if row is not None:
+            digests = json.loads(row[0])
+            if all(a in digests for a in algorithms):
+                self.hits += 1
+                found = {a: digests[a] for a in algorithms}
+                if "merkle" in digests:
+                    found["merkle"] = digests["merkle"]
+                return {"digests": found, "zip_name": row[1], "arcname": row[2]}
+        self.misses += 1
+        return None
+
+    def store(self, dev: int, inode: int, size: int, mtime_ns: int, path: str, digests: dict, zip_name: str, arcname: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (dev, inode, size, mtime_ns, path, json.dumps(digests), zip_name, arcname, self.run_id, time.time()),
+        )
+
+    def commit(self):
+        # Checkpoint: make the rows stored so far durable.
+        self.conn.commit()
+
+    def close(self, prune: bool = True):
+        # One transaction for the whole run; rows of files that were not seen this run are dropped.
+        if prune:
+            self.conn.execute("DELETE FROM files WHERE seen_run != ?", (self.run_id,))
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,205 @@
+# instrument.py (DFABS v0.4)
+#
+# ROLE
+# - Stage spans for the Coordinator: where does the time of a case go? Each stage (Surveyor,
+#   HasherPacker, Scribe, Verifier) is measured and written as a STAGE runlog record, and the case
+#   ends with a RUN_SUMMARY record (Coordinator agent) that lists all stages side by side.
+#
+# Measured per stage:
+# - wall and CPU time (this process and reaped worker processes, getrusage), CPU utilisation
+# - bytes read/written: logical (rchar/wchar) and storage (read_bytes/write_bytes) from /proc/self/io
+#   on Linux; block counts from getrusage elsewhere
+# - files and evidence bytes, files/s and MB/s, taken from the agent's own runlog record
+#   (DISCOVERY, HASH_AND_ZIP, QUEUE_MERGE, REPORT, VERIFY)
+# - peak RSS (getrusage, process lifetime peak) and, with "trace_memory": true, the tracemalloc peak of
+#   the stage (tracemalloc slows Python code down, so it is off by default)
+# - with --profile ("profile": true) a cProfile dump per stage: output/profile_<case_id>/<stage>.prof
+#   (python3 -m pstats <file>). cProfile follows the Coordinator thread, i.e. the agent's main loop and
+#   writer; pool threads and worker processes are covered by the CPU and I/O figures only.
+#
+# Design notes:
+# - Counters are process-wide: with several cases running at once (--cases) the CPU/I/O figures of
+#   a stage include the other cases' work; wall time and file counts stay per case.
+# - Without the resource module (Windows) CPU time comes from os.times(), block counts and peak RSS
+#   are recorded as None.
+
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from common import add_runlog_listener, append_runlog, ensure_dir, flush_runlogs, remove_runlog_listener
+
+# Agent runlog actions that carry the stage's file/byte counts.
+_COUNTS = {
+    "DISCOVERY": lambda d: (d.get("files"), None),
+    "HASH_AND_ZIP": lambda d: (d.get("files"), (d.get("stage_throughput") or {}).get("bytes")),
+    "QUEUE_MERGE": lambda d: (d.get("files"), None),
+    "REPORT": lambda d: (d.get("rows"), None),
+    "VERIFY": lambda d: (d.get("verified"), (d.get("throughput") or {}).get("bytes")),
+}
+
+
+def _io_counters() -> dict:
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            raw = dict(line.split(":", 1) for line in f if ":" in line)
+        return {k: int(raw[k]) for k in ("rchar", "wchar", "read_bytes", "write_bytes")}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _usage() -> dict:
+    if resource is None:
+        t = os.times()
+        return {
+            "cpu": t.user + t.system + t.children_user + t.children_system,
+            "inblock": None,
+            "oublock": None,
+            "peak_rss_kb": None,
+            "children_peak_rss_kb": None,
+        }
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "cpu": own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime,
+        "inblock": own.ru_inblock + kids.ru_inblock,
+        "oublock": own.ru_oublock + kids.ru_oublock,
+        "peak_rss_kb": own.ru_maxrss // scale,
+        "children_peak_rss_kb": kids.ru_maxrss // scale,
+    }
+
+
+def _rate(n, seconds: float, unit: float = 1):
+    return round(n / unit / seconds, 3) if n is not None and seconds > 0 else None
+
+
+class Span:
+    def __init__(self, spans: "Spans", name: str):
+        self.spans = spans
+        self.name = name
+        self.ok = True
+        self.files = None
+        self.nbytes = None
+        self.details = None
+        self._profiler = None
+        self._traced = False
+
+    def _observe(self, log_path: Path, record: dict):
+        # Counts come from the agent's runlog record for this case (same log file).
+        count = _COUNTS.get(record["action"])
+        if count is not None and os.path.abspath(log_path) == os.path.abspath(self.spans.log_path):
+            files, nbytes = count(record["details"])
+            if files is not None:
+                self.files = files
+            if nbytes is not None:
+                self.nbytes = nbytes
+
+    def __enter__(self):
+        add_runlog_listener(self._observe)
+        if self.spans.trace_memory:
+            self._traced = not tracemalloc.is_tracing()
+            if self._traced:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._usage = _usage()
+        self._io = _io_counters()
+        if self.spans.profile_dir is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._t0
+        if self._profiler is not None:
+            self._profiler.disable()
+        remove_runlog_listener(self._observe)
+        usage = _usage()
+        io = _io_counters()
+        if exc_type is not None:
+            self.ok = False
+
+        cpu = usage["cpu"] - self._usage["cpu"]
+        details = {
+            "stage": self.name,
+            "ok": self.ok,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "cpu_util": round(cpu / wall, 3) if wall > 0 else None,
+            "files": self.files,
+            "bytes": self.nbytes,
+            "files_per_s": _rate(self.files, wall),
+            "mb_per_s": _rate(self.nbytes, wall, 1024 * 1024),
+        }
+        if io:
+            details["io"] = {k: io[k] - self._io[k] for k in io}
+        elif usage["inblock"] is not None:
+            details["io"] = {k: usage[k] - self._usage[k] for k in ("inblock", "oublock")}
+        else:
+            details["io"] = {}
+        details["peak_rss_kb"] = usage["peak_rss_kb"]
+        details["children_peak_rss_kb"] = usage["children_peak_rss_kb"]
+        if self.spans.trace_memory:
+            details["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            if self._traced:
+                tracemalloc.stop()
+        if self._profiler is not None:
+            ensure_dir(self.spans.profile_dir)
+            prof = self.spans.profile_dir / f"{self.name.replace('+', '_')}.prof"
+            self._profiler.dump_stats(str(prof))
+            details["profile"] = str(prof)
+
+        self.details = details
+        self.spans.stages.append(details)
+        append_runlog(self.spans.log_path, "Coordinator", "STAGE", details)
+        flush_runlogs()
+        return False
+
+
+class Spans:
+    # The spans of one case run.
+    def __init__(self, log_path: Path, profile_dir: Path = None, trace_memory: bool = False):
+        self.log_path = Path(log_path)
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._t0 = time.perf_counter()
+        self._usage = _usage()
+
+    def stage(self, name: str) -> Span:
+        return Span(self, name)
+
+    def summary(self, case_id: str, ok: bool) -> dict:
+        wall = time.perf_counter() - self._t0
+        usage = _usage()
+        details = {
+            "case_id": case_id,
+            "ok": ok,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(usage["cpu"] - self._usage["cpu"], 6),
+            "peak_rss_kb": usage["peak_rss_kb"],
+            "slowest_stage": max(self.stages, key=lambda s: s["wall_seconds"])["stage"] if self.stages else None,
+            "stages": {
+                s["stage"]: {
+                    "wall_seconds": s["wall_seconds"],
+                    "share": round(s["wall_seconds"] / wall, 3) if wall > 0 else None,
+                    "cpu_seconds": s["cpu_seconds"],
+                    "files_per_s": s["files_per_s"],
+                    "mb_per_s": s["mb_per_s"],
+                }
+                for s in self.stages
+            },
+        }
+        append_runlog(self.log_path, "Coordinator", "RUN_SUMMARY", details)
+        flush_runlogs()
+        return details
@@ -0,0 +1,179 @@
+# iosched.py (DFABS v0.4)
+#
+# ROLE
+# - Locality-aware read scheduling for HasherPacker ("read_order", "read_fadvise"). On spinning disks and
+#   NFS the order in which files are read matters more than the hashing itself: os.walk order jumps
+#   around the disk, every file costs a seek and readahead never gets going.
+# - The discovery records are taken in windows of read_window files. Each window is read in locality order:
+#     "inode"   by (device, inode), free with the Surveyor records (inode order follows allocation order
+#               on ext4/xfs closely enough to cut most seeks)
+#     "extent"  by (device, physical offset of the first extent), FIEMAP ioctl (Linux: ext4, xfs, btrfs);
+#               files without a mapping (tmpfs, NFS, inline data) fall back to the inode order
+#   Results still come back in discovery order (ordered_map), so archive and report do not change.
+# - read_fadvise: POSIX_FADV_SEQUENTIAL on every read (bigger readahead), POSIX_FADV_WILLNEED for the file
+#   a worker will read next, POSIX_FADV_DONTNEED once a file is hashed and archived, so evidence that is
+#   read once does not push everything else out of the page cache.
+#
+# Design notes:
+# - Reordering only within a window keeps memory bounded: at most two windows of results are held
+#   (with compress_workers up to compress_spill_bytes each).
+# - The extent lookups open every file of the window; they are done in inode order, so the metadata
+#   reads are local too.
+# - Everything here is a hint. Without posix_fadvise/FIEMAP (macOS, Windows) the scheduler still sorts
+#   by inode and the hints are no-ops.
+
+import os
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+READ_ORDERS = ("discovery", "inode", "extent")
+
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP = struct.Struct("=QQIIII")
+_EXTENT = struct.Struct("=QQQQQIIII")
+FIEMAP_EXTENT_UNKNOWN = 0x2
+FIEMAP_EXTENT_DATA_INLINE = 0x200
+
+_LAST = (sys.maxsize,)
+
+
+def _advise(path: str, advice_name: str) -> bool:
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def prefetch(path: str) -> bool:
+    # Starts readahead of the whole file in the background (page cache), returns at once.
+    return _advise(path, "POSIX_FADV_WILLNEED")
+
+
+def drop_cache(path: str) -> bool:
+    # Releases the file's clean pages from the page cache.
+    return _advise(path, "POSIX_FADV_DONTNEED")
+
+
+def physical_offset(path: str):
+    # Byte offset of the file's first extent on its device, or None (no FIEMAP, empty file, no mapping).
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return None
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        buf = bytearray(_FIEMAP.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(_EXTENT.size))
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    if _FIEMAP.unpack_from(buf)[3] == 0:
+        return None
+    fields = _EXTENT.unpack_from(buf, _FIEMAP.size)
+    if fields[5] & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DATA_INLINE):
+        return None
+    return fields[1]
+
+
+def _inode_key(it: dict) -> tuple:
+    try:
+        return (it["dev"], it["inode"])
+    except KeyError:
+        pass
+    try:
+        st = os.stat(it["path"])
+    except OSError:
+        return _LAST
+    return (st.st_dev, st.st_ino)
+
+
+class ReadScheduler:
+    def __init__(self, order: str = "discovery", window: int = 64, fadvise: bool = False, prefetch_bytes: int = 8 * 1024 * 1024):
+        self.order = order
+        self.window = window
+        self.fadvise = fadvise
+        self.prefetch_bytes = prefetch_bytes
+        self.windows = 0
+        self.reordered = 0
+        self.physical = 0
+        self.dropped = 0
+
+    def plan(self, batch: list, lookahead: int = 1) -> list:
+        # ordered_map order hook: [(index in batch, job item)] in read order. Items that are not read
+        # (hash cache hits) keep their place at the end. With fadvise, each job carries "_prefetch", the
+        # file `lookahead` reads later (the one that starts when this job's worker is free again).
+        self.windows += 1
+        reads = [i for i, it in enumerate(batch) if "_cached" not in it]
+        skipped = [i for i, it in enumerate(batch) if "_cached" in it]
+        if self.order != "discovery":
+            keys = {i: _inode_key(batch[i]) for i in reads}
+            reads.sort(key=keys.__getitem__)
+            if self.order == "extent":
+                # Lookups in inode order; files without a mapping sort after the mapped ones of their device.
+                for i in reads:
+                    offset = physical_offset(batch[i]["path"]) if keys[i] is not _LAST else None
+                    if offset is not None:
+                        self.physical += 1
+                        keys[i] = (keys[i][0], 0, offset)
+                    elif keys[i] is not _LAST:
+                        keys[i] = (keys[i][0], 1, keys[i][1])
+                reads.sort(key=keys.__getitem__)
+            self.reordered += sum(1 for a, b in zip(reads, sorted(reads)) if a != b)
+
+        jobs = [(i, batch[i]) for i in reads]
+        if self.fadvise:
+            for k in range(len(jobs) - lookahead):
+                nxt = jobs[k + lookahead][1]
+                if nxt.get("size", 0) <= self.prefetch_bytes:
+                    jobs[k] = (jobs[k][0], dict(jobs[k][1], _prefetch=nxt["path"]))
+        return jobs + [(i, batch[i]) for i in skipped]
+
+    def done(self, path: str):
+        # Called by the writer once the file is hashed and archived (no further reads).
+        if self.fadvise and drop_cache(path):
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "order": self.order,
+            "window": self.window,
+            "fadvise": self.fadvise,
+            "windows": self.windows,
+            "reordered": self.reordered,
+            "physical_offsets": self.physical if self.order == "extent" else None,
+            "dropped": self.dropped,
+        }
+
+
+def read_scheduler(config: dict):
+    # ReadScheduler from the config, or None when reads stay in discovery order without hints.
+    # Raises ValueError for an unknown read_order.
+    order = config.get("read_order", "discovery")
+    if order not in READ_ORDERS:
+        raise ValueError(f"unsupported read_order: {order} (use one of {', '.join(READ_ORDERS)})")
+    fadvise = bool(config.get("read_fadvise", False))
+    if order == "discovery" and not fadvise:
+        return None
+    return ReadScheduler(
+        order,
+        max(1, int(config.get("read_window", 64))),
+        fadvise,
+        int(config.get("read_prefetch_bytes", 8 * 1024 * 1024)),
+    )
@@ -0,0 +1,305 @@
+# knownhashes.py (DFABS v0.4)
+#
+# ROLE
+# - Known-file hash sets (NSRL-style reference sets of OS/application files). HasherPacker records files
+#   whose digest is in a set as "known" in the HashResult and the report, but does not archive them.
+# - Index build (offline, once per reference set release):
+#     python3 knownhashes.py build nsrl_sha256.kh hashes.txt [more.txt ...] [--algorithm sha256] [--fp-rate 0.001]
+#   Any text file works as source: the first hex field of the algorithm's digest length on each line is
+#   used (plain lists, sha256sum output, NSRL RDS CSV). Other lines are skipped.
+#
+# Index file layout (<.kh>, little endian):
+#   header   64 bytes: magic, algorithm, digest size, bloom k, bloom bits m, entries n
+#   fanout   65537 x uint64: index of the first digest for each 2-byte prefix
+#   bloom    m / 64 x uint64
+#   digests  n x digest size, sorted and unique (raw bytes, no hex)
+#
+# Design notes:
+# - Loading only maps the file (mmap), so a 100M-entry set costs no parsing at startup; the OS pages in
+#   what lookups touch.
+# - Most evidence files are not in the set: the bloom filter answers those from memory. Only bloom hits go
+#   to the exact table, where the fanout narrows a binary search to a few entries. A bloom false positive
+#   therefore never marks a file as known.
+# - Register-blocked bloom filter: all k bits of an entry fall into one 64-bit word, so a lookup reads
+#   one word instead of k scattered bytes. The false positive rate is a few times higher than a classic
+#   bloom filter of the same size, which only costs some extra exact lookups.
+#   Digests are already uniformly distributed: the word comes from the first 8 digest bytes and the
+#   bit mask from the following k bytes, nothing is hashed again.
+# - The build sorts in runs of chunk_entries digests and merges them (heapq.merge), memory stays bounded.
+
+import argparse
+import array
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MAGIC = b"DFABSKH1"
+_HEADER = struct.Struct("<8s16sIIQQ")
+HEADER_SIZE = 64
+FANOUT_ENTRIES = 65537
+
+DIGEST_SIZES = {"md5": 16, "sha1": 20, "sha256": 32, "sha512": 64, "blake2b": 64}
+
+
+def _block(d: bytes, k: int, words: int) -> tuple:
+    # (word index, mask with up to k bits set) of one digest.
+    mask = 0
+    for b in d[8:8 + k]:
+        mask |= 1 << (b & 63)
+    return int.from_bytes(d[:8], "little") % words, mask
+
+
+def bloom_size(n: int, fp_rate: float, digest_size: int = 32) -> tuple:
+    # (k, m bits) for n entries at the target false positive rate; m rounded up to whole 64-bit words.
+    # k is capped by the digest bytes left after the word index (8 for md5).
+    n = max(1, n)
+    m = math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2))
+    m = max(64, -(-m // 64) * 64)
+    k = max(1, min(round(m / n * math.log(2)), digest_size - 8, 16))
+    return k, m
+
+
+def _parse(sources: list, digest_size: int):
+    pattern = re.compile(rb"(?<![0-9A-Fa-f])[0-9A-Fa-f]{%d}(?![0-9A-Fa-f])" % (digest_size * 2))
+    for src in sources:
+        with open(src, "rb") as f:
+            for line in f:
+                m = pattern.search(line)
+                if m:
+                    yield bytes.fromhex(m.group().decode("ascii"))
+
+
+def _read_run(path: str, digest_size: int):
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(digest_size * 4096)
+            if not block:
+                return
+            for i in range(0, len(block), digest_size):
+                yield block[i:i + digest_size]
+
+
+def build(out_path: Path, sources: list, algorithm: str = "sha256", fp_rate: float = 0.001, chunk_entries: int = 2_000_000) -> dict:
+    if algorithm not in DIGEST_SIZES:
+        raise ValueError(f"unsupported known hash algorithm: {algorithm}")
+    digest_size = DIGEST_SIZES[algorithm]
+    out_path = Path(out_path)
+    t0 = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=out_path.parent) as tmp:
+        # 1) sorted runs
+        runs = []
+        chunk = []
+        total = 0
+        for d in _parse(sources, digest_size):
+            chunk.append(d)
+            total += 1
+            if len(chunk) >= chunk_entries:
+                runs.append(_write_run(tmp, len(runs), chunk))
+                chunk = []
+        if chunk and runs:
+            runs.append(_write_run(tmp, len(runs), chunk))
+            chunk = []
+        merged = heapq.merge(*(_read_run(r, digest_size) for r in runs)) if runs else iter(sorted(chunk))
+
+        # 2) one merge pass: unique digests to a temp file, fanout counts and bloom bits on the way.
+        #    The bloom is sized from the entry count before dedup (an upper bound of n).
+        k, m = bloom_size(total, fp_rate, digest_size)
+        words = m // 64
+        bloom = array.array("Q", bytes(m // 8))
+        counts = [0] * 65536
+        n = 0
+        last = None
+        body = os.path.join(tmp, "digests")
+        with open(body, "wb") as f:
+            for d in merged:
+                if d == last:
+                    continue
+                last = d
+                f.write(d)
+                counts[d[0] << 8 | d[1]] += 1
+                w, mask = _block(d, k, words)
+                bloom[w] |= mask
+                n += 1
+
+        fanout = array.array("Q", [0] * FANOUT_ENTRIES)
+        for i in range(65536):
+            fanout[i + 1] = fanout[i] + counts[i]
+
+        # 3) final file under a temporary name, replaced atomically.
+        part = out_path.with_name(out_path.name + ".tmp")
+        with open(part, "wb") as f:
+            header = _HEADER.pack(MAGIC, algorithm.encode("ascii"), digest_size, k, m, n)
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            if sys.byteorder == "big":
+                fanout.byteswap()
+                bloom.byteswap()
+            f.write(fanout.tobytes())
+            f.write(bloom.tobytes())
+            with open(body, "rb") as src:
+                while True:
+                    block = src.read(1024 * 1024)
+                    if not block:
+                        break
+                    f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part, out_path)
+
+    return {"entries": n, "parsed": total, "algorithm": algorithm, "bloom_k": k, "bloom_bits": m, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def _write_run(tmp: str, index: int, chunk: list) -> str:
+    chunk.sort()
+    path = os.path.join(tmp, f"run_{index:04d}")
+    with open(path, "wb") as f:
+        f.write(b"".join(chunk))
+    return path
+
+
+class KnownHashes:
+    # One index file, memory-mapped read-only.
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.name = self.path.stem
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER_SIZE:
+            self._mm.close()
+            raise ValueError(f"not a known hash index: {self.path}")
+        magic, algorithm, self.digest_size, self.k, self.m, self.entries = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"not a known hash index: {self.path}")
+        self.algorithm = algorithm.rstrip(b"\0").decode("ascii")
+        self._fanout_at = HEADER_SIZE
+        self._bloom_at = self._fanout_at + FANOUT_ENTRIES * 8
+        self._digests_at = self._bloom_at + self.m // 8
+        if len(self._mm) != self._digests_at + self.entries * self.digest_size:
+            self._mm.close()
+            raise ValueError(f"known hash index truncated or corrupt: {self.path}")
+        self.lookups = 0
+        self.bloom_hits = 0
+        self.matches = 0
+
+    def __contains__(self, hexdigest: str) -> bool:
+        self.lookups += 1
+        try:
+            d = bytes.fromhex(hexdigest)
+        except ValueError:
+            return False
+        if len(d) != self.digest_size:
+            return False
+        mm = self._mm
+        w, mask = _block(d, self.k, self.m // 64)
+        if int.from_bytes(mm[self._bloom_at + w * 8:self._bloom_at + w * 8 + 8], "little") & mask != mask:
+            return False
+        self.bloom_hits += 1
+
+        prefix = d[0] << 8 | d[1]
+        lo, hi = struct.unpack_from("<QQ", mm, self._fanout_at + prefix * 8)
+        size = self.digest_size
+        base = self._digests_at
+        while lo < hi:
+            mid = (lo + hi) // 2
+            at = base + mid * size
+            probe = mm[at:at + size]
+            if probe == d:
+                self.matches += 1
+                return True
+            if probe < d:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def stats(self) -> dict:
+        return {"set": self.name, "algorithm": self.algorithm, "entries": self.entries, "lookups": self.lookups, "bloom_hits": self.bloom_hits, "matches": self.matches}
+
+    def close(self):
+        self._mm.close()
+
+
+class KnownSets:
+    # All sets of known_hashes; a file is known when any set contains its digest.
+    def __init__(self, sets: list):
+        self.sets = sets
+
+    @property
+    def names(self) -> list:
+        return [s.name for s in self.sets]
+
+    def match(self, digests: dict):
+        # Name of the first set that contains the file, or None.
+        for s in self.sets:
+            value = digests.get(s.algorithm)
+            if value and value in s:
+                return s.name
+        return None
+
+    def stats(self) -> list:
+        return [s.stats() for s in self.sets]
+
+    def close(self):
+        for s in self.sets:
+            s.close()
+
+
+def open_known(config: dict, base_dir: Path, algorithms: list):
+    # KnownSets from config["known_hashes"] (one path or a list, relative to base_dir), or None.
+    # Raises ValueError when an index is unusable or its algorithm is not computed in this run.
+    paths = config.get("known_hashes") or []
+    if isinstance(paths, str):
+        paths = [paths]
+    sets = []
+    try:
+        for p in paths:
+            try:
+                s = KnownHashes(base_dir / p)
+            except OSError as e:
+                raise ValueError(f"cannot open known hash index {p}: {e}")
+            sets.append(s)
+            if s.algorithm not in algorithms:
+                raise ValueError(f"known hash index {p} uses {s.algorithm}, add it to hash_algorithms")
+    except ValueError:
+        for s in sets:
+            s.close()
+        raise
+    return KnownSets(sets) if sets else None
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="DFABS known-file hash index")
+    sub = p.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="build an index from hash list files")
+    b.add_argument("out")
+    b.add_argument("sources", nargs="+")
+    b.add_argument("--algorithm", default="sha256", choices=sorted(DIGEST_SIZES))
+    b.add_argument("--fp-rate", type=float, default=0.001, help="bloom filter false positive rate")
+    i = sub.add_parser("info", help="show the header of an index")
+    i.add_argument("index")
+    args = p.parse_args(argv)
+
+    if args.command == "build":
+        stats = build(Path(args.out), args.sources, args.algorithm, args.fp_rate)
+        print(f"Known hashes: {stats['entries']} unique {stats['algorithm']} digests ({stats['parsed']} parsed) in {stats['seconds']}s")
+        print(f"- {args.out}")
+        return
+    try:
+        s = KnownHashes(Path(args.index))
+    except ValueError as e:
+        print(f"Known hashes ERROR: {e}")
+        sys.exit(1)
+    print(f"{s.path}: {s.entries} {s.algorithm} digests, bloom k={s.k} m={s.m} bits")
+    s.close()
+
+
+if __name__ == "__main__":
+    main()
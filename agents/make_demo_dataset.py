@@ -2,13 +2,147 @@
 #
 # Creates a small folder tree with a file "truth-set" for the submission, in this way we create repeatable evidence to showcase, test, demos, etc.
 # This makes it easy to show evidence of execution.
+#
+# Synthetic mode (--synthetic DIR) generates a parameterised, reproducible (seeded) evidence tree
+# for benchmarks: file count, directory depth/fan-out, size distribution, duplicate ratio,
+# compressibility and extension mix. See benchmark.py.
 
+import argparse
+import json
+import math
+import os
+import random
+import shutil
 from pathlib import Path
 
 BASE = Path(__file__).parent
 DEMO = BASE / "demo_case_data"
 
-def main():
+# Text used for the compressible part of synthetic files.
+_WORDS = (
+    "evidence custody forensic hash archive report disk image mailbox attachment invoice "
+    "contract meeting transfer account password server backup export keyword note"
+).split()
+
+
+def parse_size_dist(spec: str):
+    # "fixed:N", "uniform:MIN:MAX" or "lognormal:MEDIAN:SIGMA" (bytes). Returns a function rng -> size.
+    kind, *args = spec.split(":")
+    nums = [float(a) for a in args]
+    if kind == "fixed" and len(nums) == 1:
+        return lambda rng: int(nums[0])
+    if kind == "uniform" and len(nums) == 2:
+        return lambda rng: rng.randint(int(nums[0]), int(nums[1]))
+    if kind == "lognormal" and len(nums) == 2:
+        # Median/sigma is closer to real collections (many small files, a long tail of big ones).
+        mu = math.log(max(nums[0], 1.0))
+        return lambda rng: int(rng.lognormvariate(mu, nums[1]))
+    raise ValueError(f"bad size distribution: {spec}")
+
+
+def parse_ext_mix(spec: str) -> list:
+    # ".txt:5,.pdf:1,.jpg:1" -> [(".txt", 5.0), (".pdf", 1.0), (".jpg", 1.0)]
+    mix = []
+    for part in spec.split(","):
+        ext, _, weight = part.partition(":")
+        mix.append((ext.strip(), float(weight or 1)))
+    return mix
+
+
+# Files are written in pieces of this size, so large synthetic files never sit in memory whole.
+CHUNK_BYTES = 1024 * 1024
+
+
+def _content(rng: random.Random, size: int, compressibility: float):
+    # Yields the file contents in chunks of at most CHUNK_BYTES.
+    # compressibility 1.0 -> only repetitive text, 0.0 -> only random bytes.
+    text_len = int(size * compressibility)
+    pending = bytearray()
+    emitted = 0
+    while emitted + len(pending) < text_len:
+        pending += rng.choice(_WORDS).encode("ascii") + b" "
+        if len(pending) >= CHUNK_BYTES:
+            yield bytes(pending[:CHUNK_BYTES])
+            emitted += CHUNK_BYTES
+            del pending[:CHUNK_BYTES]
+    if pending:
+        tail = bytes(pending[: text_len - emitted])
+        emitted += len(tail)
+        yield tail
+    while emitted < size:
+        n = min(CHUNK_BYTES, size - emitted)
+        yield rng.randbytes(n)
+        emitted += n
+
+
+def _dir_paths(depth: int, fanout: int) -> list:
+    # All directories of a full tree with the given depth and fan-out ("" is the root).
+    dirs = [""]
+    level = [""]
+    for _ in range(depth):
+        level = [os.path.join(d, f"d{i:02d}") for d in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def generate(
+    out_dir: Path,
+    files: int = 1000,
+    depth: int = 2,
+    fanout: int = 4,
+    size_dist: str = "lognormal:4096:1.5",
+    dup_ratio: float = 0.1,
+    compressibility: float = 0.5,
+    ext_mix: str = ".txt:6,.pdf:1,.jpg:1,.doc:1",
+    seed: int = 1,
+) -> dict:
+    rng = random.Random(seed)
+    sizes = parse_size_dist(size_dist)
+    mix = parse_ext_mix(ext_mix)
+    exts = [e for e, _ in mix]
+    weights = [w for _, w in mix]
+    dirs = _dir_paths(depth, fanout)
+
+    written = []
+    total_bytes = 0
+    duplicates = 0
+    for i in range(files):
+        rel_dir = dirs[i % len(dirs)]
+        ext = rng.choices(exts, weights)[0]
+        target = out_dir / rel_dir / f"file{i:07d}{ext}"
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        if written and rng.random() < dup_ratio:
+            # Byte-identical copy of an earlier file (mail attachment / synced folder style).
+            with rng.choice(written).open("rb") as src, target.open("wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_BYTES)
+            duplicates += 1
+        else:
+            with target.open("wb") as dst:
+                for chunk in _content(rng, max(0, sizes(rng)), compressibility):
+                    dst.write(chunk)
+        written.append(target)
+        total_bytes += target.stat().st_size
+
+    return {
+        "out_dir": str(out_dir),
+        "files": files,
+        "bytes": total_bytes,
+        "duplicates": duplicates,
+        "directories": len(dirs),
+        "params": {
+            "depth": depth,
+            "fanout": fanout,
+            "size_dist": size_dist,
+            "dup_ratio": dup_ratio,
+            "compressibility": compressibility,
+            "ext_mix": ext_mix,
+            "seed": seed,
+        },
+    }
+
+
+def make_demo():
     DEMO.mkdir(parents=True, exist_ok=True)
     (DEMO / "docs").mkdir(exist_ok=True)
     (DEMO / "other").mkdir(exist_ok=True)
@@ -25,5 +159,37 @@ def main():
 
     print(f"Demo dataset created at: {DEMO}")
 
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="DFABS demo / synthetic evidence generator")
+    ap.add_argument("--synthetic", metavar="DIR", help="generate a synthetic evidence tree in DIR instead of the demo set")
+    ap.add_argument("--files", type=int, default=1000)
+    ap.add_argument("--depth", type=int, default=2)
+    ap.add_argument("--fanout", type=int, default=4)
+    ap.add_argument("--size-dist", default="lognormal:4096:1.5", help="fixed:N | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA")
+    ap.add_argument("--dup-ratio", type=float, default=0.1)
+    ap.add_argument("--compressibility", type=float, default=0.5)
+    ap.add_argument("--ext-mix", default=".txt:6,.pdf:1,.jpg:1,.doc:1")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    if not args.synthetic:
+        make_demo()
+        return
+
+    summary = generate(
+        Path(args.synthetic),
+        files=args.files,
+        depth=args.depth,
+        fanout=args.fanout,
+        size_dist=args.size_dist,
+        dup_ratio=args.dup_ratio,
+        compressibility=args.compressibility,
+        ext_mix=args.ext_mix,
+        seed=args.seed,
+    )
+    print(json.dumps(summary, indent=2))
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,184 @@
+# merkle.py (DFABS v0.4)
+#
+# ROLE
+# - Chunked tree hashing (Merkle tree) for very large evidence files such as disk images.
+# - The file is split into fixed-size chunks; each chunk is a leaf, leaves are combined pairwise
+#   up to a single root. The root is stored next to the conventional whole-file digests, the leaves in a
+#   sidecar file (leaves store, see below).
+#
+# Why:
+# - Leaves are independent, so chunks are read at their own offsets (one handle per chunk, readinto a
+#   chunk-sized buffer, works on every platform) and hashed on several threads at once; one huge file no
+#   longer keeps a single core busy for all of its bytes.
+# - The whole-file SHA-256 is still required for the report and is sequential by definition, it is
+#   computed from the same chunk buffers in file order while the next chunks are being read/hashed
+#   (one read of the file in total).
+# - A stored tree lets a later check re-hash only chosen chunks (verify_chunks) and locate damage
+#   to a chunk-sized region instead of "the file changed somewhere".
+#
+# Tree layout (RFC 6962 style domain separation, so a leaf can never be confused with a node):
+#   leaf = SHA-256(0x00 || chunk), node = SHA-256(0x01 || left || right), an odd last node is
+#   carried up unchanged. An empty file has a single leaf over zero bytes.
+#
+# Leaves store:
+# - HashResult records, hash cache rows and checkpoints only carry {"chunk_bytes", "root", "chunks"}; a
+#   1 TiB image at 8 MiB chunks would otherwise put 131072 hex leaves (8.6 MB of JSON) into each of them.
+# - The leaves go to <output_dir>/merkle_leaves/<root>.leaves, 32 raw bytes per leaf. The name is the
+#   root, so identical files (and queue attempts, cases sharing an output folder) share one file, and a
+#   loaded list is checked by recomputing its root.
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from common import new_hashers, ordered_map
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _leaf(data) -> bytes:
+    h = hashlib.sha256(b"\x00")
+    h.update(data)
+    return h.digest()
+
+
+def merkle_root(leaves: list) -> bytes:
+    level = list(leaves)
+    while len(level) > 1:
+        nxt = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def _tree(chunk_size: int, leaves: list) -> dict:
+    return {"chunk_bytes": chunk_size, "root": merkle_root(leaves).hex(), "leaves": [x.hex() for x in leaves]}
+
+
+def _read_chunk(path: Path, offset: int, length: int) -> bytearray:
+    # Own unbuffered handle per chunk: no shared file position between worker threads.
+    buf = bytearray(length)
+    view = memoryview(buf)
+    got = 0
+    with open(path, "rb", buffering=0) as f:
+        f.seek(offset)
+        while got < length:
+            n = f.readinto(view[got:])
+            if not n:
+                raise OSError(f"file shrank while hashing (offset {offset + got})")
+            got += n
+    return buf
+
+
+def chunk_count(size: int, chunk_size: int) -> int:
+    return max(1, -(-size // chunk_size))
+
+
+def hash_file_tree(path: Path, algorithms: list, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 4):
+    # Returns (whole-file digests, tree). At most `workers` chunks are in memory at a time.
+    hashers = new_hashers(algorithms)
+    size = os.stat(path).st_size
+
+    def job(i: int):
+        data = _read_chunk(path, i * chunk_size, min(chunk_size, size - i * chunk_size))
+        return _leaf(data), data
+
+    leaves = []
+    for _, (leaf, data) in ordered_map(job, range(chunk_count(size, chunk_size)), workers=workers, window=workers):
+        leaves.append(leaf)
+        for h in hashers.values():
+            h.update(data)
+    return {name: h.hexdigest() for name, h in hashers.items()}, _tree(chunk_size, leaves)
+
+
+class MerkleBuilder:
+    # Same tree from a sequential stream (single-pass / precompressed modes, which already read in order).
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.leaves = []
+        self._h = hashlib.sha256(b"\x00")
+        self._n = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.chunk_size - self._n)
+            self._h.update(view[:take])
+            self._n += take
+            view = view[take:]
+            if self._n == self.chunk_size:
+                self.leaves.append(self._h.digest())
+                self._h = hashlib.sha256(b"\x00")
+                self._n = 0
+
+    def tree(self) -> dict:
+        leaves = self.leaves
+        if self._n or not leaves:
+            leaves = leaves + [self._h.digest()]
+        return _tree(self.chunk_size, leaves)
+
+
+def verify_chunks(path: Path, tree: dict, indices=None, workers: int = 4) -> list:
+    # Re-hash the given chunks (default: all) and return the indices that no longer match the tree.
+    # Chunks past the current end of the file count as damaged.
+    chunk_size = tree["chunk_bytes"]
+    leaves = tree["leaves"]
+    size = os.stat(path).st_size
+
+    def job(i: int) -> bool:
+        offset = i * chunk_size
+        if offset > size or (offset == size and i > 0):
+            return False
+        try:
+            data = _read_chunk(path, offset, min(chunk_size, size - offset))
+        except OSError:
+            return False
+        return _leaf(data).hex() == leaves[i]
+
+    todo = range(len(leaves)) if indices is None else sorted(set(indices))
+    return [i for i, ok in ordered_map(job, todo, workers=workers) if not ok]
+
+
+def diff_trees(a: dict, b: dict) -> list:
+    # Chunk indices that differ between two trees of the same chunk size (e.g. original vs. copy).
+    if a["chunk_bytes"] != b["chunk_bytes"]:
+        raise ValueError("trees use different chunk sizes")
+    if a["root"] == b["root"]:
+        return []
+    n = max(len(a["leaves"]), len(b["leaves"]))
+    return [i for i in range(n) if i >= len(a["leaves"]) or i >= len(b["leaves"]) or a["leaves"][i] != b["leaves"][i]]
+
+
+def leaves_dir(out_dir: Path) -> Path:
+    return out_dir / "merkle_leaves"
+
+
+def _leaves_path(store: Path, root: str) -> Path:
+    return Path(store) / f"{root}.leaves"
+
+
+def store_tree(store: Path, tree: dict) -> dict:
+    # Writes the leaves to the store (once per root) and returns the tree without them, as recorded.
+    path = _leaves_path(store, tree["root"])
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+            f.write(b"".join(bytes.fromhex(x) for x in tree["leaves"]))
+        os.replace(f.name, path)
+    return {"chunk_bytes": tree["chunk_bytes"], "root": tree["root"], "chunks": len(tree["leaves"])}
+
+
+def has_tree(store: Path, tree: dict) -> bool:
+    return _leaves_path(store, tree["root"]).exists()
+
+
+def load_tree(store: Path, tree: dict) -> dict:
+    # Full tree (with leaves) for a recorded one. Raises OSError when the leaves file is missing,
+    # ValueError when it does not hash to the recorded root.
+    data = _leaves_path(store, tree["root"]).read_bytes()
+    leaves = [data[i:i + 32] for i in range(0, len(data), 32)]
+    if not leaves or len(data) % 32 or merkle_root(leaves).hex() != tree["root"]:
+        raise ValueError(f"Merkle leaves of {tree['root']} do not match the root")
+    return _tree(tree["chunk_bytes"], leaves)
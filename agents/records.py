@@ -0,0 +1,194 @@
+# records.py (DFABS v0.4)
+#
+# ROLE
+# - Compact in-memory store for file records (Surveyor discovery records, HashResult records), used by
+#   RecordSink for bus_format "json" and for inline record lists loaded from the bus.
+# - A plain dict per file repeats the root, root_name and directory strings and keeps digests as hex text,
+#   which adds up to about a kilobyte per file. The store keeps the same information in columns:
+#     - ints (size, dev, inode, mtime_ns, shard)      array("q"), 8 bytes each
+#     - compress_ratio                                array("d")
+#     - true/false/null flags (duplicate, from_cache) part of the record's key layout, no storage
+#     - low-cardinality strings (root, root_name, ext,
+#       compression, known)                           index into one interned string table
+#     - path-like strings (path, rel_path, arcname)   interned directory + one shared file name per record
+#     - digests (sha256, md5, ...)                    raw bytes (32 bytes for SHA-256 instead of 64 chars)
+#     - anything else (flags, errors, merkle trees)   kept as-is in a sparse per-record dict
+# - Records go back to the usual dict shape only when read (iteration, serialization), with the keys in
+#   their original order, so bus messages are byte-for-byte the same as before.
+#
+# Design notes:
+# - Every record keeps its key layout ("shape", shared between records with the same keys), so a record
+#   with a missing or unusual field (error records, "" digests) is reproduced exactly.
+# - A value that does not fit its column type (e.g. an upper-case digest, a huge int) goes into the sparse
+#   dict, so the conversion is always lossless.
+
+import array
+import hashlib
+import os
+
+INT_FIELDS = frozenset(("size", "dev", "inode", "mtime_ns", "shard"))
+FLOAT_FIELDS = frozenset(("compress_ratio",))
+INTERN_FIELDS = frozenset(("root", "root_name", "ext", "compression", "known"))
+PATH_FIELDS = frozenset(("path", "rel_path", "arcname"))
+
+_INT, _FLOAT, _STR, _PATH, _DIGEST, _CONST, _OTHER = range(7)
+_INT_MIN, _INT_MAX = -(1 << 63), (1 << 63) - 1
+
+_digest_sizes = {}
+
+
+def _digest_size(name: str) -> int:
+    # Fixed digest length in bytes for a hashlib algorithm name, 0 for other keys.
+    if name not in _digest_sizes:
+        size = 0
+        if name in hashlib.algorithms_available and not name.startswith("shake_"):
+            try:
+                size = hashlib.new(name).digest_size
+            except ValueError:
+                pass
+        _digest_sizes[name] = size
+    return _digest_sizes[name]
+
+
+def _split(value: str) -> tuple:
+    # (directory incl. trailing separator, file name)
+    if os.sep == "\\":
+        cut = max(value.rfind("/"), value.rfind("\\")) + 1
+        return value[:cut], value[cut:]
+    head, sep, tail = value.rpartition("/")
+    return head + sep, tail
+
+
+class RecordStore:
+    def __init__(self):
+        self._n = 0
+        self._shapes = []
+        self._shape_ids = {}
+        self._shape_of = array.array("I")
+        self._strings = []
+        self._string_ids = {}
+        self._ints = {}
+        self._floats = {}
+        self._refs = {}
+        self._digests = {}
+        self._names = []
+        self._other = {}
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _intern(self, value: str) -> int:
+        i = self._string_ids.get(value)
+        if i is None:
+            i = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return i
+
+    def _array(self, columns: dict, key: str, typecode: str) -> array.array:
+        # Columns start when a key is first seen; earlier records get a zero slot.
+        col = columns.get(key)
+        if col is None:
+            col = columns[key] = array.array(typecode, bytes(array.array(typecode).itemsize * self._n))
+        return col
+
+    def _digest_column(self, key: str) -> bytearray:
+        col = self._digests.get(key)
+        if col is None:
+            col = self._digests[key] = bytearray(_digest_size(key) * self._n)
+        return col
+
+    def append(self, rec: dict):
+        shape = []
+        other = None
+        name = None
+        filled = 0
+        for key, value in rec.items():
+            kind = _OTHER
+            const = None
+            t = type(value)
+            if value is True or value is False or value is None:
+                kind = _CONST
+                const = value
+            elif t is int and key in INT_FIELDS and _INT_MIN <= value <= _INT_MAX:
+                kind = _INT
+                self._array(self._ints, key, "q").append(value)
+            elif t is float and key in FLOAT_FIELDS:
+                kind = _FLOAT
+                self._array(self._floats, key, "d").append(value)
+            elif t is str:
+                if key in INTERN_FIELDS:
+                    kind = _STR
+                    self._array(self._refs, key, "I").append(self._intern(value))
+                elif key in PATH_FIELDS:
+                    head, tail = _split(value)
+                    if name is None or tail == name:
+                        name = tail
+                        kind = _PATH
+                        self._array(self._refs, key, "I").append(self._intern(head))
+                else:
+                    size = _digest_size(key)
+                    if size and len(value) == 2 * size:
+                        try:
+                            raw = bytes.fromhex(value)
+                        except ValueError:
+                            raw = None
+                        if raw is not None and raw.hex() == value:
+                            kind = _DIGEST
+                            self._digest_column(key).extend(raw)
+            if kind == _OTHER:
+                if other is None:
+                    other = {}
+                other[key] = value
+            elif kind != _CONST:
+                filled += 1
+            shape.append((key, kind, const))
+
+        shape = tuple(shape)
+        sid = self._shape_ids.get(shape)
+        if sid is None:
+            sid = self._shape_ids[shape] = len(self._shapes)
+            self._shapes.append(shape)
+        self._shape_of.append(sid)
+        self._names.append(name)
+        if other is not None:
+            self._other[self._n] = other
+        self._n += 1
+
+        # Columns this record does not use still get their slot (one slot per record in every column).
+        if filled < len(self._ints) + len(self._floats) + len(self._refs) + len(self._digests):
+            for columns in (self._ints, self._floats, self._refs):
+                for col in columns.values():
+                    if len(col) < self._n:
+                        col.append(0)
+            for key, col in self._digests.items():
+                if len(col) < self._n * _digest_size(key):
+                    col.extend(bytes(_digest_size(key)))
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("record index out of range")
+        other = self._other.get(i)
+        rec = {}
+        for key, kind, const in self._shapes[self._shape_of[i]]:
+            if kind == _INT:
+                rec[key] = self._ints[key][i]
+            elif kind == _FLOAT:
+                rec[key] = self._floats[key][i]
+            elif kind == _CONST:
+                rec[key] = const
+            elif kind == _STR:
+                rec[key] = self._strings[self._refs[key][i]]
+            elif kind == _PATH:
+                rec[key] = self._strings[self._refs[key][i]] + self._names[i]
+            elif kind == _DIGEST:
+                size = _digest_size(key)
+                rec[key] = self._digests[key][i * size:(i + 1) * size].hex()
+            else:
+                rec[key] = other[key]
+        return rec
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
@@ -1,6 +1,14 @@
+import csv
+import hashlib
+import json
+import os
+import zipfile
+import zlib
 from pathlib import Path
 
+import archive
 import common
+import Coordinator
 import Surveyor
 import HasherPacker
 import Scribe
@@ -24,6 +32,16 @@ def test_sha256_repeatable(tmp_path: Path):
     assert common.sha256_file(p) == common.sha256_file(p)
 
 
+def test_sha256_streaming_matches_whole_file(tmp_path: Path):
+    p = tmp_path / "blob.bin"
+    data = bytes(range(256)) * 4099
+    p.write_bytes(data)
+    expected = hashlib.sha256(data).hexdigest()
+    # Odd buffer size forces a short final read; mmap path must agree with readinto path.
+    assert common.sha256_file(p, buffer_size=1000) == expected
+    assert common.sha256_file(p, buffer_size=1000, use_mmap=True, mmap_threshold=0) == expected
+
+
 def test_surveyor_enforces_size_limit(tmp_path: Path):
     cfg = _base_config()
     base = tmp_path
@@ -46,6 +64,363 @@ def test_surveyor_enforces_size_limit(tmp_path: Path):
     assert any(d.get("reason") == "size_limit" for d in devs)
 
 
+def test_hasherpacker_single_pass_digest_matches_archive(tmp_path: Path):
+    cfg = _base_config()
+    cfg["single_pass_archive"] = True
+    cfg["hash_buffer_bytes"] = 7
+    base = tmp_path
+
+    ev = base / "evidence"
+    (ev / "a").mkdir(parents=True)
+    (ev / "b").mkdir(parents=True)
+    (ev / "a" / "note.txt").write_text("first copy of a note", encoding="utf-8")
+    (ev / "b" / "note.txt").write_text("second, different note", encoding="utf-8")
+
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+
+    msg = common.read_json(base / "bus" / "20_hash_result.json")
+    files = msg["content"]["files"]
+    assert msg["content"]["single_pass"] is True
+    assert len(files) == 2
+
+    with zipfile.ZipFile(msg["content"]["zip_path"]) as z:
+        for r in files:
+            archived = z.read(r["arcname"])
+            assert hashlib.sha256(archived).hexdigest() == r["sha256"]
+            assert r["sha256"] == common.sha256_file(Path(r["path"]))
+
+
+def test_multi_algorithm_digests_reach_report(tmp_path: Path):
+    cfg = _base_config()
+    cfg["hash_algorithms"] = ["md5", "sha1", "blake2b"]
+    base = tmp_path
+
+    ev = base / "evidence"
+    ev.mkdir(parents=True)
+    (ev / "doc.txt").write_bytes(b"court submission")
+
+    assert common.hash_algorithms(cfg["hash_algorithms"]) == ["sha256", "md5", "sha1", "blake2b"]
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+    assert Scribe.run(cfg, base) is True
+
+    with (base / "output" / "report_UT_CASE.csv").open(encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 1
+    for algo in ["sha256", "md5", "sha1", "blake2b"]:
+        assert rows[0][algo] == hashlib.new(algo, b"court submission").hexdigest()
+
+
+def test_hasherpacker_rejects_unknown_algorithm(tmp_path: Path, capsys):
+    cfg = _base_config()
+    cfg["hash_algorithms"] = ["crc99"]
+    base = tmp_path
+    (base / "evidence").mkdir(parents=True)
+
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is False
+    assert "unsupported hash algorithm" in capsys.readouterr().out
+
+
+def test_hasherpacker_worker_pool_keeps_discovery_order(tmp_path: Path):
+    cfg = _base_config()
+    base = tmp_path
+
+    ev = base / "evidence"
+    for d in range(4):
+        (ev / f"d{d}").mkdir(parents=True)
+        for i in range(6):
+            (ev / f"d{d}" / f"f{i}.txt").write_text(f"{d}-{i}" * (i + 1), encoding="utf-8")
+
+    assert Surveyor.run(cfg, base) is True
+    discovered = [f["path"] for f in common.read_json(base / "bus" / "10_discovery_report.json")["content"]["files"]]
+
+    def run_with(workers: int) -> list:
+        cfg["hash_workers"] = workers
+        assert HasherPacker.run(cfg, base) is True
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            assert z.namelist() == [r["arcname"] for r in content["files"]]
+        return content["files"]
+
+    sequential = run_with(1)
+    pooled = run_with(4)
+    assert [r["path"] for r in pooled] == discovered
+    assert pooled == sequential
+
+
+def test_hasherpacker_precompressed_shards(tmp_path: Path):
+    cfg = _base_config()
+    cfg["max_file_size_bytes"] = 100000
+    cfg["compress_workers"] = 2
+    cfg["compress_spill_bytes"] = 64
+    cfg["archive_shard_max_entries"] = 2
+    base = tmp_path
+
+    ev = base / "evidence"
+    ev.mkdir(parents=True)
+    for i in range(5):
+        (ev / f"log{i}.txt").write_text(f"line {i}\n" * 500, encoding="utf-8")
+
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+
+    content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+    shards = content["shards"]
+    assert content["archive_mode"] == "precompressed"
+    assert [Path(s["zip_path"]).name for s in shards] == [
+        "evidence_UT_CASE_part001.zip",
+        "evidence_UT_CASE_part002.zip",
+        "evidence_UT_CASE_part003.zip",
+    ]
+    assert not (base / "output" / ".staging_UT_CASE").exists()
+
+    by_arcname = {r["arcname"]: r for r in content["files"]}
+    for i, shard in enumerate(shards):
+        with zipfile.ZipFile(shard["zip_path"]) as z:
+            assert z.testzip() is None
+            assert z.namelist() == shard["entries"]
+            for name in shard["entries"]:
+                assert by_arcname[name]["shard"] == i
+                assert hashlib.sha256(z.read(name)).hexdigest() == by_arcname[name]["sha256"]
+                assert z.getinfo(name).compress_size < z.getinfo(name).file_size
+
+
+def test_compression_policy_per_entry(tmp_path: Path):
+    cfg = _base_config()
+    cfg["allowed_extensions"] = [".txt", ".jpg", ".bin"]
+    cfg["max_file_size_bytes"] = 100000
+    cfg["compression_policy"] = "auto"
+    cfg["compression_strong_method"] = "lzma"
+    base = tmp_path
+
+    ev = base / "evidence"
+    ev.mkdir(parents=True)
+    (ev / "photo.jpg").write_bytes(b"\xff\xd8" + b"A" * 4000)
+    (ev / "random.bin").write_bytes(os.urandom(4000))
+    (ev / "repeat.txt").write_text("same line\n" * 400, encoding="utf-8")
+    (ev / "prose.txt").write_text(" ".join(str(i * 7919 % 1000) for i in range(800)), encoding="utf-8")
+
+    expected = {"photo.jpg": "stored", "random.bin": "stored", "repeat.txt": "lzma", "prose.txt": "deflate"}
+    assert Surveyor.run(cfg, base) is True
+
+    for single_pass, workers in ((False, 0), (True, 0), (False, 2)):
+        cfg["single_pass_archive"] = single_pass
+        cfg["compress_workers"] = workers
+        assert HasherPacker.run(cfg, base) is True
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            for r in content["files"]:
+                info = z.getinfo(r["arcname"])
+                assert r["compression"] == expected[Path(r["path"]).name]
+                assert info.compress_type == archive.COMPRESSION_METHODS[r["compression"]]
+                assert r["compress_ratio"] == round(info.compress_size / info.file_size, 4)
+                assert hashlib.sha256(z.read(r["arcname"])).hexdigest() == r["sha256"]
+
+
+def test_hash_cache_reuses_unchanged_entries(tmp_path: Path):
+    cfg = _base_config()
+    cfg["hash_cache"] = True
+    cfg["hash_algorithms"] = ["md5"]
+    base = tmp_path
+
+    ev = base / "evidence"
+    ev.mkdir(parents=True)
+    for i in range(3):
+        (ev / f"n{i}.txt").write_text(f"note {i} " * 5, encoding="utf-8")
+
+    def run_case() -> list:
+        assert Surveyor.run(cfg, base) is True
+        assert HasherPacker.run(cfg, base) is True
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            assert z.testzip() is None
+            for r in content["files"]:
+                assert hashlib.md5(z.read(r["arcname"])).hexdigest() == r["md5"]
+        return content["files"]
+
+    first = run_case()
+    assert not any(r.get("from_cache") for r in first)
+
+    (ev / "n1.txt").write_text("changed content", encoding="utf-8")
+    second = run_case()
+    reused = {Path(r["path"]).name for r in second if r.get("from_cache")}
+    assert reused == {"n0.txt", "n2.txt"}
+    assert not list((base / "output").glob("*.prev"))
+
+    cfg["verify_all"] = True
+    third = run_case()
+    assert not any(r.get("from_cache") for r in third)
+    assert [r["sha256"] for r in third] == [r["sha256"] for r in second]
+
+
+def test_dedup_archive_stores_unique_content_once(tmp_path: Path, monkeypatch):
+    cfg = _base_config()
+    cfg["dedup_archive"] = True
+    base = tmp_path
+
+    ev = base / "evidence"
+    for d in ("inbox", "synced", "other"):
+        (ev / d).mkdir(parents=True)
+        (ev / d / "attachment.txt").write_text("same attachment bytes", encoding="utf-8")
+    (ev / "other" / "unique.txt").write_text("same size, not same!!", encoding="utf-8")
+    assert Surveyor.run(cfg, base) is True
+
+    # Single-pass mode reads every file once: duplicates are hashed while written, then rolled back.
+    reads = []
+    chunks = HasherPacker.iter_file_chunks
+    monkeypatch.setattr(HasherPacker, "iter_file_chunks", lambda p, **kw: reads.append(str(p)) or chunks(p, **kw))
+
+    for single_pass, workers in ((False, 0), (True, 0), (False, 2)):
+        cfg["single_pass_archive"] = single_pass
+        cfg["compress_workers"] = workers
+        reads.clear()
+        assert HasherPacker.run(cfg, base) is True
+        assert Scribe.run(cfg, base) is True
+
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        files = content["files"]
+        assert len(files) == 4
+        if single_pass:
+            assert sorted(reads) == sorted(r["path"] for r in files)
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            assert len(z.namelist()) == 2
+            assert z.testzip() is None
+            for r in files:
+                assert hashlib.sha256(z.read(r["arcname"])).hexdigest() == r["sha256"]
+        assert sum(1 for r in files if r.get("duplicate")) == 2
+
+        with (base / "output" / "report_UT_CASE.csv").open(encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 4
+        assert sorted(r["duplicate"] for r in rows) == ["", "", "yes", "yes"]
+
+
+def test_surveyor_parallel_traversal_is_deterministic(tmp_path: Path):
+    cfg = _base_config()
+    cfg["allowed_roots"] = ["evidence", "missing_root"]
+    base = tmp_path
+
+    ev = base / "evidence"
+    for d in ("b", "a", "c/deep/er"):
+        (ev / d).mkdir(parents=True)
+        for name in ("z.txt", "m.TXT", "skip.jpg", ".txt"):
+            (ev / d / name).write_text(d + name, encoding="utf-8")
+    (ev / "top.txt").write_text("top", encoding="utf-8")
+    (ev / "a" / "big.txt").write_text("X" * 500, encoding="utf-8")
+
+    def survey(workers: int, max_files: int = 100) -> dict:
+        cfg["survey_workers"] = workers
+        cfg["max_files"] = max_files
+        assert Surveyor.run(cfg, base) is True
+        return common.read_json(base / "bus" / "10_discovery_report.json")["content"]
+
+    sequential = survey(1)
+    rel = [f["rel_path"] for f in sequential["files"]]
+    assert rel == [
+        "top.txt",
+        "a/m.TXT", "a/z.txt",
+        "b/m.TXT", "b/z.txt",
+        "c/deep/er/m.TXT", "c/deep/er/z.txt",
+    ]
+    assert [d["reason"] for d in sequential["deviations"]] == ["size_limit", "root_missing"]
+    assert survey(4) == sequential
+
+    capped = survey(4, max_files=3)
+    assert [f["rel_path"] for f in capped["files"]] == rel[:3]
+    assert [d["reason"] for d in capped["deviations"]] == ["size_limit", "max_files_reached", "root_missing"]
+    # As in the original os.walk loop, the cap is checked after a file is recorded: 0 still yields one.
+    assert [f["rel_path"] for f in survey(4, max_files=0)["files"]] == ["top.txt"]
+
+
+def test_surveyor_stops_subtree_scans_at_max_files(tmp_path: Path, monkeypatch):
+    import time
+
+    ev = tmp_path / "evidence"
+    for i in range(8):
+        deep = ev / f"d{i}"
+        for j in range(20):
+            deep = deep / f"s{j}"
+        deep.mkdir(parents=True)
+    (ev / "top.txt").write_text("top", encoding="utf-8")
+
+    listed = []
+    real_list_dir = Surveyor._list_dir
+
+    def slow_list_dir(dirpath):
+        listed.append(dirpath)
+        if dirpath != str(ev.resolve()):
+            time.sleep(0.02)
+        return real_list_dir(dirpath)
+
+    monkeypatch.setattr(Surveyor, "_list_dir", slow_list_dir)
+    events = list(Surveyor.discover(tmp_path, ["evidence"], [".txt"], 1000, 1, workers=2))
+    assert [k for k, _ in events] == ["file", "deviation"]
+    # 1 + 8 * 21 directories without the stop: running scans end at their next directory, queued ones never start.
+    assert len(listed) < 40
+
+
+def test_pipelined_run_matches_sequential(tmp_path: Path):
+    cfg = _base_config()
+    cfg["pipeline_queue_size"] = 2
+    cfg["hash_workers"] = 3
+    base = tmp_path
+
+    ev = base / "evidence"
+    for d in range(3):
+        (ev / f"d{d}").mkdir(parents=True)
+        for i in range(5):
+            (ev / f"d{d}" / f"f{i}.txt").write_text(f"{d}/{i}", encoding="utf-8")
+
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+    sequential = common.read_json(base / "bus" / "20_hash_result.json")["content"]["files"]
+
+    log_path = base / "output" / "runlog_UT_CASE.jsonl"
+    assert Coordinator.run_pipelined(cfg, base, log_path) is None
+    discovery = common.read_json(base / "bus" / "10_discovery_report.json")["content"]["files"]
+    pipelined = common.read_json(base / "bus" / "20_hash_result.json")["content"]["files"]
+
+    assert len(discovery) == 15
+    assert pipelined == sequential
+    assert "PIPELINE" in log_path.read_text(encoding="utf-8")
+
+
+def test_jsonl_bus_format_streams_records(tmp_path: Path):
+    cfg = _base_config()
+    base = tmp_path
+
+    ev = base / "evidence"
+    ev.mkdir(parents=True)
+    for i in range(4):
+        (ev / f"r{i}.txt").write_text(f"record {i}", encoding="utf-8")
+    (ev / "huge.txt").write_text("X" * 500, encoding="utf-8")
+
+    def pipeline(fmt: str) -> str:
+        cfg["bus_format"] = fmt
+        assert Surveyor.run(cfg, base) is True
+        assert HasherPacker.run(cfg, base) is True
+        assert Scribe.run(cfg, base) is True
+        return (base / "output" / "report_UT_CASE.csv").read_text(encoding="utf-8")
+
+    inline_report = pipeline("json")
+    streamed_report = pipeline("jsonl")
+    assert streamed_report == inline_report
+
+    bus = base / "bus"
+    discovery = common.read_json(bus / "10_discovery_report.json")
+    assert discovery["protocol"] == common.PROTOCOL and discovery["type"] == "DiscoveryReport"
+    ref = discovery["content"]["files"]
+    assert ref == {"format": "jsonl", "records": "10_discovery_report.files.jsonl", "count": 4}
+    assert common.record_count(discovery["content"], "deviations") == 1
+    assert len(list(common.iter_records(bus, discovery["content"], "files"))) == 4
+
+    hashed = common.read_json(bus / "20_hash_result.json")["content"]
+    assert hashed["files"]["records"] == "20_hash_result.files.jsonl"
+    assert len((bus / "20_hash_result.files.jsonl").read_text(encoding="utf-8").splitlines()) == 4
+
+
 def test_hasherpacker_requires_discovery_message(tmp_path: Path, capsys):
     cfg = _base_config()
     base = tmp_path
@@ -66,3 +441,883 @@ def test_scribe_requires_hash_message(tmp_path: Path, capsys):
     assert Scribe.run(cfg, base) is False
     out = capsys.readouterr().out.lower()
     assert "missing hash" in out and "message" in out
+
+
+def test_synthetic_generator_and_benchmark(tmp_path: Path):
+    import benchmark
+    import make_demo_dataset
+
+    data = tmp_path / "evidence"
+    summary = make_demo_dataset.generate(data, files=40, depth=1, fanout=3, size_dist="fixed:2048", dup_ratio=0.25, seed=7)
+    assert summary["files"] == 40 and summary["bytes"] == 40 * 2048
+    assert len(list(data.rglob("*.*"))) == 40
+    # Same seed -> same tree.
+    again = make_demo_dataset.generate(tmp_path / "again", files=40, depth=1, fanout=3, size_dist="fixed:2048", dup_ratio=0.25, seed=7)
+    assert again["duplicates"] == summary["duplicates"]
+    # Contents are produced in bounded chunks and add up to the requested size.
+    import random
+    for compressibility in (0.0, 0.5, 1.0):
+        chunks = list(make_demo_dataset._content(random.Random(1), 3 * make_demo_dataset.CHUNK_BYTES + 5, compressibility))
+        assert max(len(c) for c in chunks) <= make_demo_dataset.CHUNK_BYTES
+        assert sum(len(c) for c in chunks) == 3 * make_demo_dataset.CHUNK_BYTES + 5
+
+    work = tmp_path / "work"
+    work.mkdir()
+    result = benchmark.run_benchmark(work, data, {"hash_workers": 2})
+    assert result["files"] == 40 and result["bytes"] == 40 * 2048
+    assert set(result["stages"]) == {"Surveyor", "HasherPacker", "Scribe"}
+    assert result["stages"]["HasherPacker"]["archive_ratio"] > 0
+    assert result["end_to_end"]["files_per_s"] > 0
+    # Each stage runs in its own process: end to end is timed around the run and peaks at the largest stage.
+    stages = result["stages"].values()
+    assert result["end_to_end"]["seconds"] >= sum(st["seconds"] for st in stages)
+    assert result["end_to_end"]["peak_rss_kb"]["self"] == max(st["peak_rss_kb"]["self"] for st in stages) > 0
+
+
+def test_run_cases_isolates_namespaces(tmp_path: Path):
+    base = tmp_path
+    configs = []
+    for n in range(3):
+        ev = base / f"evidence{n}"
+        ev.mkdir()
+        for i in range(n + 2):
+            (ev / f"f{i}.txt").write_text(f"case {n} file {i}", encoding="utf-8")
+        cfg = _base_config()
+        cfg["case_id"] = f"UT_CASE_{n}"
+        cfg["allowed_roots"] = [f"evidence{n}"]
+        cfg["hash_workers"] = 8
+        configs.append(cfg)
+
+    results = Coordinator.run_cases(configs, base, max_cases=2, io_workers=4)
+    assert results == {"UT_CASE_0": True, "UT_CASE_1": True, "UT_CASE_2": True}
+
+    for n in range(3):
+        case_id = f"UT_CASE_{n}"
+        hashed = common.read_json(base / "bus" / case_id / "20_hash_result.json")["content"]
+        assert len(hashed["files"]) == n + 2
+        assert (base / "output" / case_id / f"evidence_{case_id}.zip").exists()
+        log = [json.loads(line) for line in (base / "output" / case_id / f"runlog_{case_id}.jsonl").read_text(encoding="utf-8").splitlines()]
+        scheduled = next(r for r in log if r["action"] == "CASE_SCHEDULED")
+        status = next(r for r in log if r["action"] == "CASE_STATUS")
+        # hash_workers 8 capped at the case's share of the 4-thread budget.
+        assert scheduled["details"]["hash_workers"] == 2
+        assert scheduled["details"]["verify_workers"] == 2
+        assert status["details"]["status"] == "ok" and status["details"]["files"] == n + 2
+
+    # Pools that run at the same time share one slice: pipelined traversal + hashing, queue processes
+    # times their threads, hashing threads times their Merkle threads.
+    share = Coordinator._worker_share({"survey_workers": 8, "hash_workers": 8}, 8, 4, pipeline=True)
+    assert share["survey_workers"] + share["hash_workers"] == 8
+    share = Coordinator._worker_share({"queue_workers": 3, "hash_workers": 8, "compress_workers": 8}, 8, 4)
+    assert share["queue_workers"] == 3 and share["hash_workers"] == 2 and share["compress_workers"] == 1
+    share = Coordinator._worker_share({"queue_workers": 20}, 8, 4)
+    assert share["queue_workers"] == 8 and share["hash_workers"] == 1
+    share = Coordinator._worker_share({"hash_workers": 2, "merkle_chunk_bytes": 512, "merkle_workers": 16, "verify_workers": 16}, 8, 4)
+    assert share["hash_workers"] * share["merkle_workers"] == 8 and share["verify_workers"] == 8
+
+
+def test_resume_after_interrupted_run_matches_full_run(tmp_path: Path):
+    import shutil
+
+    for n, extra in enumerate(({"archive_shard_max_entries": 4, "hash_workers": 2}, {"compress_workers": 2, "dedup_archive": True})):
+        base = tmp_path / f"case{n}"
+        ev = base / "evidence"
+        ev.mkdir(parents=True)
+        for i in range(30):
+            (ev / f"f{i}.txt").write_text(("dup" if i % 3 == 0 else f"file {i} ") * 4, encoding="utf-8")
+        cfg = _base_config()
+        cfg.update(extra)
+
+        assert Surveyor.run(cfg, base) is True
+        assert HasherPacker.run(cfg, base) is True
+        expected = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        expected_zips = [Path(s["zip_path"]).read_bytes() for s in expected["shards"]]
+
+        shutil.rmtree(base / "bus")
+        shutil.rmtree(base / "output")
+        cfg["checkpoint_every_files"] = 2
+        assert Surveyor.run(cfg, base) is True
+        discovery = common.read_json(base / "bus" / "10_discovery_report.json")["content"]
+
+        def interrupted():
+            for k, it in enumerate(discovery["files"]):
+                if k == 24:
+                    # Past the pool's read-ahead window, so some items are already archived.
+                    raise OSError("share disconnected")
+                yield it
+
+        try:
+            HasherPacker.pack(cfg, base, interrupted())
+        except OSError:
+            pass
+        assert (base / "bus" / "20_hash_checkpoint.json").exists()
+        assert not (base / "bus" / "20_hash_result.json").exists()
+
+        assert Coordinator.run_case(cfg, base, resume=True) is True
+        resumed = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        assert resumed == expected
+        assert [Path(s["zip_path"]).read_bytes() for s in resumed["shards"]] == expected_zips
+        assert not (base / "bus" / "20_hash_checkpoint.json").exists()
+        log = [json.loads(line) for line in (base / "output" / "runlog_UT_CASE.jsonl").read_text(encoding="utf-8").splitlines()]
+        assert any(r["action"] == "TASK_RESUME" for r in log)
+        hashed = [r["details"] for r in log if r["action"] == "HASH_AND_ZIP"]
+        assert hashed[-1]["resumed_from"] > 0
+
+
+def test_merkle_tree_hashing_locates_damaged_chunks(tmp_path: Path):
+    import merkle
+
+    data = os.urandom(5000)
+    big = tmp_path / "disk.img"
+    big.write_bytes(data)
+    digests, tree = merkle.hash_file_tree(big, ["sha256"], chunk_size=512, workers=3)
+    assert digests["sha256"] == hashlib.sha256(data).hexdigest()
+    assert len(tree["leaves"]) == 10
+
+    # Sequential builder (single-pass / precompressed modes) gives the same tree.
+    b = merkle.MerkleBuilder(512)
+    for i in range(0, len(data), 700):
+        b.update(data[i:i + 700])
+    assert b.tree() == tree
+
+    damaged = bytearray(data)
+    damaged[1500] ^= 0xFF
+    big.write_bytes(bytes(damaged))
+    assert merkle.verify_chunks(big, tree) == [2]
+    assert merkle.verify_chunks(big, tree, indices=[0, 1]) == []
+
+    # Pipeline: tree stored next to the whole-file digest, root in the report.
+    cfg = _base_config()
+    cfg.update({"max_file_size_bytes": 10_000, "merkle_chunk_bytes": 512, "merkle_min_bytes": 1000, "merkle_workers": 2})
+    ev = tmp_path / "evidence"
+    ev.mkdir()
+    (ev / "big.txt").write_bytes(data)
+    (ev / "small.txt").write_text("small", encoding="utf-8")
+    for mode in ({}, {"compress_workers": 2}):
+        assert Surveyor.run(cfg, tmp_path) is True
+        assert HasherPacker.run(dict(cfg, **mode), tmp_path) is True
+        content = common.read_json(tmp_path / "bus" / "20_hash_result.json")["content"]
+        files = {Path(r["path"]).name: r for r in content["files"]}
+        # Records carry the root only, the leaves are in the leaves store.
+        assert files["big.txt"]["merkle"] == {"chunk_bytes": 512, "root": tree["root"], "chunks": 10}
+        assert "merkle" not in files["small.txt"]
+    store = merkle.leaves_dir(tmp_path / "output")
+    assert merkle.load_tree(store, files["big.txt"]["merkle"]) == tree
+    assert Scribe.run(cfg, tmp_path) is True
+    with (tmp_path / "output" / "report_UT_CASE.csv").open(encoding="utf-8") as f:
+        rows = {Path(r["path"]).name: r for r in csv.DictReader(f)}
+    assert rows["big.txt"]["merkle_root"] == tree["root"] and rows["small.txt"]["merkle_root"] == ""
+
+    # Verifier: a damaged archive entry is located through the stored leaves.
+    import Verifier
+
+    zip_path = Path(content["shards"][0]["zip_path"])
+    with zipfile.ZipFile(zip_path) as z:
+        entries = [(i.filename, z.read(i)) for i in z.infolist()]
+    with zipfile.ZipFile(zip_path, "w") as z:
+        for name, body in entries:
+            z.writestr(name, bytes(damaged) if body == data else body)
+    assert Verifier.run(cfg, tmp_path) is False
+    result = common.read_json(tmp_path / "bus" / "40_verification_result.json")["content"]
+    assert [m["damaged_chunks"] for m in result["mismatches"] if m["algorithm"] == "merkle"] == [[2]]
+
+    # A leaves file that does not hash to its root is refused.
+    leaves_file = store / f"{tree['root']}.leaves"
+    leaves_file.write_bytes(leaves_file.read_bytes()[:-1] + b"\x00")
+    try:
+        merkle.load_tree(store, files["big.txt"]["merkle"])
+        assert False, "damaged leaves accepted"
+    except ValueError:
+        pass
+
+
+def test_verifier_reports_mismatch_missing_and_extra(tmp_path: Path):
+    import Verifier
+
+    cfg = _base_config()
+    cfg.update({"dedup_archive": True, "verify_workers": 3, "verify_archive": True})
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(6):
+        (ev / f"f{i}.txt").write_text("same" if i < 2 else f"content {i}", encoding="utf-8")
+
+    assert Coordinator.run_case(cfg, base) is True
+    result = common.read_json(base / "bus" / "40_verification_result.json")["content"]
+    assert result["ok"] is True and result["entries_verified"] == 5 and result["report_checked"] is True
+
+    # Rebuild the archive with one entry altered, one dropped and one unexpected entry added.
+    zip_path = base / "output" / "evidence_UT_CASE.zip"
+    with zipfile.ZipFile(zip_path) as z:
+        entries = {n: z.read(n) for n in z.namelist()}
+    entries["evidence/f2.txt"] = b"tampered"
+    del entries["evidence/f3.txt"]
+    entries["evidence/planted.txt"] = b"x"
+    with zipfile.ZipFile(zip_path, "w") as z:
+        for n, data in entries.items():
+            z.writestr(n, data)
+
+    assert Verifier.run(cfg, base) is False
+    result = common.read_json(base / "bus" / "40_verification_result.json")["content"]
+    assert [m["arcname"] for m in result["mismatches"]] == ["evidence/f2.txt"]
+    assert [m["arcname"] for m in result["missing"]] == ["evidence/f3.txt"]
+    assert [m["arcname"] for m in result["extra"]] == ["evidence/planted.txt"]
+    log = (base / "output" / "runlog_UT_CASE.jsonl").read_text(encoding="utf-8")
+    assert '"action": "VERIFY"' in log and "mb_per_s" in log
+
+    # Manifest checks, streamed: a duplicate whose digest differs from its stored entry's, and a report
+    # row with another digest (rows in a different order than the records still pair up).
+    assert Coordinator.run_case(cfg, base) is True
+    msg = common.read_json(base / "bus" / "20_hash_result.json")
+    dup = next(r for r in msg["content"]["files"] if r.get("duplicate"))
+    dup["sha256"] = "0" * 64
+    common.write_json(base / "bus" / "20_hash_result.json", msg)
+    report = base / "output" / "report_UT_CASE.csv"
+    with report.open(newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    tampered = next(r for r in rows if r["path"].endswith("f4.txt"))
+    tampered["sha256"] = "1" * 64
+    with report.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(reversed(rows))
+    assert Verifier.run(cfg, base) is False
+    result = common.read_json(base / "bus" / "40_verification_result.json")["content"]
+    assert [(m["path"], m["expected"]) for m in result["mismatches"]] == [(dup["path"], "0" * 64)]
+    dup_row = next(r for r in rows if r["path"] == dup["path"])
+    assert sorted((m["path"], m["report"]) for m in result["report_mismatches"]) == sorted(
+        [(dup["path"], dup_row["sha256"]), (tampered["path"], "1" * 64)]
+    )
+    assert not (result["missing"] or result["extra"] or result["errors"])
+
+    # Report rows without a record, and records without a row.
+    dropped = rows.pop(0)
+    rows.append(dict(rows[0], path=str(base / "evidence" / "planted.txt")))
+    with report.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+    assert Verifier.run(cfg, base) is False
+    result = common.read_json(base / "bus" / "40_verification_result.json")["content"]
+    missing_rows = [(m["path"], m["missing_from"]) for m in result["report_mismatches"] if "missing_from" in m]
+    assert missing_rows == [(dropped["path"], "report"), (str(base / "evidence" / "planted.txt"), "manifest")]
+
+    # Duplicates are checked with every configured algorithm, not only SHA-256.
+    cfg["hash_algorithms"] = ["sha256", "md5"]
+    assert Coordinator.run_case(cfg, base) is True
+    msg = common.read_json(base / "bus" / "20_hash_result.json")
+    dup = next(r for r in msg["content"]["files"] if r.get("duplicate"))
+    dup["md5"] = "0" * 32
+    common.write_json(base / "bus" / "20_hash_result.json", msg)
+    assert Verifier.run(cfg, base) is False
+    result = common.read_json(base / "bus" / "40_verification_result.json")["content"]
+    assert [(m["path"], m["algorithm"]) for m in result["mismatches"]] == [(dup["path"], "md5")]
+
+
+def test_scribe_builds_indexed_case_database(tmp_path: Path, monkeypatch):
+    import sqlite3
+
+    import casedb
+
+    cfg = _base_config()
+    cfg.update({"report_formats": ["sqlite"], "sqlite_batch_rows": 2, "max_file_size_bytes": 1000})
+    base = tmp_path
+    ev = base / "evidence"
+    (ev / "sub").mkdir(parents=True)
+    (ev / "a.txt").write_text("alpha", encoding="utf-8")
+    (ev / "b.txt").write_text("alpha", encoding="utf-8")
+    (ev / "sub" / "c.txt").write_text("c" * 500, encoding="utf-8")
+    (ev / "big.txt").write_text("x" * 2000, encoding="utf-8")
+
+    assert Coordinator.run_case(cfg, base) is True
+    assert not (base / "output" / "report_UT_CASE.csv").exists()
+    done = common.read_json(base / "bus" / "30_report_generated.json")["content"]
+    assert done["report_csv"] is None and done["rows"] == 3
+
+    con = sqlite3.connect(done["case_db"])
+    alpha = hashlib.sha256(b"alpha").hexdigest()
+    assert sorted(r[0] for r in con.execute("SELECT rel_path FROM files WHERE sha256 = ?", (alpha,))) == ["a.txt", "b.txt"]
+    assert [r[0] for r in con.execute("SELECT rel_path FROM files WHERE ext = '.txt' AND size > 100")] == [os.path.join("sub", "c.txt")]
+    assert con.execute("SELECT COUNT(*) FROM files WHERE root_name = 'evidence'").fetchone()[0] == 3
+    assert [r[0] for r in con.execute("SELECT reason FROM deviations")] == ["size_limit"]
+    plan = " ".join(str(r) for r in con.execute("EXPLAIN QUERY PLAN SELECT path FROM files WHERE sha256 = ?", (alpha,)))
+    assert "idx_files_sha256" in plan
+    con.close()
+
+    # A failure while loading the discovery records aborts the database: no half-written .tmp is left.
+    def broken(self, records):
+        raise OSError("discovery records unreadable")
+
+    monkeypatch.setattr(casedb.CaseDB, "add_deviations", broken)
+    try:
+        Scribe.run(cfg, base)
+        assert False, "Scribe ignored the failed discovery import"
+    except OSError:
+        pass
+    assert not Path(done["case_db"] + ".tmp").exists()
+
+
+def test_queue_workers_merge_into_one_hash_result(tmp_path: Path):
+    import workqueue
+
+    cfg = _base_config()
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(10):
+        (ev / f"f{i:02d}.txt").write_text(f"file {i}", encoding="utf-8")
+
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+    sequential = common.read_json(base / "bus" / "20_hash_result.json")["content"]["files"]
+
+    cfg.update({"queue_workers": 2, "queue_shard_files": 3, "verify_archive": True})
+    assert Coordinator.run_case(cfg, base) is True
+    merged = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+    assert merged["work_shards"] == 4 and len(merged["shards"]) == 4
+    assert [(r["path"], r["sha256"]) for r in merged["files"]] == [(r["path"], r["sha256"]) for r in sequential]
+    assert [r["shard"] for r in merged["files"]] == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3]
+    # Attempts log to the case runlog, each HASH_AND_ZIP record names its attempt.
+    out = base / "output"
+    assert [p.name for p in out.glob("runlog_*")] == ["runlog_UT_CASE.jsonl"]
+    log = [json.loads(line) for line in (out / "runlog_UT_CASE.jsonl").read_text(encoding="utf-8").splitlines()]
+    attempts = sorted(r["details"]["queue_attempt"] for r in log if r["action"] == "HASH_AND_ZIP" and r["details"]["queue_attempt"])
+    assert attempts == ["q0001-g1", "q0002-g1", "q0003-g1", "q0004-g1"]
+    assert sorted(Path(s["zip_path"]).name for s in merged["shards"])[0] == "evidence_UT_CASE-q0001-g1.zip"
+
+    # A worker died holding a lease: once the heartbeat is stale the shard is reclaimed as generation 2.
+    bus = base / "bus"
+    q = workqueue.queue_dir(bus)
+    workqueue.split(bus, "UT_CASE", common.iter_records(bus, common.read_json(bus / "10_discovery_report.json")["content"], "files"), 5)
+    dead = q / "shard_0001.lease.1"
+    dead.write_text("{}", encoding="utf-8")
+    os.utime(dead, (0, 0))
+    assert HasherPacker.work(dict(cfg, queue_lease_seconds=30), base, worker_id="w2") == 2
+    assert common.read_json(q / "shard_0001.done.json")["gen"] == 2
+    content, stats = workqueue.merge(bus)
+    assert [st["gen"] for st in stats] == [2, 1]
+    assert len(content["files"]) == 10
+
+
+def test_daemon_runs_submitted_cases_from_bus_events(tmp_path: Path):
+    import asyncio
+
+    import daemon
+
+    for watch in ("inotify", "polling"):
+        base = tmp_path / watch
+        cases = []
+        for n in range(2):
+            ev = base / f"evidence{n}"
+            ev.mkdir(parents=True)
+            for i in range(n + 2):
+                (ev / f"f{i}.txt").write_text(f"{watch} case {n} file {i}", encoding="utf-8")
+            cases.append({"case_id": f"UT_D{n}", "allowed_roots": [f"evidence{n}"]})
+        cfg = dict(_base_config(), daemon_inotify=watch == "inotify", daemon_poll_seconds=0.05, verify_archive=True)
+        # One request waits in the inbox before the daemon starts, one arrives while it runs.
+        daemon.submit(cases[0], cfg, base)
+        # A case named like the inbox would share its folder: rejected.
+        daemon.submit({"case_id": "inbox"}, cfg, base)
+
+        async def scenario():
+            server = asyncio.create_task(daemon.serve(cfg, base, exit_after=2))
+            await asyncio.sleep(0.2)
+            daemon.submit(cases[1], cfg, base)
+            return await asyncio.wait_for(server, timeout=60)
+
+        assert asyncio.run(scenario()) == {"UT_D0": True, "UT_D1": True}
+        for n in range(2):
+            case_id = f"UT_D{n}"
+            out = base / "output" / case_id
+            assert (out / f"report_{case_id}.csv").exists()
+            assert common.read_json(base / "bus" / case_id / "40_verification_result.json")["content"]["ok"] is True
+            log = [json.loads(line) for line in (out / f"runlog_{case_id}.jsonl").read_text(encoding="utf-8").splitlines()]
+            assert [r["action"] for r in log if r["agent"] == "Coordinator"] == ["TASK_START", "TASK_END", "DAEMON_CASE"]
+            stages = log[-1]["details"]["stages"]
+            assert set(stages) == {"Surveyor", "HasherPacker", "Scribe", "Verifier"}
+            assert all("seconds" in s for s in stages.values())
+            # A stage starts only after the agent before it returned, its runlog records come first.
+            actions = [r["action"] for r in log]
+            assert actions.index("DISCOVERY") < actions.index("HASH_AND_ZIP") < actions.index("REPORT") < actions.index("VERIFY")
+        assert not list((base / "bus" / "inbox").glob("*.json"))
+        assert len(list((base / "bus" / "inbox" / "rejected").glob("*.json"))) == 1
+
+
+def test_polling_watcher_forgets_removed_files(tmp_path: Path):
+    import asyncio
+
+    import daemon
+
+    seen = []
+
+    async def scenario():
+        watcher = daemon._PollingWatcher(asyncio.get_running_loop(), seen.append, 0.02)
+        watcher.watch(tmp_path)
+        (tmp_path / "a.json").write_text("{}", encoding="utf-8")
+        await asyncio.sleep(0.2)
+        (tmp_path / "a.json").unlink()
+        await asyncio.sleep(0.2)
+        watcher.close()
+        return watcher._seen
+
+    assert asyncio.run(scenario()) == {} and seen == [tmp_path / "a.json"]
+
+
+def test_known_hash_set_skips_archiving_known_files(tmp_path: Path, monkeypatch):
+    import Verifier
+    import knownhashes
+
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(6):
+        (ev / f"f{i}.txt").write_text(f"file {i}", encoding="utf-8")
+    ref = base / "refset.txt"
+    lines = ["SHA-256,FileName"]
+    lines += [f"{hashlib.sha256(f'file {i}'.encode()).hexdigest().upper()},f{i}.txt" for i in (1, 4)]
+    lines += [hashlib.sha256(f"other {i}".encode()).hexdigest() for i in range(2000)]
+    ref.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    stats = knownhashes.build(base / "ref.kh", [ref], chunk_entries=500)
+    assert stats["entries"] == 2002
+
+    index = knownhashes.KnownHashes(base / "ref.kh")
+    assert hashlib.sha256(b"other 7").hexdigest() in index
+    assert hashlib.sha256(b"not in the set").hexdigest() not in index
+    index.close()
+
+    # Single-pass mode reads every file once: known files are rolled back after they were streamed.
+    reads = []
+    chunks = HasherPacker.iter_file_chunks
+    monkeypatch.setattr(HasherPacker, "iter_file_chunks", lambda p, **kw: reads.append(str(p)) or chunks(p, **kw))
+
+    for extra in ({}, {"single_pass_archive": True}, {"compress_workers": 2}):
+        cfg = _base_config()
+        cfg.update(extra, known_hashes="ref.kh")
+        assert Surveyor.run(cfg, base) is True
+        reads.clear()
+        assert HasherPacker.run(cfg, base) is True
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        if extra.get("single_pass_archive"):
+            assert content["single_pass"] is True
+            assert sorted(reads) == sorted(r["path"] for r in content["files"])
+        known = sorted(Path(r["path"]).name for r in content["files"] if r.get("known"))
+        assert known == ["f1.txt", "f4.txt"]
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            assert sorted(Path(n).name for n in z.namelist()) == ["f0.txt", "f2.txt", "f3.txt", "f5.txt"]
+        assert Scribe.run(cfg, base) is True
+        with (base / "output" / "report_UT_CASE.csv").open(newline="", encoding="utf-8") as f:
+            rows = {Path(row["path"]).name: row for row in csv.DictReader(f)}
+        assert rows["f1.txt"]["known"] == "ref" and rows["f1.txt"]["arcname"] == "" and rows["f0.txt"]["known"] == ""
+        assert Verifier.run(cfg, base) is True
+
+    assert HasherPacker.run(dict(_base_config(), known_hashes="missing.kh"), base) is False
+
+
+def test_record_store_is_compact_and_lossless(tmp_path: Path):
+    import tracemalloc
+
+    from records import RecordStore
+
+    records = []
+    for i in range(3000):
+        rel = f"dir{i % 40}/file_{i}.txt"
+        records.append({"path": f"/cases/evidence/{rel}", "root": "/cases/evidence", "root_name": "evidence", "rel_path": rel, "ext": ".txt", "size": i * 7, "dev": 2049, "inode": 900000 + i, "mtime_ns": 1700000000000000000 + i})
+        h = {"path": records[-1]["path"], "ext": ".txt", "size": i * 7, "sha256": hashlib.sha256(str(i).encode()).hexdigest(), "arcname": f"evidence/{rel}", "compression": "deflate", "compress_ratio": 0.25}
+        if i % 50 == 0:
+            h = {"path": h["path"], "sha256": "", "error": "Permission denied"}
+        if i % 70 == 0:
+            h.update(duplicate=True, arcname="evidence/other.txt", sha256=h["sha256"].upper(), compress_ratio=None)
+        records.append(h)
+
+    tracemalloc.start()
+    store = RecordStore()
+    for r in records:
+        store.append(r)
+    compact = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    copies = [json.loads(json.dumps(r)) for r in records]
+    plain = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(store) == len(records) and store[-1] == records[-1]
+    assert [list(r.items()) for r in store] == [list(r.items()) for r in copies]
+    assert compact * 3 < plain
+
+    # Messages with a RecordStore serialize exactly like the plain list.
+    msg = common.make_message("Surveyor", "HasherPacker", "DiscoveryReport", "UT", {"files": store, "deviations": []})
+    common.write_json(tmp_path / "m.json", msg)
+    assert (tmp_path / "m.json").read_text(encoding="utf-8") == json.dumps(dict(msg, content={"files": records, "deviations": []}), indent=2)
+
+
+def test_read_message_parses_inline_records_into_a_record_store(tmp_path: Path):
+    import tracemalloc
+
+    from records import RecordStore
+
+    records = [{"path": f"/cases/evidence/d{i % 40}/f{i}.txt", "size": i, "sha256": hashlib.sha256(str(i).encode()).hexdigest()} for i in range(3000)]
+    msg = common.make_message("HasherPacker", "Scribe", "HashResult", "UT", {"files": records, "deviations": [], "shards": [{"entries": 3, "ratio": 1.5e-3}]})
+    path = tmp_path / "20_hash_result.json"
+    common.write_json(path, msg)
+
+    tracemalloc.start()
+    streamed = common.read_message(path)
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    plain = common.read_json(path)
+    full = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert isinstance(streamed["content"]["files"], RecordStore)
+    assert json.dumps(dict(streamed, content=dict(streamed["content"], files=list(streamed["content"]["files"])))) == json.dumps(plain)
+    assert kept * 3 < full
+
+    # Any JSON layout reads the same, numbers split across buffer refills included; broken text is a ValueError.
+    path.write_text(json.dumps(plain, separators=(",", ":")), encoding="utf-8")
+    with path.open(encoding="utf-8") as f:
+        compact = common._read_object(common._JSONReader(f, chunk=3), ("files",), 0)
+    assert list(compact["content"]["files"]) == plain["content"]["files"] and compact["content"]["shards"] == [{"entries": 3, "ratio": 1.5e-3}]
+    path.write_text(json.dumps(plain)[:-40], encoding="utf-8")
+    try:
+        common.read_message(path)
+        assert False, "truncated message accepted"
+    except ValueError:
+        pass
+
+
+def test_stage_spans_profile_and_buffered_runlog(tmp_path: Path, monkeypatch):
+    import pstats
+
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(5):
+        (ev / f"f{i}.txt").write_text(f"span file {i}" * 3, encoding="utf-8")
+    cfg = dict(_base_config(), verify_archive=True, runlog_flush_records=100, runlog_fsync="close")
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(os.fstat(fd).st_ino) or real_fsync(fd))
+
+    assert Coordinator.run_case(cfg, base, profile=True) is True
+    log_path = base / "output" / "runlog_UT_CASE.jsonl"
+    log = [json.loads(line) for line in log_path.read_text(encoding="utf-8").splitlines()]
+    stages = {r["details"]["stage"]: r["details"] for r in log if r["action"] == "STAGE"}
+    assert list(stages) == ["Surveyor", "HasherPacker", "Scribe", "Verifier"]
+    assert stages["Surveyor"]["files"] == 5 and stages["HasherPacker"]["bytes"] == 5 * len("span file 0" * 3)
+    assert all(s["ok"] and s["wall_seconds"] >= 0 and "io" in s and s["peak_rss_kb"] > 0 for s in stages.values())
+    pstats.Stats(stages["HasherPacker"]["profile"])
+    summary = log[-1]
+    assert summary["agent"] == "Coordinator" and summary["action"] == "RUN_SUMMARY"
+    assert summary["details"]["ok"] is True and set(summary["details"]["stages"]) == set(stages)
+    # run_case closes its log: runlog_fsync "close" syncs it once the case is done.
+    assert log_path.stat().st_ino in synced
+
+    # The policy belongs to the log path: another log keeps the default (every record written at once).
+    other = base / "other.jsonl"
+    common.append_runlog(other, "UT", "UNBUFFERED", {})
+    assert "UNBUFFERED" in other.read_text(encoding="utf-8")
+
+    # Buffered records reach the file on flush; a removed log is recreated on the next flush.
+    common.append_runlog(log_path, "UT", "BUFFERED", {})
+    assert "BUFFERED" not in log_path.read_text(encoding="utf-8")
+    common.flush_runlogs()
+    assert "BUFFERED" in log_path.read_text(encoding="utf-8")
+    log_path.unlink()
+    common.append_runlog(log_path, "UT", "AFTER_UNLINK", {})
+    common.close_runlog(log_path)
+    assert json.loads(log_path.read_text(encoding="utf-8"))["action"] == "AFTER_UNLINK"
+
+    # The exit flush syncs "close" logs that were never closed; stage-end flushes only write.
+    common.append_runlog(log_path, "UT", "AT_EXIT", {})
+    synced.clear()
+    common.flush_runlogs()
+    assert log_path.stat().st_ino not in synced
+    common.append_runlog(log_path, "UT", "AT_EXIT_2", {})
+    common.flush_runlogs(final=True)
+    assert log_path.stat().st_ino in synced
+    common.close_runlog(log_path)
+
+    # Without the resource module (Windows) CPU time still comes from os.times(), peak RSS is None.
+    import benchmark
+    import instrument
+
+    monkeypatch.setattr(instrument, "resource", None)
+    monkeypatch.setattr(benchmark, "resource", None)
+    with instrument.Spans(base / "nores.jsonl").stage("UT") as span:
+        sum(range(10000))
+    record = json.loads((base / "nores.jsonl").read_text(encoding="utf-8").splitlines()[0])["details"]
+    assert span.ok and record["peak_rss_kb"] is None and record["cpu_seconds"] >= 0
+    assert benchmark._peak_rss_kb() == {"self": None, "children": None}
+
+
+def test_read_scheduler_reads_in_disk_order_and_keeps_discovery_order(tmp_path: Path):
+    import iosched
+
+    # Plan: reads sorted by (dev, inode), cache hits last, each job prefetches the read `lookahead` later.
+    sched = iosched.ReadScheduler("inode", window=8, fadvise=True)
+    batch = [
+        {"path": "c", "dev": 1, "inode": 30, "size": 1},
+        {"path": "a", "dev": 1, "inode": 10, "size": 1},
+        {"path": "hit", "dev": 1, "inode": 5, "size": 1, "_cached": {}},
+        {"path": "b", "dev": 1, "inode": 20, "size": 1},
+    ]
+    plan = sched.plan(batch, lookahead=1)
+    assert [i for i, _ in plan] == [1, 3, 0, 2]
+    assert [job.get("_prefetch") for _, job in plan] == ["b", "c", None, None]
+
+    # ordered_map runs each batch in plan order and still yields in input order.
+    calls = []
+    order = lambda b: sorted(enumerate(b), key=lambda p: -p[1])
+    out = list(common.ordered_map(lambda x: calls.append(x) or x * 10, range(5), window=3, order=order))
+    assert out == [(i, i * 10) for i in range(5)]
+    assert calls == [2, 1, 0, 4, 3]
+    assert [r for _, r in common.ordered_map(lambda x: x, range(50), workers=4, window=7, order=order)] == list(range(50))
+
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(12):
+        (ev / f"f{i:02d}.txt").write_text(f"sched {i}" * (i + 1), encoding="utf-8")
+    cfg = _base_config()
+    assert Surveyor.run(cfg, base) is True
+    discovered = [r["path"] for r in common.read_json(base / "bus" / "10_discovery_report.json")["content"]["files"]]
+    assert HasherPacker.run(cfg, base) is True
+    plain = common.read_json(base / "bus" / "20_hash_result.json")["content"]["files"]
+
+    for extra in ({"hash_workers": 3}, {"single_pass_archive": True}, {"compress_workers": 2}):
+        cfg = dict(_base_config(), read_order="extent", read_fadvise=True, read_window=5, **extra)
+        assert HasherPacker.run(cfg, base) is True
+        content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        assert [(r["path"], r["sha256"]) for r in content["files"]] == [(r["path"], r["sha256"]) for r in plain]
+        with zipfile.ZipFile(content["zip_path"]) as z:
+            assert [Path(n).name for n in z.namelist()] == [Path(p).name for p in discovered]
+        log = [json.loads(line) for line in (base / "output" / "runlog_UT_CASE.jsonl").read_text(encoding="utf-8").splitlines()]
+        stats = log[-1]["details"]["read_schedule"]
+        assert stats["order"] == "extent" and stats["windows"] == 3 and stats["fadvise"] is True
+
+    assert HasherPacker.run(dict(_base_config(), read_order="random"), base) is False
+
+
+def test_zip_writer_round_trips_every_method(tmp_path: Path):
+    from archive import EvidenceArchive, compressor_for
+
+    src = tmp_path / "src.txt"
+    data = b"evidence line\n" * 5000
+    src.write_bytes(data)
+    methods = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA)
+    with EvidenceArchive(tmp_path, "ZW") as archive:
+        for m in methods:
+            archive.write_file(src, f"file/{m}.txt", compress_type=m)
+            zinfo = zipfile.ZipInfo.from_file(src, arcname=f"pre/{m}.txt")
+            zinfo.compress_type = m
+            c = compressor_for(m)
+            raw = c.compress(data) + c.flush() if c else data
+            archive.write_precompressed(zinfo, [raw[:100], raw[100:]], zlib.crc32(data), len(data))
+        zinfo = zipfile.ZipInfo.from_file(src, arcname="stream/ünï.txt")
+        with archive.open_entry(zinfo) as dst:
+            dst.write(memoryview(data))
+    with zipfile.ZipFile(archive.zip_path) as z:
+        assert z.testzip() is None
+        assert len(z.infolist()) == 2 * len(methods) + 1
+        assert all(z.read(i) == data for i in z.infolist())
+        assert {i.compress_type for i in z.infolist()} == set(methods)
+
+
+def test_zip_writer_zip64_and_lzma_round_trip_through_zipfile(tmp_path: Path, monkeypatch):
+    import io
+
+    import archive
+    from archive import EvidenceArchive, compressor_for, zinfo_state
+
+    # LZMA entries carry the same properties header and raw stream as zipfile writes them.
+    data = b"evidence line\n" * 5000
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_LZMA) as z:
+        z.writestr("a", data)
+    ref = zipfile.ZipFile(buf).getinfo("a")
+    c = compressor_for(zipfile.ZIP_LZMA)
+    start = ref.header_offset + 30 + len("a")
+    assert c.compress(data) + c.flush() == buf.getvalue()[start:start + ref.compress_size]
+
+    # A lowered ZIP64 limit puts every ZIP64 field (local and central extras, end64 record and locator)
+    # into a small archive; zipfile must read it back, also after a resume.
+    monkeypatch.setattr(archive, "ZIP64_LIMIT", 1000)
+    src = tmp_path / "src.txt"
+    src.write_bytes(data)
+    methods = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA)
+    first = EvidenceArchive(tmp_path, "Z64")
+    for m in methods:
+        first.write_file(src, f"file/{m}.txt", compress_type=m)
+        zinfo = zipfile.ZipInfo.from_file(src, arcname=f"pre/{m}.txt")
+        zinfo.compress_type = m
+        c = compressor_for(m)
+        raw = c.compress(data) + c.flush() if c else data
+        first.write_precompressed(zinfo, [raw], zlib.crc32(data), len(data), len(raw))
+    state = first.state()
+    entries = [{"shard": 0, **zinfo_state(z)} for z in first._zip.entries]
+    first._zip.fp.close()  # interrupted: no central directory
+
+    with EvidenceArchive(tmp_path, "Z64") as archive_:
+        assert archive_.resume(state, entries) == len(entries) and archive_.rewound is None
+        archive_.write_file(src, "small.txt", compress_type=zipfile.ZIP_LZMA, buffer_size=999)
+    raw_zip = archive_.zip_path.read_bytes()
+    assert b"PK\x06\x06" in raw_zip and b"PK\x06\x07" in raw_zip
+    with zipfile.ZipFile(archive_.zip_path) as z:
+        assert z.testzip() is None
+        infos = z.infolist()
+        assert len(infos) == 2 * len(methods) + 1 and all(z.read(i) == data for i in infos)
+        # Central ZIP64 extra (header id 1) on every entry past the limit.
+        assert all(i.extra[:2] == b"\x01\x00" for i in infos)
+        assert {i.compress_type for i in infos} == set(methods)
+
+
+def test_archive_shard_size_limit_is_never_exceeded(tmp_path: Path):
+    from archive import EvidenceArchive
+
+    files = []
+    for i, size in enumerate((3000, 2500, 4000, 100, 9000, 1200)):
+        p = tmp_path / f"f{i}.bin"
+        p.write_bytes(os.urandom(size))
+        files.append(p)
+    limit = 6000
+    for method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        with EvidenceArchive(tmp_path, f"SL{method}", max_bytes=limit) as archive:
+            for p in files:
+                archive.write_file(p, p.name, compress_type=method)
+        sizes = [s["bytes"] for s in archive.shards]
+        # Only the shard holding the 9000-byte file alone may pass the limit.
+        assert [n for s, n in zip(archive.shards, sizes) if n > limit] == [n for s, n in zip(archive.shards, sizes) if s["entries"] == ["f4.bin"]]
+        assert sum(len(s["entries"]) for s in archive.shards) == len(files)
+
+
+def test_single_pass_read_error_leaves_no_partial_entry(tmp_path: Path, monkeypatch):
+    import Verifier
+
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(4):
+        (ev / f"f{i}.txt").write_text(f"single pass {i}\n" * 20, encoding="utf-8")
+    cfg = dict(_base_config(), single_pass_archive=True, max_file_size_bytes=1000)
+    assert Surveyor.run(cfg, base) is True
+
+    real = HasherPacker.iter_file_chunks
+
+    def failing(path, *args, **kwargs):
+        # f2.txt fails after its first chunk was already written to the entry.
+        for n, chunk in enumerate(real(path, *args, **kwargs)):
+            if path.name == "f2.txt" and n == 1:
+                raise OSError("injected read error")
+            yield chunk
+
+    monkeypatch.setattr(HasherPacker, "iter_file_chunks", failing)
+    assert HasherPacker.run(dict(cfg, hash_buffer_bytes=64), base) is True
+    content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+    errors = [Path(r["path"]).name for r in content["files"] if r.get("error")]
+    assert errors == ["f2.txt"]
+    with zipfile.ZipFile(content["zip_path"]) as z:
+        assert z.testzip() is None
+        assert sorted(Path(n).name for n in z.namelist()) == ["f0.txt", "f1.txt", "f3.txt"]
+    assert Scribe.run(cfg, base) is True
+    assert Verifier.run(cfg, base) is True
+    assert common.read_json(base / "bus" / "40_verification_result.json")["content"]["extra"] == []
+
+
+def test_failed_cached_copy_is_rewritten_once(tmp_path: Path, monkeypatch):
+    from archive import EvidenceArchive, PreviousArchives
+
+    cfg = dict(_base_config(), hash_cache=True)
+    base = tmp_path
+    ev = base / "evidence"
+    ev.mkdir()
+    for i in range(3):
+        (ev / f"c{i}.txt").write_text(f"cached {i} " * 8, encoding="utf-8")
+    assert Surveyor.run(cfg, base) is True
+    assert HasherPacker.run(cfg, base) is True
+
+    real = PreviousArchives.raw_entry
+
+    def broken(self, zip_name, arcname, *args, **kwargs):
+        # c1.txt: the previous archive breaks off after the first bytes of the entry were copied.
+        zinfo, chunks = real(self, zip_name, arcname, *args, **kwargs)
+        if not arcname.endswith("c1.txt"):
+            return zinfo, chunks
+
+        def cut():
+            yield next(chunks)[:5]
+            raise zipfile.BadZipFile("truncated entry")
+
+        return zinfo, cut()
+
+    monkeypatch.setattr(PreviousArchives, "raw_entry", broken)
+    assert HasherPacker.run(cfg, base) is True
+    content = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+    assert {Path(r["path"]).name for r in content["files"] if r.get("from_cache")} == {"c0.txt", "c2.txt"}
+    with zipfile.ZipFile(content["zip_path"]) as z:
+        names = z.namelist()
+        assert len(names) == len(set(names)) == 3
+        assert z.testzip() is None
+        for r in content["files"]:
+            assert hashlib.sha256(z.read(r["arcname"])).hexdigest() == r["sha256"]
+
+    with EvidenceArchive(base / "output", "DUP") as archive:
+        archive.write_file(ev / "c0.txt", "same/name.txt")
+        try:
+            archive.write_file(ev / "c1.txt", "same/name.txt")
+            raise AssertionError("duplicate arcname accepted")
+        except ValueError:
+            pass
+    with zipfile.ZipFile(archive.zip_path) as z:
+        assert z.namelist() == ["same/name.txt"]
+
+
+def test_resume_rewrites_shards_that_do_not_match_checkpoint(tmp_path: Path):
+    import shutil
+
+    for damage in ("open", "closed"):
+        base = tmp_path / damage
+        ev = base / "evidence"
+        ev.mkdir(parents=True)
+        for i in range(30):
+            (ev / f"f{i}.txt").write_text(f"resume file {i} " * 4, encoding="utf-8")
+        cfg = dict(_base_config(), archive_shard_max_entries=4)
+        assert Surveyor.run(cfg, base) is True
+        assert HasherPacker.run(cfg, base) is True
+        expected = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        expected_zips = [Path(s["zip_path"]).read_bytes() for s in expected["shards"]]
+
+        shutil.rmtree(base / "output")
+        cfg["checkpoint_every_files"] = 2
+        discovery = common.read_json(base / "bus" / "10_discovery_report.json")["content"]["files"]
+
+        def interrupted():
+            for k, it in enumerate(discovery):
+                if k == 19:
+                    raise OSError("share disconnected")
+                yield it
+
+        try:
+            HasherPacker.pack(cfg, base, interrupted())
+        except OSError:
+            pass
+        state = common.read_json(base / "bus" / "20_hash_checkpoint.json")
+        assert state["archive"]["end"] and len(state["archive"]["shards"]) > 2
+
+        # Flip one byte in the data of the open shard's last entry, or of a closed shard's last entry.
+        shard = state["archive"]["shards"][-1 if damage == "open" else 1]
+        path = Path(shard["zip_path"])
+        data = bytearray(path.read_bytes())
+        at = state["archive"]["end"] - 3 if damage == "open" else data.rfind(b"PK\x01\x02", 0, data.find(b"PK\x05\x06")) - 3
+        data[at] ^= 0xFF
+        path.write_bytes(bytes(data))
+
+        cfg["resume"] = True
+        assert HasherPacker.run(cfg, base) is True
+        resumed = common.read_json(base / "bus" / "20_hash_result.json")["content"]
+        assert resumed == expected
+        assert [Path(s["zip_path"]).read_bytes() for s in resumed["shards"]] == expected_zips
+        log = [json.loads(line) for line in (base / "output" / "runlog_UT_CASE.jsonl").read_text(encoding="utf-8").splitlines()]
+        rewound = log[-1]["details"]["resume_rewound"]
+        assert rewound["shard"] == path.name
+        assert rewound["kept_entries"] == (4 * (len(state["archive"]["shards"]) - 1) if damage == "open" else 4)
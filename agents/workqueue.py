@@ -0,0 +1,217 @@
+# workqueue.py (DFABS v0.4)
+#
+# ROLE
+# - Lease-based work queue on the file bus, so several independent HasherPacker processes (and later
+#   hosts sharing the filesystem) can hash one case. No new services: plain files and atomic operations.
+#
+# Layout (bus/queue/):
+#   manifest.json           case_id, number of shards
+#   shard_0001.jsonl        discovery records of one work shard (split by Coordinator)
+#   shard_0001.lease.<gen>  lease of the worker processing attempt <gen> (O_EXCL create, mtime = heartbeat)
+#   shard_0001.g<gen>/      bus of that attempt (20_hash_result.json), archive evidence_<case>-q0001-g<gen>.zip
+#   shard_0001.done.json    completion marker: which attempt's result counts (first finisher wins)
+#
+# Design notes:
+# - Claim = O_EXCL create of lease generation 1. A lease whose heartbeat is older than lease_timeout
+#   belongs to a dead worker; it is reclaimed by O_EXCL-creating generation <gen>+1. Two workers
+#   reclaiming at once race on the same file name, so exactly one wins, and nothing is ever renamed
+#   over somebody else's lease.
+# - Each attempt writes into its own namespace, so a slow worker that lost its lease can never corrupt
+#   the archive of the worker that took over. The done marker is created with link() (fails if it
+#   exists); a late finisher sees that and removes its own output.
+# - Heartbeat: a background thread touches the lease; if a newer generation appears the worker has
+#   lost the shard and its result is discarded.
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from common import RecordSink, ensure_dir, iter_records, read_json, read_message, write_json
+
+QUEUE_DIR = "queue"
+
+
+def queue_dir(bus: Path) -> Path:
+    return bus / QUEUE_DIR
+
+
+def shard_name(index: int) -> str:
+    return f"shard_{index + 1:04d}"
+
+
+def split(bus: Path, case_id: str, records, shard_files: int) -> int:
+    # Splits discovery records into work shards (in discovery order). Returns the number of shards.
+    q = queue_dir(bus)
+    if q.exists():
+        shutil.rmtree(q)
+    ensure_dir(q)
+    shards = 0
+    f = None
+    n = 0
+    for r in records:
+        if f is None or n >= shard_files:
+            if f is not None:
+                f.close()
+            f = (q / f"{shard_name(shards)}.jsonl").open("w", encoding="utf-8")
+            shards += 1
+            n = 0
+        f.write(json.dumps(r) + "\n")
+        n += 1
+    if f is not None:
+        f.close()
+    write_json(q / "manifest.json", {"case_id": case_id, "shards": shards, "shard_files": shard_files})
+    return shards
+
+
+def _lease_gens(q: Path, name: str) -> list:
+    gens = []
+    for p in q.glob(f"{name}.lease.*"):
+        suffix = p.name.rsplit(".", 1)[1]
+        if suffix.isdigit():
+            gens.append(int(suffix))
+    return sorted(gens)
+
+
+def _create_exclusive(path: Path, payload: dict) -> bool:
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    return True
+
+
+class Lease:
+    def __init__(self, q: Path, name: str, gen: int, worker_id: str, heartbeat_seconds: float):
+        self.q = q
+        self.name = name
+        self.gen = gen
+        self.worker_id = worker_id
+        self.path = q / f"{name}.lease.{gen}"
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(heartbeat_seconds,), name=f"lease-{name}", daemon=True)
+        self._thread.start()
+
+    def _beat(self, every: float):
+        while not self._stop.wait(every):
+            if _lease_gens(self.q, self.name)[-1:] != [self.gen]:
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if _lease_gens(self.q, self.name)[-1:] != [self.gen]:
+            self.lost = True
+
+
+def claim(q: Path, name: str, worker_id: str, lease_timeout: float, heartbeat_seconds: float):
+    # Returns a Lease, or None when the shard is done or held by a live worker.
+    if (q / f"{name}.done.json").exists():
+        return None
+    gens = _lease_gens(q, name)
+    if gens:
+        try:
+            age = time.time() - (q / f"{name}.lease.{gens[-1]}").stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if age < lease_timeout:
+            return None
+    gen = gens[-1] + 1 if gens else 1
+    payload = {"worker": worker_id, "host": socket.gethostname(), "pid": os.getpid(), "claimed_at": time.time(), "reclaimed": bool(gens)}
+    if not _create_exclusive(q / f"{name}.lease.{gen}", payload):
+        return None
+    return Lease(q, name, gen, worker_id, heartbeat_seconds)
+
+
+def attempt_config(config: dict, name: str, gen: int) -> dict:
+    # Namespace of one attempt: its own bus folder and archive (evidence_<case_id>-<queue_attempt>.zip).
+    # case_id stays the case's, so the attempt logs to the case runlog, tagged with queue_attempt.
+    index = name.split("_")[1]
+    return {
+        **config,
+        "queue_attempt": f"q{index}-g{gen}",
+        "bus_dir": str(Path(config["bus_dir"]) / QUEUE_DIR / f"{name}.g{gen}"),
+        # Per-attempt namespaces would make cache/checkpoint files single-use, keep them off.
+        "hash_cache": False,
+        "checkpoint_every_files": 0,
+        "checkpoint_every_seconds": 0,
+    }
+
+
+def complete(q: Path, lease: Lease, ok: bool) -> bool:
+    # Publishes the attempt's result unless another attempt already did. Returns True if it counted.
+    done = q / f"{lease.name}.done.json"
+    tmp = q / f"{lease.name}.done.{lease.gen}.tmp"
+    write_json(tmp, {"gen": lease.gen, "worker": lease.worker_id, "ok": ok, "result": f"{lease.name}.g{lease.gen}/20_hash_result.json"})
+    try:
+        os.link(tmp, done)
+        won = True
+    except FileExistsError:
+        won = False
+    tmp.unlink()
+    return won
+
+
+def discard_attempt(base_dir: Path, config: dict, lease: Lease):
+    # Output of an attempt whose result does not count (lease lost or another attempt finished first).
+    cfg = attempt_config(config, lease.name, lease.gen)
+    out = base_dir / cfg["output_dir"]
+    archive_id = f"{cfg['case_id']}-{cfg['queue_attempt']}"
+    for p in list(out.glob(f"evidence_{archive_id}.zip")) + list(out.glob(f"evidence_{archive_id}_part*.zip")):
+        p.unlink()
+    shutil.rmtree(base_dir / cfg["bus_dir"], ignore_errors=True)
+
+
+def pending(q: Path, shards: int) -> list:
+    return [shard_name(i) for i in range(shards) if not (q / f"{shard_name(i)}.done.json").exists()]
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def merge(bus: Path, fmt: str = "json"):
+    # Concatenates the per-shard HashResults in shard (= discovery) order.
+    # Returns (content, shard stats) or raises ValueError if a shard is missing or failed.
+    q = queue_dir(bus)
+    manifest = read_json(q / "manifest.json")
+    sink = RecordSink(bus, "20_hash_result.json", "files", fmt)
+    merged = {"shards": []}
+    stats = []
+    for i in range(manifest["shards"]):
+        name = shard_name(i)
+        done_path = q / f"{name}.done.json"
+        if not done_path.exists():
+            raise ValueError(f"work shard {name} not completed")
+        done = read_json(done_path)
+        if not done["ok"]:
+            raise ValueError(f"work shard {name} failed (worker {done['worker']})")
+        result_path = q / done["result"]
+        content = read_message(result_path)["content"]
+        offset = len(merged["shards"])
+        for r in iter_records(result_path.parent, content, "files"):
+            if "arcname" in r:
+                r["shard"] = offset + r.get("shard", 0)
+            sink.append(r)
+        merged["shards"].extend(content["shards"])
+        for key in ("single_pass", "archive_mode", "hash_algorithms", "dedup", "merkle_chunk_bytes", "known_sets"):
+            merged.setdefault(key, content.get(key))
+        stats.append({"shard": name, "gen": done["gen"], "worker": done["worker"]})
+
+    merged["files"] = sink.value()
+    merged["zip_path"] = merged["shards"][0]["zip_path"] if merged["shards"] else None
+    merged["work_shards"] = len(stats)
+    return merged, stats